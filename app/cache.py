@@ -0,0 +1,42 @@
+import threading
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    # Small thread-safe LRU cache whose entries expire after ttl seconds
+    def __init__(self, maxsize: int = 1024, ttl: float = 60, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.data = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key, default=None):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return default
+            if item[0] <= self.clock():
+                del self.data[key]
+                return default
+            self.data.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value, ttl: float = None):
+        with self.lock:
+            self.data[key] = (self.clock() + (self.ttl if ttl is None else ttl), value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            item = self.data.pop(key, None)
+        return default if item is None or item[0] <= self.clock() else item[1]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+from .metrics import CIRCUIT_STATE, PUSHOVER_QUOTA_LIMIT, PUSHOVER_QUOTA_REMAINING
+
+# Consecutive failures (429, 5xx, transport errors) that open a config's breaker
+BREAKER_FAILURES = int(os.getenv("PUSHGATE_BREAKER_FAILURES", "5"))
+# Seconds an open breaker waits before letting a probe through; doubles after each failed probe
+BREAKER_COOLDOWN = float(os.getenv("PUSHGATE_BREAKER_COOLDOWN", "30"))
+BREAKER_COOLDOWN_MAX = float(os.getenv("PUSHGATE_BREAKER_COOLDOWN_MAX", "600"))
+# Stop sending through a config when its monthly quota is down to this many messages
+QUOTA_RESERVE = int(os.getenv("PUSHGATE_QUOTA_RESERVE", "0"))
+# What /send does while the breaker is open: "fail" (503 with Retry-After) or "queue" (202, delivered later)
+BREAKER_OPEN_ACTION = os.getenv("PUSHGATE_BREAKER_OPEN_ACTION", "fail").lower()
+
+STATUS_CIRCUIT_OPEN = "circuit_open"
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+def _header_int(headers, name):
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+class CircuitBreaker:
+    # closed -> open after BREAKER_FAILURES failures in a row, or when the quota reported in the
+    # X-Limit-App-* headers is used up (then open until the reset time). Once the wait is over,
+    # one request at a time goes through as a probe (half open); success closes the breaker,
+    # failure opens it again for twice as long.
+    def __init__(self, config_id, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN,
+                 cooldown_max: float = BREAKER_COOLDOWN_MAX, reserve: int = QUOTA_RESERVE, clock=time.time):
+        self.config_id = config_id
+        self.max_failures = failures
+        self.base_cooldown = cooldown
+        self.cooldown_max = cooldown_max
+        self.reserve = reserve
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.cooldown = cooldown
+        self.retry_at = None  # epoch seconds when an open breaker lets a probe through
+        self.probing = False
+        self.quota_limit = None
+        self.quota_remaining = None
+        self.quota_reset = None  # epoch seconds, from X-Limit-App-Reset
+        self.last_status = None
+
+    def allow(self) -> bool:
+        # True if a request may go out now; in half-open state only one probe at a time
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.clock() < self.retry_at:
+                return False
+            if self.probing:
+                return False
+            self._set_state(HALF_OPEN)
+            self.probing = True
+            return True
+
+    def retry_after(self) -> float:
+        # Seconds until an open breaker will let a request through (0 if it would now)
+        with self.lock:
+            if self.state == CLOSED or self.retry_at is None:
+                return 0
+            return max(0, self.retry_at - self.clock())
+
+    def record(self, status_code, headers=None):
+        with self.lock:
+            self.last_status = status_code
+            self.probing = False
+            if headers is not None:
+                self._record_quota(headers)
+            now = self.clock()
+            failed = status_code == "error" or status_code == 429 or (isinstance(status_code, int) and status_code >= 500)
+            exhausted = self.quota_remaining is not None and self.quota_remaining <= self.reserve
+            if exhausted and self.quota_reset and self.quota_reset > now:
+                self._open(self.quota_reset)
+            elif failed:
+                self.failures += 1
+                if self.state == HALF_OPEN:
+                    self.cooldown = min(self.cooldown * 2, self.cooldown_max)
+                    self._open(now + self.cooldown)
+                elif self.failures >= self.max_failures:
+                    self._open(now + self.cooldown)
+            else:
+                self.failures = 0
+                self.cooldown = self.base_cooldown
+                self.retry_at = None
+                self._set_state(CLOSED)
+
+    def abandon(self):
+        # The request allowed by allow() never completed (e.g. cancelled); free the probe slot
+        with self.lock:
+            self.probing = False
+
+    def _record_quota(self, headers):
+        limit = _header_int(headers, "X-Limit-App-Limit")
+        remaining = _header_int(headers, "X-Limit-App-Remaining")
+        reset = _header_int(headers, "X-Limit-App-Reset")
+        if remaining is None:
+            return
+        self.quota_limit, self.quota_remaining, self.quota_reset = limit, remaining, reset
+        label = str(self.config_id)
+        PUSHOVER_QUOTA_REMAINING.labels(label).set(remaining)
+        if limit is not None:
+            PUSHOVER_QUOTA_LIMIT.labels(label).set(limit)
+
+    def _open(self, until: float):
+        self.retry_at = until
+        self._set_state(OPEN)
+
+    def _set_state(self, state: str):
+        self.state = state
+        CIRCUIT_STATE.labels(str(self.config_id)).set(_STATE_VALUES[state])
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "config_id": self.config_id,
+                "state": self.state,
+                "failures": self.failures,
+                "retry_after": max(0, self.retry_at - self.clock()) if self.retry_at and self.state != CLOSED else 0,
+                "last_status": self.last_status,
+                "quota_limit": self.quota_limit,
+                "quota_remaining": self.quota_remaining,
+                "quota_reset": self.quota_reset,
+            }
+
+class Breakers:
+    # One breaker per PushoverConfig id, created on first use
+    def __init__(self, factory=CircuitBreaker):
+        self.factory = factory
+        self.lock = threading.Lock()
+        self.breakers = {}
+
+    def get(self, config_id) -> CircuitBreaker:
+        breaker = self.breakers.get(config_id)
+        if breaker is None:
+            with self.lock:
+                breaker = self.breakers.setdefault(config_id, self.factory(config_id))
+        return breaker
+
+    def snapshot(self):
+        return {config_id: b.snapshot() for config_id, b in list(self.breakers.items())}
+
+    def clear(self):
+        with self.lock:
+            self.breakers = {}
+
+breakers = Breakers()
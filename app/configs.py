@@ -0,0 +1,139 @@
+import logging
+import os
+import time
+from sqlalchemy.orm import Session
+from .crypto import decrypt
+from .models import DeliveryGroup, DeliveryGroupMember, PushoverConfig
+from .shared_state import DatabaseGenerations, GenerationWatcher, bump_generation
+
+logger = logging.getLogger(__name__)
+
+# Kept in the shared_generations table whatever PUSHGATE_STATE_BACKEND is: a worker that missed an
+# edit would go on sending with old or deleted credentials, so this one is never process-local
+GENERATION = "configs"
+# An id or group name missing from the cache reloads it at most this often; other changes come
+# through the generation
+CONFIG_MISS_RELOAD_SECONDS = float(os.getenv("PUSHGATE_CONFIG_MISS_RELOAD_SECONDS", "5"))
+
+class CachedConfig:
+    # Decrypted copy of a PushoverConfig row; what the send path works with
+    __slots__ = ("id", "name", "app_token", "user_key", "is_default")
+
+    def __init__(self, id, name, app_token, user_key, is_default=False):
+        self.id = id
+        self.name = name
+        self.app_token = app_token
+        self.user_key = user_key
+        self.is_default = is_default
+
+class CachedGroup:
+    # A delivery group with the ids of its member configs, in id order
+    __slots__ = ("id", "name", "config_ids")
+
+    def __init__(self, id, name, config_ids):
+        self.id = id
+        self.name = name
+        self.config_ids = config_ids
+
+def credentials(config):
+    # (app token, user key) of a CachedConfig, or of a PushoverConfig row (decrypted on the spot)
+    if isinstance(config, CachedConfig):
+        if config.app_token is None:
+            raise Exception(f"Pushover config {config.id} could not be decrypted with the current key")
+        return config.app_token, config.user_key
+    return decrypt(config.encrypted_app_token), decrypt(config.encrypted_user_key)
+
+class ConfigCache:
+    # Every Pushover config, decrypted once and kept in memory, so a send costs no query and no
+    # Fernet decryption. The admin handlers call changed() after editing configs: that drops
+    # this process's copy and bumps the "configs" generation in the database, which other workers
+    # check at most every PUSHGATE_STATE_CHECK_INTERVAL seconds. An id that is not in the cache
+    # triggers a reload, but only if the last load is at least miss_reload seconds old, so a
+    # client sending a bad id does not make every request re-read and decrypt all configs.
+    # Delivery groups are cached the same way, so a group send costs no query either.
+    def __init__(self, watcher: GenerationWatcher = None, miss_reload: float = CONFIG_MISS_RELOAD_SECONDS, clock=time.monotonic):
+        self.watcher = watcher or GenerationWatcher(GENERATION, store=DatabaseGenerations())
+        self.miss_reload = miss_reload
+        self.clock = clock
+        self.state = None  # ({id: CachedConfig}, default id, {id: CachedGroup}), replaced whole so readers need no lock
+        self.loaded_at = None
+
+    def _load(self, db: Session):
+        configs = {}
+        default_id = None
+        for row in db.query(PushoverConfig).order_by(PushoverConfig.id):
+            try:
+                app_token, user_key = credentials(row)
+            except Exception:
+                # Only sends through this config fail (in credentials()), not the whole cache
+                logger.exception("Could not decrypt Pushover config %s", row.id)
+                app_token = user_key = None
+            configs[row.id] = CachedConfig(row.id, row.name, app_token, user_key, is_default=bool(row.is_default))
+            if row.is_default and default_id is None:
+                default_id = row.id
+        if default_id is None and configs:
+            # No default chosen: the oldest config, as before there was a setting
+            default_id = next(iter(configs))
+        groups = {g.id: CachedGroup(g.id, g.name, []) for g in db.query(DeliveryGroup).order_by(DeliveryGroup.id)}
+        for member in db.query(DeliveryGroupMember).order_by(DeliveryGroupMember.group_id, DeliveryGroupMember.config_id):
+            if member.group_id in groups and member.config_id in configs:
+                groups[member.group_id].config_ids.append(member.config_id)
+        self.state = (configs, default_id, groups)
+        self.loaded_at = self.clock()
+        return self.state
+
+    def _reload_for_miss(self, db: Session):
+        # The reloaded state, or None when the current one is too recent to be worth replacing
+        if self.loaded_at is not None and self.clock() - self.loaded_at < self.miss_reload:
+            return None
+        return self._load(db)
+
+    def _current(self, db: Session):
+        # Check the generation first, even before the first load, so the watcher starts from
+        # the value seen before loading and a bump made during the load is not missed
+        changed = self.watcher.changed()
+        state = self.state
+        if state is None or changed:
+            state = self._load(db)
+        return state
+
+    def get(self, db: Session, config_id: int = None):
+        # The config with this id (None if there is none), or the default config
+        configs, default_id, _ = self._current(db)
+        if config_id is None:
+            return configs.get(default_id)
+        config = configs.get(config_id)
+        if config is None:
+            state = self._reload_for_miss(db)
+            config = state[0].get(config_id) if state else None
+        return config
+
+    def group(self, db: Session, ref):
+        # The delivery group with this id ("3" works too) or name; None if there is none
+        def find(groups):
+            if isinstance(ref, int) or str(ref).isdigit():
+                return groups.get(int(ref))
+            return next((g for g in groups.values() if g.name == ref), None)
+        group = find(self._current(db)[2])
+        if group is None:
+            state = self._reload_for_miss(db)
+            group = find(state[2]) if state else None
+        return group
+
+    def groups(self, db: Session):
+        return list(self._current(db)[2].values())
+
+    def all(self, db: Session):
+        return list(self._current(db)[0].values())
+
+    def invalidate(self):
+        self.state = None
+
+    def changed(self):
+        self.invalidate()
+        if self.watcher.store is not None:
+            self.watcher.store.bump(GENERATION)
+        else:
+            bump_generation(GENERATION)
+
+config_cache = ConfigCache()
@@ -1,5 +1,9 @@
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet
+import hashlib
+import hmac
 import os
+import threading
+import time
 
 # Improved Fernet key file resolution for all environments
 
@@ -22,12 +26,68 @@ def _find_fernet_key_file():
 
 FERNET_KEY_FILE = _find_fernet_key_file()
 
-def get_fernet():
+# How often (seconds) the key file is stat()ed for changes; 0 checks on every call
+FERNET_KEY_CHECK_INTERVAL = float(os.environ.get("FERNET_KEY_CHECK_INTERVAL", "1.0"))
+
+class _KeyRing:
+    # Keys parsed from the key file, newest (primary) first, plus the cipher built from them
+    def __init__(self, keys, stamp):
+        self.keys = keys
+        self.stamp = stamp
+        self.fernet = MultiFernet([Fernet(k) for k in keys])
+        self.index_keys = [_index_key(k) for k in keys]
+        self.checked_at = time.monotonic()
+
+_key_ring = None
+_key_ring_lock = threading.Lock()
+
+def _read_keys():
+    # One key per line; the first line encrypts, any further lines are older keys still accepted for decryption
     if not FERNET_KEY_FILE or not os.path.exists(FERNET_KEY_FILE) or os.path.getsize(FERNET_KEY_FILE) == 0:
         raise Exception(f"Fernet key not found or empty (checked: $FERNET_KEY_FILE, ./secrets/fernet_key, /run/secrets/fernet_key)")
     with open(FERNET_KEY_FILE, "rb") as f:
-        key = f.read().strip()
-    return Fernet(key)
+        keys = [line.strip() for line in f.read().splitlines()]
+    keys = [k for k in keys if k and not k.startswith(b"#")]
+    if not keys:
+        raise Exception(f"Fernet key file {FERNET_KEY_FILE} contains no keys")
+    return keys
+
+# Optional callable returning the shared "fernet_keys" generation; app.shared_state sets it
+# in multi-process mode so a rotation reaches every worker even if the file stamp looks unchanged
+key_generation_source = None
+
+def _key_file_stamp():
+    try:
+        st = os.stat(FERNET_KEY_FILE)
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+    except (TypeError, OSError):
+        stamp = None
+    source = key_generation_source
+    return stamp if source is None else (stamp, source())
+
+def get_key_ring() -> _KeyRing:
+    # Cached per process; the key file is re-read only when its inode, mtime or size (or the shared generation) changes
+    global _key_ring
+    ring = _key_ring
+    if ring is not None and time.monotonic() - ring.checked_at < FERNET_KEY_CHECK_INTERVAL:
+        return ring
+    with _key_ring_lock:
+        ring = _key_ring
+        stamp = _key_file_stamp()
+        if ring is not None and stamp == ring.stamp:
+            ring.checked_at = time.monotonic()
+            return ring
+        _key_ring = _KeyRing(_read_keys(), stamp)
+        return _key_ring
+
+def reload_keys():
+    # Drop the cached key ring so the next call re-reads the key file
+    global _key_ring
+    with _key_ring_lock:
+        _key_ring = None
+
+def get_fernet():
+    return get_key_ring().fernet
 
 def encrypt(data: str) -> str:
     f = get_fernet()
@@ -36,3 +96,19 @@ def encrypt(data: str) -> str:
 def decrypt(token: str) -> str:
     f = get_fernet()
     return f.decrypt(token.encode()).decode()
+
+# Keyed digest used to look tokens up by index instead of decrypting every row.
+# The HMAC key is derived from the Fernet key, so the digest is useless without it.
+def _index_key(key: bytes) -> bytes:
+    return hashlib.sha256(b"pushgate-token-index:" + key).digest()
+
+def token_digest_for_key(key: bytes, token: str) -> str:
+    return hmac.new(_index_key(key), token.encode(), hashlib.sha256).hexdigest()
+
+def token_digest(token: str) -> str:
+    # Digest under the primary key; this is what gets stored
+    return hmac.new(get_key_ring().index_keys[0], token.encode(), hashlib.sha256).hexdigest()
+
+def token_digests(token: str) -> list:
+    # Digests under every key in the ring, so tokens stored before a key rotation still match
+    return [hmac.new(k, token.encode(), hashlib.sha256).hexdigest() for k in get_key_ring().index_keys]
@@ -1,10 +1,78 @@
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
 import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; only one process sets up the schema there anyway
+    fcntl = None
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./pushgate.db")
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# Optional separate URL for read-only traffic (e.g. a replica); defaults to the main database
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL", DATABASE_URL)
+
+# "tuned" applies the SQLite pragmas below on every new connection; "default" leaves SQLite's defaults
+DB_PROFILE = os.getenv("PUSHGATE_DB_PROFILE", "tuned").lower()
+SQLITE_PRAGMAS = {
+    # Only takes effect on a new database (must come before journal_mode); lets the retention job
+    # return freed pages with PRAGMA incremental_vacuum. Existing files need one VACUUM to switch.
+    "auto_vacuum": os.getenv("SQLITE_AUTO_VACUUM", "INCREMENTAL"),
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),  # readers and the writer stop blocking each other
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),  # with WAL: durable across app crashes, fsync at checkpoints
+    "busy_timeout": os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"),  # wait for the write lock instead of "database is locked"
+    "cache_size": os.getenv("SQLITE_CACHE_SIZE", "-65536"),  # negative = KiB, so 64 MiB per connection
+    "mmap_size": os.getenv("SQLITE_MMAP_SIZE", "268435456"),  # 256 MiB of the file read via mmap
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "5"))
+# Held while a process creates tables and applies migrations, so uvicorn workers starting together
+# take turns. Defaults to "<database file>.schema-lock" for SQLite, else a file in the temp directory.
+SCHEMA_LOCK_FILE = os.getenv("PUSHGATE_SCHEMA_LOCK_FILE", "")
+
+def _is_sqlite(url: str):
+    return url.startswith("sqlite")
+
+def _is_memory(url: str):
+    return url in ("sqlite://", "sqlite:///:memory:")
+
+def _apply_sqlite_pragmas(engine, read_only: bool = False):
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_conn, _record):
+        cursor = dbapi_conn.cursor()
+        if DB_PROFILE == "tuned":
+            for name, value in SQLITE_PRAGMAS.items():
+                if value:
+                    cursor.execute(f"PRAGMA {name} = {value}")
+        if read_only:
+            cursor.execute("PRAGMA query_only = ON")
+        cursor.close()
+
+def _create_engine(url: str, pool_size: int, read_only: bool = False):
+    kwargs = {}
+    if _is_sqlite(url):
+        kwargs["connect_args"] = {"check_same_thread": False}
+    if not _is_memory(url):
+        kwargs.update(pool_size=pool_size, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT, pool_pre_ping=not _is_sqlite(url))
+    eng = create_engine(url, **kwargs)
+    if _is_sqlite(url):
+        _apply_sqlite_pragmas(eng, read_only=read_only)
+    return eng
+
+engine = _create_engine(DATABASE_URL, DB_POOL_SIZE)
+# Admin pages and other read-only requests use their own pool, so they never hold (or wait for)
+# a connection the send path needs. On SQLite these connections are query_only.
+if _is_memory(DATABASE_URL):
+    read_engine = engine
+else:
+    read_engine = _create_engine(DATABASE_READ_URL, DB_READ_POOL_SIZE, read_only=_is_sqlite(DATABASE_READ_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 Base = declarative_base()
 
 def get_db():
@@ -14,6 +82,38 @@ def get_db():
     finally:
         db.close()
 
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def _schema_lock_path(url: str):
+    if SCHEMA_LOCK_FILE:
+        return SCHEMA_LOCK_FILE
+    if _is_sqlite(url) and not _is_memory(url):
+        return os.path.abspath(make_url(url).database) + ".schema-lock"
+    return os.path.join(tempfile.gettempdir(), "pushgate-schema.lock")
+
+@contextmanager
+def schema_lock(url: str = DATABASE_URL):
+    # Exclusive lock across the processes of this host: each worker runs init_db() at startup, and
+    # without it two of them creating the same table at once fail with "table already exists"
+    if fcntl is None or _is_memory(url):
+        yield
+        return
+    with open(_schema_lock_path(url), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
 def init_db():
     from . import models
-    Base.metadata.create_all(bind=engine)
+    from .migrations import migrate
+    with schema_lock():
+        Base.metadata.create_all(bind=engine)
+        # create_all does not alter existing tables; versioned migrations bring older databases up to date
+        migrate(engine)
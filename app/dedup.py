@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+from starlette.concurrency import run_in_threadpool
+from .cache import TTLCache
+from .db import SessionLocal
+from .metrics import DEDUP_SUPPRESSED
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+# Open dedup windows kept per process; the least recently used are evicted beyond this
+DEDUP_CACHE_SIZE = int(os.getenv("PUSHGATE_DEDUP_CACHE_SIZE", "10000"))
+DEDUP_MODES = ("drop", "collapse")
+
+class DedupWindow:
+    # One message that went out, plus the identical copies suppressed after it
+    __slots__ = ("key", "token_id", "config_id", "message", "priority", "mode", "seconds", "message_id", "suppressed", "closed")
+
+    def __init__(self, key, token_id, config_id, message, mode, seconds, priority=0):
+        self.key = key
+        self.token_id = token_id
+        self.config_id = config_id
+        self.message = message
+        self.priority = priority
+        self.mode = mode
+        self.seconds = seconds
+        self.message_id = None
+        self.suppressed = 0
+        self.closed = False
+
+def collapsed_text(message: str, count: int) -> str:
+    # "<message> (repeated xN)", trimmed so the result still fits Pushover's 1024 bytes
+    suffix = f" (repeated x{count})"
+    budget = 1024 - len(suffix.encode("utf-8"))
+    body = message.encode("utf-8")[:budget].decode("utf-8", "ignore")
+    return body + suffix
+
+def _record_suppressed(message_id: int, count: int):
+    db = SessionLocal()
+    try:
+        db.query(Message).filter(Message.id == message_id).update(
+            {Message.suppressed_count: Message.suppressed_count + count}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+class Deduplicator:
+    # Per-token dedup windows in a bounded TTL cache keyed by a hash of (token, config, priority, text),
+    # so a copy sent at a higher priority (an escalation) is never dropped for a lower-priority one.
+    # The first copy opens a window and is sent as usual; copies inside the window are counted
+    # and dropped before rate limiting. When the window closes, the count is written to the first
+    # copy's Message.suppressed_count, and in "collapse" mode one "(repeated xN)" message is sent.
+    # State is per process, so with several workers each one deduplicates on its own.
+    def __init__(self, maxsize: int = DEDUP_CACHE_SIZE, clock=time.monotonic):
+        self.cache = TTLCache(maxsize=maxsize, ttl=60, clock=clock)
+        self.lock = threading.Lock()
+        self.on_collapse = None  # async callable(window) sending the summary; set by the app
+        self.pending = set()  # windows whose close is scheduled, flushed on shutdown
+
+    @staticmethod
+    def key(token_id: int, config_id, message: str, priority: int = 0):
+        return hashlib.sha256(f"{token_id}\0{config_id}\0{priority}\0{message}".encode()).digest()
+
+    def check(self, token, config_id, message: str, priority: int = 0):
+        # Returns (window, duplicate). window is None when the token has dedup off.
+        seconds = token.dedup_window_seconds
+        if not seconds:
+            return None, False
+        key = self.key(token.id, config_id, message, priority)
+        with self.lock:
+            window = self.cache.get(key)
+            if window is not None and not window.closed:
+                window.suppressed += 1
+                DEDUP_SUPPRESSED.inc()
+                return window, True
+            window = DedupWindow(key, token.id, config_id, message, token.dedup_mode or "drop", seconds, priority)
+            self.cache.set(key, window, ttl=seconds)
+            return window, False
+
+    def discard(self, window: DedupWindow):
+        # The first copy was not delivered; let the next copy through instead of suppressing it
+        with self.lock:
+            if self.cache.get(window.key) is window:
+                self.cache.pop(window.key)
+        window.closed = True
+
+    def opened(self, window: DedupWindow, message_id):
+        # The first copy is logged; close the window after its length (needs a running event loop)
+        window.message_id = message_id
+        self.pending.add(window)
+        asyncio.get_running_loop().call_later(window.seconds, lambda: asyncio.ensure_future(self.close(window)))
+
+    async def close(self, window: DedupWindow):
+        with self.lock:
+            if window.closed:
+                return
+            window.closed = True
+            if self.cache.get(window.key) is window:
+                self.cache.pop(window.key)
+        self.pending.discard(window)
+        if not window.suppressed:
+            return
+        try:
+            if window.message_id is not None:
+                await run_in_threadpool(_record_suppressed, window.message_id, window.suppressed)
+            if window.mode == "collapse" and self.on_collapse is not None:
+                await self.on_collapse(window)
+        except Exception:
+            logger.exception("Failed to close dedup window for token %s", window.token_id)
+
+    def flush(self):
+        # On shutdown: record the counts of windows still open (no collapse messages are sent)
+        for window in list(self.pending):
+            window.closed = True
+            if window.suppressed and window.message_id is not None:
+                try:
+                    _record_suppressed(window.message_id, window.suppressed)
+                except Exception:
+                    logger.exception("Failed to record suppressed count for message %s", window.message_id)
+        self.pending.clear()
+
+deduplicator = Deduplicator()
@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import os
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session, joinedload
+from starlette.concurrency import run_in_threadpool
+from .db import SessionLocal
+from .models import Message, OutboundQueue, Token
+from .pushover import get_pushover_config, deliver_timed
+from .usage import record_usage
+from .circuit import breakers, STATUS_CIRCUIT_OPEN
+from .groups import DELIVERY_QUEUED, deliver_to_targets, pending_config_ids, record_deliveries, settle_held
+
+logger = logging.getLogger(__name__)
+
+# "direct" sends inside the /send request; "queued" accepts with 202 and delivers in the background
+DELIVERY_MODE = os.getenv("PUSHGATE_DELIVERY_MODE", "direct").lower()
+QUEUE_WORKERS = int(os.getenv("PUSHGATE_QUEUE_WORKERS", "4"))
+QUEUE_MAX_ATTEMPTS = int(os.getenv("PUSHGATE_QUEUE_MAX_ATTEMPTS", "8"))
+QUEUE_BACKOFF_BASE = float(os.getenv("PUSHGATE_QUEUE_BACKOFF_BASE", "2"))  # seconds before the first retry
+QUEUE_BACKOFF_MAX = float(os.getenv("PUSHGATE_QUEUE_BACKOFF_MAX", "600"))
+QUEUE_LEASE_SECONDS = float(os.getenv("PUSHGATE_QUEUE_LEASE_SECONDS", "60"))
+QUEUE_POLL_INTERVAL = float(os.getenv("PUSHGATE_QUEUE_POLL_INTERVAL", "1"))
+
+STATUS_QUEUED = "queued"
+
+def queued_mode():
+    return DELIVERY_MODE == "queued"
+
+def enqueue_messages(db: Session, token_id: int, items):
+    # items: [(message, pushover_config_id, priority)]. Message and queue rows are committed in one
+    # transaction, so an accepted message survives a restart.
+    now = datetime.utcnow()
+    msgs = [Message(token_id=token_id, message=message, status=STATUS_QUEUED, timestamp=now, priority=priority) for message, _, priority in items]
+    db.add_all(msgs)
+    db.flush()
+    db.add_all([
+        OutboundQueue(message_id=msg.id, pushover_config_id=config_id, next_attempt_at=now, priority=priority)
+        for msg, (_, config_id, priority) in zip(msgs, items)
+    ])
+    db.commit()
+    return msgs
+
+def enqueue_message(db: Session, token_id: int, message: str, pushover_config_id: int = None, priority: int = 0):
+    return enqueue_messages(db, token_id, [(message, pushover_config_id, priority)])[0]
+
+def backoff_delay(attempts: int):
+    # Exponential backoff with full jitter, capped at QUEUE_BACKOFF_MAX
+    return random.uniform(0, min(QUEUE_BACKOFF_MAX, QUEUE_BACKOFF_BASE * (2 ** (attempts - 1))))
+
+def is_retryable(status_code):
+    return status_code == "error" or status_code == 429 or (isinstance(status_code, int) and status_code >= 500)
+
+def claim_next(db: Session):
+    # Lease the oldest due row of the highest priority. The conditional UPDATE makes the claim
+    # atomic across workers and processes without SELECT ... FOR UPDATE, which SQLite does not have.
+    # Fairness across tokens is left to the dispatch scheduler the delivery then goes through.
+    now = datetime.utcnow()
+    candidates = (
+        db.query(OutboundQueue.id)
+        .filter(OutboundQueue.next_attempt_at <= now)
+        .filter(or_(OutboundQueue.locked_until.is_(None), OutboundQueue.locked_until < now))
+        .order_by(OutboundQueue.priority.desc(), OutboundQueue.next_attempt_at)
+        .limit(5)
+        .all()
+    )
+    for (job_id,) in candidates:
+        result = db.execute(
+            update(OutboundQueue)
+            .where(OutboundQueue.id == job_id)
+            .where(or_(OutboundQueue.locked_until.is_(None), OutboundQueue.locked_until < now))
+            .values(locked_until=now + timedelta(seconds=QUEUE_LEASE_SECONDS))
+        )
+        db.commit()
+        if result.rowcount == 1:
+            job = db.query(OutboundQueue).options(joinedload(OutboundQueue.message)).filter(OutboundQueue.id == job_id).first()
+            config = get_pushover_config(db, job.pushover_config_id)
+            return job, config
+    return None, None
+
+def record_attempt(db: Session, job: OutboundQueue, status_code, resp_text: str, not_before: float = 0, config_id: int = None, latency: float = None):
+    # not_before: seconds the config's circuit breaker still holds requests back; retries wait at least that long.
+    # config_id/latency go to the usage rollups, which count a queued message once, at its final outcome.
+    if status_code == STATUS_CIRCUIT_OPEN:
+        # Never reached Pushover, so it does not use up an attempt
+        job.last_error = resp_text[:1000]
+        job.next_attempt_at = datetime.utcnow() + timedelta(seconds=max(not_before, QUEUE_POLL_INTERVAL))
+        job.locked_until = None
+        db.commit()
+        return
+    msg = db.query(Message).filter(Message.id == job.message_id).first()
+    job.attempts += 1
+    if status_code == 200 or not is_retryable(status_code) or job.attempts >= QUEUE_MAX_ATTEMPTS:
+        # Final outcome: the message keeps the last Pushover status, like a direct send
+        if msg:
+            msg.status = str(status_code)
+            record_usage(db, [(datetime.utcnow(), msg.token_id, config_id or job.pushover_config_id, msg.status, latency)])
+        db.delete(job)
+    else:
+        job.last_error = f"{status_code}: {resp_text}"[:1000]
+        job.next_attempt_at = datetime.utcnow() + timedelta(seconds=max(backoff_delay(job.attempts), not_before))
+        job.locked_until = None
+    db.commit()
+
+def record_group_attempt(db: Session, job: OutboundQueue, outcomes, not_before: float = 0):
+    # Like record_attempt, for a group send: outcomes holds the targets that were still pending.
+    # Delivered and finally failed targets are settled, retryable ones stay "queued"; the job is
+    # gone once no target is pending. Attempts only count when some target reached Pushover.
+    msg = db.query(Message).filter(Message.id == job.message_id).first()
+    reached = any(status_code != STATUS_CIRCUIT_OPEN for _, status_code, _, _ in outcomes)
+    if reached:
+        job.attempts += 1
+    give_up = job.attempts >= QUEUE_MAX_ATTEMPTS
+    settled, retrying = [], False
+    for config_id, status_code, resp_text, latency in settle_held(outcomes, hold=not give_up):
+        if status_code == DELIVERY_QUEUED or (is_retryable(status_code) and not give_up):
+            settled.append((config_id, DELIVERY_QUEUED, resp_text if status_code == DELIVERY_QUEUED else f"{status_code}: {resp_text}", latency))
+            retrying = True
+        else:
+            settled.append((config_id, status_code, resp_text, latency))
+    if msg and settled:
+        record_deliveries(db, msg, settled)
+    if retrying:
+        delay = backoff_delay(job.attempts) if reached else QUEUE_POLL_INTERVAL
+        job.last_error = next((detail for _, status, detail, _ in settled if status == DELIVERY_QUEUED), None)
+        job.next_attempt_at = datetime.utcnow() + timedelta(seconds=max(delay, not_before))
+        job.locked_until = None
+    else:
+        db.delete(job)
+    db.commit()
+
+def _token_weight(db: Session, token_id: int):
+    return db.query(Token.dispatch_weight).filter(Token.id == token_id).scalar() or 1
+
+async def process_group_job(db: Session, job: OutboundQueue, weight: float = 1):
+    config_ids = await run_in_threadpool(pending_config_ids, db, job.message_id)
+    msg = job.message
+    outcomes = await deliver_to_targets(db, config_ids, msg.message, msg.priority, msg.token_id, weight)
+    held = [breakers.get(config_id).retry_after() for config_id, status_code, _, _ in outcomes if status_code == STATUS_CIRCUIT_OPEN]
+    await run_in_threadpool(record_group_attempt, db, job, outcomes, max(held, default=0))
+
+async def process_one():
+    # Deliver one due message; returns False when nothing was due
+    db = SessionLocal()
+    try:
+        job, config = await run_in_threadpool(claim_next, db)
+        if job is None:
+            return False
+        try:
+            msg = job.message
+            weight = await run_in_threadpool(_token_weight, db, msg.token_id)
+            if job.delivery_group_id is not None:
+                await process_group_job(db, job, weight)
+                return True
+            not_before, latency = 0, None
+            if config is None:
+                status_code, resp_text = "error", "Pushover config not set"
+            else:
+                status_code, resp_text, latency = await deliver_timed(config, msg.message, msg.priority, msg.token_id, weight)
+                not_before = breakers.get(config.id).retry_after()
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            # E.g. a config that no longer decrypts after a key change. Counted as a failed attempt,
+            # so the job backs off and gives up after QUEUE_MAX_ATTEMPTS instead of being claimed
+            # again every time its lease runs out.
+            logger.exception("Queued delivery of message %s failed", job.message_id)
+            await run_in_threadpool(db.rollback)
+            await run_in_threadpool(record_attempt, db, job, "error", str(exc) or type(exc).__name__)
+            return True
+        await run_in_threadpool(record_attempt, db, job, status_code, resp_text, not_before, config.id if config else None, latency)
+        return True
+    finally:
+        db.close()
+
+class DeliveryWorkers:
+    # A pool of asyncio tasks draining the outbound queue, started with the app in queued mode
+    def __init__(self, count: int = QUEUE_WORKERS):
+        self.count = count
+        self.tasks = []
+        self.wakeup = asyncio.Event()
+
+    def start(self):
+        if self.tasks:
+            return
+        self.tasks = [asyncio.create_task(self._run()) for _ in range(self.count)]
+
+    def notify(self):
+        self.wakeup.set()
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _run(self):
+        while True:
+            try:
+                if await process_one():
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Queued delivery failed")
+            # Nothing due: sleep until /send enqueues something or the poll interval passes (for retries)
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), QUEUE_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+workers = DeliveryWorkers()
+
+def queue_status(db: Session, message_id: int):
+    job = db.query(OutboundQueue).filter(OutboundQueue.message_id == message_id).first()
+    if not job:
+        return {"attempts": None, "next_attempt_at": None, "last_error": None}
+    return {"attempts": job.attempts, "next_attempt_at": job.next_attempt_at, "last_error": job.last_error}
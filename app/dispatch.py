@@ -0,0 +1,147 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from .metrics import DISPATCH_BACKLOG, DISPATCH_INFLIGHT, DISPATCH_WAIT_SECONDS
+
+# Pushover's priority levels, lowest to highest; each one is a dispatch lane
+PRIORITIES = (-2, -1, 0, 1, 2)
+# Pushover calls in flight at once across all configs. Keep it at or below PUSHOVER_MAX_CONNECTIONS,
+# so waiting happens here, in priority order, rather than in the connection pool's FIFO.
+DISPATCH_MAX_INFLIGHT = int(os.getenv("PUSHGATE_DISPATCH_MAX_INFLIGHT", os.getenv("PUSHOVER_MAX_CONNECTIONS", "20")))
+# Pushover calls in flight at once for one config (one Pushover application)
+DISPATCH_CONFIG_CONCURRENCY = int(os.getenv("PUSHGATE_DISPATCH_CONFIG_CONCURRENCY", "4"))
+
+class _Waiter:
+    __slots__ = ("lane", "config_id", "future", "queued_at", "cancelled")
+
+    def __init__(self, lane, config_id, future, queued_at):
+        self.lane = lane
+        self.config_id = config_id
+        self.future = future
+        self.queued_at = queued_at
+        self.cancelled = False
+
+class DispatchScheduler:
+    # Decides which waiting send makes the next Pushover call once the in-flight caps are reached.
+    # Lanes are served in strict priority order, highest first, so emergency and high-priority
+    # messages overtake everything queued below them. Within a lane, tokens share the slots in
+    # proportion to their dispatch weight (start-time fair queuing): each send is tagged
+    # max(lane virtual time, the token's previous tag) + 1/weight, and the lowest tag goes next,
+    # so a token with a deep backlog cannot push back a token that sends now and then. A send whose
+    # config is at its concurrency cap is skipped over, not waited on, so one saturated Pushover
+    # app does not hold up the others. All state lives on the event loop; no locks are needed.
+    def __init__(self, max_inflight: int = DISPATCH_MAX_INFLIGHT, per_config: int = DISPATCH_CONFIG_CONCURRENCY, clock=time.monotonic):
+        self.max_inflight = max_inflight
+        self.per_config = per_config
+        self.clock = clock
+        self.loop = None
+        self._reset()
+
+    def _reset(self):
+        self.lanes = {p: [] for p in PRIORITIES}  # heaps of (tag, sequence, waiter)
+        self.vtime = dict.fromkeys(PRIORITIES, 0.0)
+        self.finish = {p: {} for p in PRIORITIES}  # per lane: token id -> tag of its latest send
+        self.waiting = Counter()
+        self.inflight = 0
+        self.config_inflight = Counter()
+        self.sequence = itertools.count()
+        for lane in PRIORITIES:
+            DISPATCH_BACKLOG.labels(str(lane)).set(0)
+        DISPATCH_INFLIGHT.set(0)
+
+    def _bind(self):
+        # Futures belong to one event loop; if the loop changes, whatever waited on the old one is gone
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self._reset()
+        return loop
+
+    @asynccontextmanager
+    async def slot(self, config_id, priority: int = 0, token_id=None, weight: float = 1):
+        # async with scheduler.slot(config.id, priority, token.id, weight): <one Pushover call>
+        loop = self._bind()
+        lane = min(max(int(priority or 0), PRIORITIES[0]), PRIORITIES[-1])
+        finish = self.finish[lane]
+        tag = max(self.vtime[lane], finish.get(token_id, 0.0)) + 1.0 / max(weight or 1, 0.01)
+        finish[token_id] = tag
+        waiter = _Waiter(lane, config_id, loop.create_future(), self.clock())
+        heapq.heappush(self.lanes[lane], (tag, next(self.sequence), waiter))
+        self._set_waiting(lane, 1)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(config_id)
+            else:
+                waiter.cancelled = True
+                self._set_waiting(lane, -1)
+            raise
+        try:
+            yield
+        finally:
+            self._release(config_id)
+
+    def _set_waiting(self, lane, delta):
+        self.waiting[lane] += delta
+        DISPATCH_BACKLOG.labels(str(lane)).set(self.waiting[lane])
+
+    def _release(self, config_id):
+        self.inflight -= 1
+        self.config_inflight[config_id] -= 1
+        DISPATCH_INFLIGHT.set(self.inflight)
+        self._dispatch()
+
+    def _next(self):
+        # Highest lane first; within it the lowest tag whose config has room
+        for lane in reversed(PRIORITIES):
+            heap = self.lanes[lane]
+            skipped, found = [], None
+            while heap:
+                entry = heapq.heappop(heap)
+                waiter = entry[2]
+                if waiter.cancelled:
+                    continue
+                if self.config_inflight[waiter.config_id] < self.per_config:
+                    found = entry
+                    break
+                skipped.append(entry)
+            for entry in skipped:
+                heapq.heappush(heap, entry)
+            if not heap and not skipped:
+                # Lane drained: every tag is at or below its virtual time, so the history can go
+                self.finish[lane].clear()
+            if found:
+                return found
+        return None
+
+    def _dispatch(self):
+        while self.inflight < self.max_inflight:
+            entry = self._next()
+            if entry is None:
+                return
+            tag, _, waiter = entry
+            self.vtime[waiter.lane] = tag
+            self.inflight += 1
+            self.config_inflight[waiter.config_id] += 1
+            DISPATCH_INFLIGHT.set(self.inflight)
+            self._set_waiting(waiter.lane, -1)
+            DISPATCH_WAIT_SECONDS.labels(str(waiter.lane)).observe(self.clock() - waiter.queued_at)
+            waiter.future.set_result(None)
+
+    def snapshot(self):
+        # What this process is doing right now, for /api/dispatch
+        return {
+            "max_inflight": self.max_inflight,
+            "config_concurrency": self.per_config,
+            "inflight": self.inflight,
+            "inflight_by_config": {str(k): v for k, v in self.config_inflight.items() if v},
+            "waiting": {str(lane): self.waiting[lane] for lane in reversed(PRIORITIES)},
+        }
+
+scheduler = DispatchScheduler()
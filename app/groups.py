@@ -0,0 +1,131 @@
+import asyncio
+from datetime import datetime
+from sqlalchemy.orm import Session
+from .circuit import STATUS_CIRCUIT_OPEN
+from .configs import config_cache
+from .models import Message, MessageDelivery, OutboundQueue
+from .pushover import deliver_timed
+from .usage import record_usage
+
+GROUP_NAME_MAX_LENGTH = 64
+# Delivery statuses besides Pushover's HTTP status and "error"
+DELIVERY_QUEUED = "queued"  # not delivered yet; the group's queue job retries it
+DELIVERY_UNAVAILABLE = "unavailable"  # never sent: the config's circuit breaker was open
+# Message status when some targets got the message and some did not
+STATUS_PARTIAL = "207"
+
+def clean_group_name(name: str) -> str:
+    # Raises ValueError for names that are empty, too long or cannot be told apart from an id
+    name = (name or "").strip()
+    if not name:
+        raise ValueError("Group name is required")
+    if name.isdigit():
+        raise ValueError("Group name cannot be only digits")
+    if len(name) > GROUP_NAME_MAX_LENGTH:
+        raise ValueError(f"Group name is longer than {GROUP_NAME_MAX_LENGTH} characters")
+    return name
+
+def group_key(group) -> str:
+    # Stands in for a config id where sends are keyed per target (dedup windows)
+    return f"group:{group.id}"
+
+def group_from_key(db: Session, key):
+    if isinstance(key, str) and key.startswith("group:"):
+        return config_cache.group(db, int(key[len("group:"):]))
+    return None
+
+def combined_status(statuses) -> str:
+    # The Message status for a group send: "queued" while any target is pending, "200" when
+    # every target got it, STATUS_PARTIAL when some did, otherwise the first target's failure
+    statuses = [str(s) for s in statuses]
+    if DELIVERY_QUEUED in statuses:
+        return DELIVERY_QUEUED
+    delivered = [s == "200" for s in statuses]
+    if all(delivered):
+        return "200"
+    if any(delivered):
+        return STATUS_PARTIAL
+    return statuses[0]
+
+async def _deliver_one(config_id: int, config, message: str, priority: int, token_id: int, weight: float):
+    if config is None:
+        return config_id, "error", "Pushover config not set", None
+    status_code, resp_text, latency = await deliver_timed(config, message, priority, token_id, weight)
+    return config_id, status_code, resp_text, latency
+
+async def deliver_to_targets(db: Session, config_ids, message: str, priority: int = 0, token_id: int = None, weight: float = 1):
+    # One Pushover call per config, all at once over the shared connection pool, so the whole
+    # fan-out takes about as long as the slowest target. Returns [(config_id, status, text, latency)].
+    targets = [(config_id, config_cache.get(db, config_id)) for config_id in config_ids]
+    calls = (_deliver_one(config_id, config, message, priority, token_id, weight) for config_id, config in targets)
+    return list(await asyncio.gather(*calls))
+
+def record_deliveries(db: Session, msg: Message, outcomes, now: datetime = None):
+    # Save per-target outcomes [(config_id, status, detail, latency)] and the combined status on the
+    # message. Outcomes that are final and reached Pushover also go to the usage rollups, one per
+    # target. The caller commits.
+    now = now or datetime.utcnow()
+    existing = {d.config_id: d for d in db.query(MessageDelivery).filter(MessageDelivery.message_id == msg.id)}
+    usage = []
+    for config_id, status_code, detail, latency in outcomes:
+        status = str(status_code)
+        delivery = existing.get(config_id)
+        if delivery is None:
+            delivery = existing[config_id] = MessageDelivery(message_id=msg.id, config_id=config_id)
+            db.add(delivery)
+        delivery.status = status
+        delivery.latency = latency
+        delivery.detail = detail[:1000] if detail else None
+        if status not in (DELIVERY_QUEUED, DELIVERY_UNAVAILABLE):
+            usage.append((now, msg.token_id, config_id, status, latency))
+    msg.status = combined_status(d.status for _, d in sorted(existing.items()))
+    record_usage(db, usage)
+
+def settle_held(outcomes, hold: bool):
+    # Targets whose circuit breaker was open never reached Pushover: keep them "queued" for a
+    # retry (hold) or record them as "unavailable"
+    held_status = DELIVERY_QUEUED if hold else DELIVERY_UNAVAILABLE
+    return [
+        (config_id, held_status if status_code == STATUS_CIRCUIT_OPEN else status_code, detail, latency)
+        for config_id, status_code, detail, latency in outcomes
+    ]
+
+def log_group_message(db: Session, token_id: int, message: str, group_id: int, outcomes, priority: int = 0) -> int:
+    # Message row, its deliveries and their usage in one transaction. Targets still "queued"
+    # (queued mode, or held by an open circuit breaker) get a queue job for the delivery workers.
+    now = datetime.utcnow()
+    msg = Message(token_id=token_id, message=message, timestamp=now, priority=priority)
+    db.add(msg)
+    db.flush()
+    record_deliveries(db, msg, outcomes, now)
+    if msg.status == DELIVERY_QUEUED:
+        db.add(OutboundQueue(message_id=msg.id, delivery_group_id=group_id, next_attempt_at=now, priority=priority))
+    db.commit()
+    return msg.id
+
+def pending_config_ids(db: Session, message_id: int):
+    return [
+        config_id for (config_id,) in db.query(MessageDelivery.config_id)
+        .filter(MessageDelivery.message_id == message_id, MessageDelivery.status == DELIVERY_QUEUED)
+        .order_by(MessageDelivery.config_id)
+    ]
+
+def deliveries_for(db: Session, message_ids):
+    # {message id: [MessageDelivery]} for the given messages; plain sends have none
+    by_message = {}
+    if message_ids:
+        rows = db.query(MessageDelivery).filter(MessageDelivery.message_id.in_(list(message_ids)))
+        for d in rows.order_by(MessageDelivery.message_id, MessageDelivery.config_id):
+            by_message.setdefault(d.message_id, []).append(d)
+    return by_message
+
+def delivery_result(config_id: int, status_code, detail: str):
+    # One entry of the "deliveries" list in /send responses
+    status = str(status_code)
+    if status == "200":
+        return {"config_id": config_id, "status": "ok", "pushover_response": detail}
+    if status_code == STATUS_CIRCUIT_OPEN or status == DELIVERY_UNAVAILABLE:
+        return {"config_id": config_id, "status": DELIVERY_UNAVAILABLE, "detail": detail}
+    if status == DELIVERY_QUEUED:
+        return {"config_id": config_id, "status": DELIVERY_QUEUED}
+    return {"config_id": config_id, "status": "error", "detail": f"Pushover error: {detail}"}
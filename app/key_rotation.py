@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from sqlalchemy.orm import Session
+from .crypto import token_digest_for_key
+from .models import Token, PushoverConfig, AdminSettings
+
+# Every column holding Fernet ciphertext; key rotation walks exactly these
+ENCRYPTED_COLUMNS = [
+    (Token, ["encrypted_token"]),
+    (PushoverConfig, ["encrypted_app_token", "encrypted_user_key"]),
+    (AdminSettings, ["encrypted_password"]),
+]
+
+def read_key_file(path: str):
+    with open(path, "rb") as f:
+        keys = [line.strip() for line in f.read().splitlines()]
+    return [k for k in keys if k and not k.startswith(b"#")]
+
+def write_key_file(path: str, keys):
+    # Write-then-rename, so a running app never reads a half-written file
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(b"\n".join(keys) + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.chmod(tmp, 0o600)
+    os.replace(tmp, path)
+
+def key_fingerprint(key: bytes) -> str:
+    return hashlib.sha256(key).hexdigest()[:12]
+
+class Checkpoint:
+    # Progress of a re-encryption pass, saved after every batch: the last id done per table.
+    # Tied to the primary key it was made for; a checkpoint for another key is ignored.
+    def __init__(self, path: str, primary: bytes):
+        self.path = path
+        self.primary = key_fingerprint(primary)
+        self.done = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("primary") == self.primary:
+                self.done = data.get("done", {})
+
+    def last_id(self, table: str) -> int:
+        return self.done.get(table, 0)
+
+    def save(self, table: str, last_id: int):
+        self.done[table] = last_id
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"primary": self.primary, "done": self.done}, f)
+        os.replace(tmp, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def _decrypt(primary: Fernet, multi: MultiFernet, ciphertext: str):
+    # (plaintext, already under the primary key?); plaintext is None if no key opens it
+    try:
+        return primary.decrypt(ciphertext.encode()).decode(), True
+    except InvalidToken:
+        pass
+    try:
+        return multi.decrypt(ciphertext.encode()).decode(), False
+    except InvalidToken:
+        return None, False
+
+def reencrypt_table(db: Session, model, columns, keys, batch_size: int = 500, start_after: int = 0, on_batch=None):
+    # Re-encrypt `columns` of `model` under keys[0] in id order, one transaction per batch.
+    # Only the id and ciphertext columns are loaded. Each row is updated only if its ciphertext
+    # is still what was read, so a concurrent edit from the app (already under the new key) wins.
+    # Returns (last id, rows rewritten, values that no key could decrypt).
+    primary = Fernet(keys[0])
+    multi = MultiFernet([Fernet(k) for k in keys])
+    is_token = model is Token
+    extra = [Token.token_digest] if is_token else []
+    last_id, rewritten, failed = start_after, 0, 0
+    while True:
+        rows = (
+            db.query(model.id, *[getattr(model, c) for c in columns], *extra)
+            .filter(model.id > last_id)
+            .order_by(model.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        for row in rows:
+            last_id = row.id
+            values = {}
+            for column in columns:
+                ciphertext = getattr(row, column)
+                if ciphertext is None:
+                    continue
+                plain, current = _decrypt(primary, multi, ciphertext)
+                if plain is None:
+                    failed += 1
+                    continue
+                if not current:
+                    values[column] = primary.encrypt(plain.encode()).decode()
+                if is_token:
+                    # The lookup digest is keyed by the primary key too
+                    digest = token_digest_for_key(keys[0], plain)
+                    if row.token_digest != digest:
+                        values["token_digest"] = digest
+            if values:
+                updated = db.query(model).filter(
+                    model.id == row.id, *[getattr(model, c) == getattr(row, c) for c in columns]
+                ).update(values, synchronize_session=False)
+                rewritten += updated
+        db.commit()
+        if on_batch:
+            on_batch(model.__tablename__, last_id, rewritten, failed)
+    return last_id, rewritten, failed
+
+def reencrypt_all(db: Session, keys, checkpoint: Checkpoint = None, batch_size: int = 500, on_batch=None):
+    # Resumable pass over every encrypted column; returns {table: (rewritten, failed)}
+    results = {}
+    for model, columns in ENCRYPTED_COLUMNS:
+        table = model.__tablename__
+
+        def progress(table, last_id, rewritten, failed):
+            if checkpoint:
+                checkpoint.save(table, last_id)
+            if on_batch:
+                on_batch(table, last_id, rewritten, failed)
+
+        start = checkpoint.last_id(table) if checkpoint else 0
+        _, rewritten, failed = reencrypt_table(db, model, columns, keys, batch_size, start_after=start, on_batch=progress)
+        results[table] = (rewritten, failed)
+    return results
+
+def count_not_current(db: Session, primary_key: bytes, batch_size: int = 500):
+    # Values (and token digests) that still depend on an older key; {table: count}
+    primary = Fernet(primary_key)
+    counts = {}
+    for model, columns in ENCRYPTED_COLUMNS:
+        is_token = model is Token
+        extra = [Token.token_digest] if is_token else []
+        pending, last_id = 0, 0
+        while True:
+            rows = (
+                db.query(model.id, *[getattr(model, c) for c in columns], *extra)
+                .filter(model.id > last_id)
+                .order_by(model.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            for row in rows:
+                last_id = row.id
+                for column in columns:
+                    ciphertext = getattr(row, column)
+                    if ciphertext is None:
+                        continue
+                    try:
+                        plain = primary.decrypt(ciphertext.encode()).decode()
+                    except InvalidToken:
+                        pending += 1
+                        continue
+                    if is_token and row.token_digest != token_digest_for_key(primary_key, plain):
+                        pending += 1
+        counts[model.__tablename__] = pending
+    return counts
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from starlette.concurrency import run_in_threadpool
+from .db import SessionLocal
+from .models import Message
+from .usage import record_usage
+
+logger = logging.getLogger(__name__)
+
+# How /send records its Message row:
+#   "wait"  - buffered and committed in groups by a background writer; the request waits for its group (default)
+#   "async" - buffered the same way, but the request returns without waiting for the commit
+#   "sync"  - the request commits its own row, as before
+LOG_DURABILITY = os.getenv("PUSHGATE_LOG_DURABILITY", "wait").lower()
+LOG_FLUSH_SIZE = int(os.getenv("PUSHGATE_LOG_FLUSH_SIZE", "200"))
+LOG_FLUSH_INTERVAL = float(os.getenv("PUSHGATE_LOG_FLUSH_INTERVAL_MS", "5")) / 1000
+
+class LogWriter:
+    # Group commit: a single thread drains a queue of pending rows and writes each batch in one
+    # transaction. A batch closes when it reaches LOG_FLUSH_SIZE rows or LOG_FLUSH_INTERVAL has
+    # passed since its first row, so under load many requests share one commit (one fsync).
+    def __init__(self, session_factory=SessionLocal, flush_size: int = LOG_FLUSH_SIZE, flush_interval: float = LOG_FLUSH_INTERVAL):
+        self.session_factory = session_factory
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.pending = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.flushes = 0
+        self.rows_written = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="pushgate-log-writer", daemon=True)
+                self.thread.start()
+
+    def stop(self, timeout: float = 5):
+        # Flush everything submitted so far, then end the thread
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.pending.put(None)
+            thread.join(timeout)
+
+    def submit(self, token_id: int, message: str, status, timestamp: datetime = None, config_id: int = None, latency: float = None, priority: int = 0) -> Future:
+        # Returns a Future resolving to the new message id once its batch is committed.
+        # config_id and latency (seconds) only feed the usage rollups.
+        self.start()
+        future = Future()
+        row = {"token_id": token_id, "message": message, "status": str(status), "timestamp": timestamp or datetime.utcnow(), "priority": priority}
+        self.pending.put((row, (config_id, latency), future))
+        return future
+
+    def _run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            batch = [item]
+            stopping = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.flush_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self.pending.get(timeout=remaining) if remaining > 0 else self.pending.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+            if stopping:
+                return
+
+    def _flush(self, batch):
+        db = self.session_factory()
+        try:
+            msgs = [Message(**row) for row, _, _ in batch]
+            db.add_all(msgs)
+            record_usage(db, [(row["timestamp"], row["token_id"], config_id, row["status"], latency) for row, (config_id, latency), _ in batch])
+            db.commit()
+            self.flushes += 1
+            self.rows_written += len(msgs)
+            for msg, (_, _, future) in zip(msgs, batch):
+                future.set_result(msg.id)
+        except Exception as e:
+            db.rollback()
+            logger.exception("Failed to write %d message log row(s)", len(batch))
+            for _, _, future in batch:
+                future.set_exception(e)
+        finally:
+            db.close()
+
+log_writer = LogWriter()
+
+def _write_now(token_id: int, message: str, status, config_id: int = None, latency: float = None, priority: int = 0):
+    db = SessionLocal()
+    try:
+        msg = Message(token_id=token_id, message=message, status=str(status), timestamp=datetime.utcnow(), priority=priority)
+        db.add(msg)
+        record_usage(db, [(msg.timestamp, token_id, config_id, msg.status, latency)])
+        db.commit()
+        return msg.id
+    finally:
+        db.close()
+
+async def log_message(token_id: int, message: str, status, wait: bool = False, config_id: int = None, latency: float = None, priority: int = 0):
+    # Record a sent message according to LOG_DURABILITY; returns its id, or None in async mode
+    # unless wait=True (for callers that need the id). The usage rollups are updated in the same commit.
+    if LOG_DURABILITY == "sync":
+        return await run_in_threadpool(_write_now, token_id, message, status, config_id, latency, priority)
+    future = log_writer.submit(token_id, message, status, config_id=config_id, latency=latency, priority=priority)
+    if LOG_DURABILITY == "async" and not wait:
+        return None
+    return await asyncio.wrap_future(future)
@@ -1,6 +1,11 @@
-from fastapi import FastAPI, Request, Depends, Form, HTTPException, status, Query
+from fastapi import FastAPI, Request, Depends, Form, HTTPException, status, Query, Header
+import asyncio
+import os
 import re
-from fastapi.responses import HTMLResponse, RedirectResponse
+from typing import List, Optional
+from urllib.parse import urlencode
+from pydantic import BaseModel
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
@@ -9,26 +14,47 @@ from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.middleware.base import RequestResponseEndpoint
 from starlette.types import ASGIApp
 import secrets as pysecrets
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from .db import get_db, init_db
+from starlette.concurrency import run_in_threadpool
+from fastapi.responses import Response
+from .db import get_db, get_read_db, init_db, SessionLocal, ReadSessionLocal, engine, read_engine
 from .auth import get_current_admin, get_admin_password
-from .pushover import send_pushover_message
-from .rate_limit import check_token_rate_limit
-from .models import Token, PushoverConfig, Message, AdminSettings
-from .crypto import encrypt, decrypt
-from datetime import datetime
+from .pushover import get_pushover_config, deliver_timed, close_client
+from .configs import CachedGroup, config_cache, credentials
+from .groups import (DELIVERY_QUEUED, DELIVERY_UNAVAILABLE, STATUS_PARTIAL, combined_status, deliver_to_targets, delivery_result, group_key,
+                     group_from_key, log_group_message, settle_held, deliveries_for, clean_group_name)
+from .retention import retention_job, RETENTION_DAYS
+from .dedup import deduplicator, collapsed_text, DEDUP_MODES
+from .circuit import breakers, BREAKER_OPEN_ACTION, STATUS_CIRCUIT_OPEN
+from .dispatch import PRIORITIES, scheduler
+from .delivery import queued_mode, enqueue_message, enqueue_messages, queue_status, workers as delivery_workers
+from .rate_limit import rate_limiter
+from .schedule import STATUS_SCHEDULED, cancel_scheduled, count_scheduled, deliver_time, schedule_message, scheduled_for, timer as schedule_timer
+from .shared_state import check_deployment
+from .log_writer import log_message, log_writer
+from .usage import record_usage, usage_stats
+from .models import Token, PushoverConfig, Message, AdminSettings, DeliveryGroup, DeliveryGroupMember
+from .crypto import encrypt, decrypt, token_digest
+from .tokens import lookup_token, token_prefix, clean_label, resolve_token_ref, token_names, token_page
+from .messages import message_page, count_messages, export_messages, EXPORT_FORMATS
+from .search import search_messages
+from .metrics import MetricsMiddleware, RATE_LIMIT_REJECTIONS, QUEUE_DEPTH, QUEUE_DEPTH_BY_PRIORITY, SCHEDULED_MESSAGES, time_stage, instrument_pool, render_metrics, mark_process_dead
+from .models import OutboundQueue
+from datetime import datetime, timedelta
 
 # Add root_path for proxy path prefix
 app = FastAPI(root_path="/pushgate")
 
 app.add_middleware(SessionMiddleware, secret_key="dummy")  # Will be replaced with Docker secret
+app.add_middleware(MetricsMiddleware)
+
+instrument_pool(engine, "write")
+if read_engine is not engine:
+    instrument_pool(read_engine, "read")
 
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
-from .crypto import decrypt
-# Register the 'decrypt' filter for Jinja2 templates
-templates.env.filters["decrypt"] = decrypt
-
 # CSRF token helpers
 CSRF_SESSION_KEY = "csrf_token"
 def get_csrf_token(request: Request):
@@ -43,9 +69,34 @@ def verify_csrf(request: Request, token: str):
     if not session_token or session_token != token:
         raise HTTPException(status_code=400, detail="Invalid CSRF token")
 
+def _warm_rate_limiter():
+    db = SessionLocal()
+    try:
+        rate_limiter.warm(db)
+    finally:
+        db.close()
+
 @app.on_event("startup")
-def on_startup():
-    init_db()
+async def on_startup():
+    check_deployment()
+    await run_in_threadpool(init_db)
+    await run_in_threadpool(_warm_rate_limiter)
+    # Workers also start when the queue holds released scheduled messages, and whenever the
+    # schedule timer releases more
+    if queued_mode() or BREAKER_OPEN_ACTION == "queue" or await run_in_threadpool(_queue_depth):
+        delivery_workers.start()
+    schedule_timer.start()
+    retention_job.start()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await retention_job.stop()
+    await schedule_timer.stop()
+    await delivery_workers.stop()
+    await run_in_threadpool(log_writer.stop)
+    await run_in_threadpool(deduplicator.flush)
+    await close_client()
+    mark_process_dead()
 
 @app.get("/", response_class=HTMLResponse)
 def index_page(request: Request):
@@ -55,30 +106,59 @@ def index_page(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
 @app.get("/tokens", response_class=HTMLResponse)
-def tokens_page(request: Request, db: Session = Depends(get_db), admin=Depends(get_current_admin), msg: str = Query(None)):
-    tokens = db.query(Token).all()
-    decrypted_tokens = []
-    for t in tokens:
-        try:
-            decrypted = decrypt(t.encrypted_token)
-        except Exception:
-            decrypted = "<decryption error>"
-        decrypted_tokens.append({
-            "id": t.id,
-            "token": decrypted,
-            "created_at": t.created_at,
-            "last_used": t.last_used,
-            "rate_limit_per_hour": t.rate_limit_per_hour
-        })
+def tokens_page(
+    request: Request,
+    db: Session = Depends(get_read_db),
+    admin=Depends(get_current_admin),
+    msg: str = Query(None),
+    q: str = Query(None),
+    before: int = Query(None),
+    after: int = Query(None),
+    page_size: int = Query(50, ge=1, le=200),
+):
+    # Labels and prefixes only; a token's secret is fetched row by row through /tokens/{id}/reveal
+    page = token_page(db, q, page_size, before=before, after=after)
+    filters = {k: v for k, v in {"q": q, "page_size": page_size}.items() if v}
+    previous_url = f"?{urlencode({**filters, 'before': page['previous_cursor']})}" if page["previous_cursor"] else None
+    next_url = f"?{urlencode({**filters, 'after': page['next_cursor']})}" if page["next_cursor"] else None
     csrf_token = get_csrf_token(request)
-    return templates.TemplateResponse("tokens.html", {"request": request, "tokens": decrypted_tokens, "msg": msg, "csrf_token": csrf_token})
+    return templates.TemplateResponse("tokens.html", {
+        "request": request, "tokens": page["tokens"], "q": q, "previous_url": previous_url, "next_url": next_url,
+        "default_retention_days": RETENTION_DAYS, "msg": msg, "csrf_token": csrf_token,
+    })
+
+def _no_store(content: dict):
+    return JSONResponse(content, headers={"Cache-Control": "no-store"})
+
+@app.post("/tokens/{token_id}/reveal")
+def reveal_token(request: Request, token_id: int, db: Session = Depends(get_read_db), admin=Depends(get_current_admin), csrf_token: str = Form(...)):
+    # One token's plaintext, for the Reveal button; the only place the admin UI decrypts a token
+    verify_csrf(request, csrf_token)
+    row = db.query(Token.encrypted_token).filter(Token.id == token_id).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Token not found")
+    try:
+        plain = decrypt(row.encrypted_token)
+    except Exception:
+        raise HTTPException(status_code=500, detail="Token could not be decrypted with the current key")
+    return _no_store({"id": token_id, "token": plain})
 
 @app.post("/tokens/create")
-def create_token(request: Request, db: Session = Depends(get_db), admin=Depends(get_current_admin), rate_limit_per_hour: int = Form(5), csrf_token: str = Form(...)):
+def create_token(request: Request, db: Session = Depends(get_db), admin=Depends(get_current_admin), rate_limit_per_hour: int = Form(5), dedup_window_seconds: int = Form(None), dedup_mode: str = Form("drop"), label: str = Form(""), csrf_token: str = Form(...)):
     verify_csrf(request, csrf_token)
+    if dedup_mode not in DEDUP_MODES:
+        return RedirectResponse(url="/pushgate/tokens?msg=Invalid+dedup+mode", status_code=303)
+    try:
+        label = clean_label(label)
+    except ValueError as e:
+        return RedirectResponse(url=f"/pushgate/tokens?{urlencode({'msg': str(e)})}", status_code=303)
+    if label and db.query(Token.id).filter(Token.label == label).first():
+        return RedirectResponse(url="/pushgate/tokens?msg=Label+already+in+use", status_code=303)
     new_token = pysecrets.token_urlsafe(32)
     encrypted = encrypt(new_token)
-    token_obj = Token(encrypted_token=encrypted, created_at=datetime.utcnow(), rate_limit_per_hour=rate_limit_per_hour)
+    token_obj = Token(encrypted_token=encrypted, token_digest=token_digest(new_token), token_prefix=token_prefix(new_token), label=label,
+                      created_at=datetime.utcnow(), rate_limit_per_hour=rate_limit_per_hour,
+                      dedup_window_seconds=dedup_window_seconds or None, dedup_mode=dedup_mode)
     db.add(token_obj)
     db.commit()
     return RedirectResponse(url="/pushgate/tokens?msg=Token+created", status_code=303)
@@ -91,12 +171,73 @@ def rotate_token(request: Request, token_id: int = Form(...), rate_limit_per_hou
         return RedirectResponse(url="/pushgate/tokens?msg=Token+not+found", status_code=303)
     new_token = pysecrets.token_urlsafe(32)
     token_obj.encrypted_token = encrypt(new_token)
+    token_obj.token_digest = token_digest(new_token)
+    token_obj.token_prefix = token_prefix(new_token)
     token_obj.created_at = datetime.utcnow()
     if rate_limit_per_hour is not None:
         token_obj.rate_limit_per_hour = rate_limit_per_hour
     db.commit()
     return RedirectResponse(url="/pushgate/tokens?msg=Token+rotated", status_code=303)
 
+@app.post("/tokens/label")
+def update_token_label(request: Request, token_id: int = Form(...), label: str = Form(""), db: Session = Depends(get_db), admin=Depends(get_current_admin), csrf_token: str = Form(...)):
+    verify_csrf(request, csrf_token)
+    try:
+        label = clean_label(label)
+    except ValueError as e:
+        return RedirectResponse(url=f"/pushgate/tokens?{urlencode({'msg': str(e)})}", status_code=303)
+    token_obj = db.query(Token).filter(Token.id == token_id).first()
+    if not token_obj:
+        return RedirectResponse(url="/pushgate/tokens?msg=Token+not+found", status_code=303)
+    if label and db.query(Token.id).filter(Token.label == label, Token.id != token_id).first():
+        return RedirectResponse(url="/pushgate/tokens?msg=Label+already+in+use", status_code=303)
+    token_obj.label = label
+    db.commit()
+    return RedirectResponse(url="/pushgate/tokens?msg=Label+updated", status_code=303)
+
+@app.post("/tokens/dedup")
+def update_token_dedup(request: Request, token_id: int = Form(...), dedup_window_seconds: int = Form(None), dedup_mode: str = Form("drop"), db: Session = Depends(get_db), admin=Depends(get_current_admin), csrf_token: str = Form(...)):
+    verify_csrf(request, csrf_token)
+    if dedup_mode not in DEDUP_MODES:
+        return RedirectResponse(url="/pushgate/tokens?msg=Invalid+dedup+mode", status_code=303)
+    token_obj = db.query(Token).filter(Token.id == token_id).first()
+    if not token_obj:
+        return RedirectResponse(url="/pushgate/tokens?msg=Token+not+found", status_code=303)
+    token_obj.dedup_window_seconds = dedup_window_seconds or None
+    token_obj.dedup_mode = dedup_mode
+    db.commit()
+    return RedirectResponse(url="/pushgate/tokens?msg=Dedup+settings+updated", status_code=303)
+
+@app.post("/tokens/retention")
+def update_token_retention(request: Request, token_id: int = Form(...), retention_days: str = Form(""), db: Session = Depends(get_db), admin=Depends(get_current_admin), csrf_token: str = Form(...)):
+    verify_csrf(request, csrf_token)
+    # Empty = the global default, 0 = keep forever
+    try:
+        days = int(retention_days) if retention_days.strip() else None
+    except ValueError:
+        days = -1
+    if days is not None and days < 0:
+        return RedirectResponse(url="/pushgate/tokens?msg=Invalid+retention", status_code=303)
+    token_obj = db.query(Token).filter(Token.id == token_id).first()
+    if not token_obj:
+        return RedirectResponse(url="/pushgate/tokens?msg=Token+not+found", status_code=303)
+    token_obj.retention_days = days
+    db.commit()
+    return RedirectResponse(url="/pushgate/tokens?msg=Retention+updated", status_code=303)
+
+@app.post("/tokens/weight")
+def update_token_weight(request: Request, token_id: int = Form(...), dispatch_weight: int = Form(...), db: Session = Depends(get_db), admin=Depends(get_current_admin), csrf_token: str = Form(...)):
+    # The token's share of Pushover call slots, relative to other tokens sending at the same priority
+    verify_csrf(request, csrf_token)
+    if not 1 <= dispatch_weight <= 100:
+        return RedirectResponse(url="/pushgate/tokens?msg=Weight+must+be+between+1+and+100", status_code=303)
+    token_obj = db.query(Token).filter(Token.id == token_id).first()
+    if not token_obj:
+        return RedirectResponse(url="/pushgate/tokens?msg=Token+not+found", status_code=303)
+    token_obj.dispatch_weight = dispatch_weight
+    db.commit()
+    return RedirectResponse(url="/pushgate/tokens?msg=Weight+updated", status_code=303)
+
 @app.post("/tokens/delete")
 def delete_token(request: Request, token_id: int = Form(...), db: Session = Depends(get_db), admin=Depends(get_current_admin), csrf_token: str = Form(...)):
     verify_csrf(request, csrf_token)
@@ -108,10 +249,24 @@ def delete_token(request: Request, token_id: int = Form(...), db: Session = Depe
     return RedirectResponse(url="/pushgate/tokens?msg=Token+deleted", status_code=303)
 
 @app.get("/pushover-config", response_class=HTMLResponse)
-def pushover_config_page(request: Request, db: Session = Depends(get_db), admin=Depends(get_current_admin), msg: str = Query(None)):
+def pushover_config_page(request: Request, db: Session = Depends(get_read_db), admin=Depends(get_current_admin), msg: str = Query(None)):
     configs = db.query(PushoverConfig).all()
     csrf_token = get_csrf_token(request)
-    return templates.TemplateResponse("pushover_config.html", {"request": request, "configs": configs, "msg": msg, "csrf_token": csrf_token})
+    circuits = breakers.snapshot()
+    default = get_pushover_config(db)
+    groups = config_cache.groups(db)
+    return templates.TemplateResponse("pushover_config.html", {"request": request, "configs": configs, "circuits": circuits, "default_id": default.id if default else None, "groups": groups, "msg": msg, "csrf_token": csrf_token})
+
+@app.get("/api/pushover-config/status")
+def pushover_config_status(db: Session = Depends(get_read_db), admin=Depends(get_current_admin)):
+    # Circuit breaker state and last reported quota per config, as seen by this worker
+    circuits = breakers.snapshot()
+    return {
+        "configs": [
+            {"id": c.id, "name": c.name, **circuits.get(c.id, {"state": "closed", "quota_limit": None, "quota_remaining": None, "quota_reset": None})}
+            for c in db.query(PushoverConfig).all()
+        ]
+    }
 
 @app.post("/pushover-config/add")
 def add_pushover_config(request: Request, name: str = Form(...), app_token: str = Form(...), user_key: str = Form(...), db: Session = Depends(get_db), admin=Depends(get_current_admin), csrf_token: str = Form(...)):
@@ -121,19 +276,24 @@ def add_pushover_config(request: Request, name: str = Form(...), app_token: str
     config = PushoverConfig(name=name, encrypted_app_token=enc_app_token, encrypted_user_key=enc_user_key)
     db.add(config)
     db.commit()
+    config_cache.changed()
     return RedirectResponse(url="/pushgate/pushover-config?msg=Config+added", status_code=303)
 
 @app.post("/pushover-config/update")
-def update_pushover_config(request: Request, config_id: int = Form(...), name: str = Form(...), app_token: str = Form(...), user_key: str = Form(...), db: Session = Depends(get_db), admin=Depends(get_current_admin), csrf_token: str = Form(...)):
+def update_pushover_config(request: Request, config_id: int = Form(...), name: str = Form(...), app_token: str = Form(""), user_key: str = Form(""), db: Session = Depends(get_db), admin=Depends(get_current_admin), csrf_token: str = Form(...)):
+    # An app token or user key left empty keeps its current value, so only revealed fields change
     verify_csrf(request, csrf_token)
     config = db.query(PushoverConfig).filter(PushoverConfig.id == config_id).first()
     if not config:
         return RedirectResponse(url="/pushgate/pushover-config?msg=Config+not+found", status_code=303)
     config.name = name
-    config.encrypted_app_token = encrypt(app_token)
-    config.encrypted_user_key = encrypt(user_key)
+    if app_token.strip():
+        config.encrypted_app_token = encrypt(app_token)
+    if user_key.strip():
+        config.encrypted_user_key = encrypt(user_key)
     config.updated_at = datetime.utcnow()
     db.commit()
+    config_cache.changed()
     return RedirectResponse(url="/pushgate/pushover-config?msg=Config+updated", status_code=303)
 
 @app.post("/pushover-config/delete")
@@ -142,54 +302,453 @@ def delete_pushover_config(request: Request, config_id: int = Form(...), db: Ses
     config = db.query(PushoverConfig).filter(PushoverConfig.id == config_id).first()
     if not config:
         return RedirectResponse(url="/pushgate/pushover-config?msg=Config+not+found", status_code=303)
+    db.query(DeliveryGroupMember).filter(DeliveryGroupMember.config_id == config_id).delete(synchronize_session=False)
     db.delete(config)
     db.commit()
+    config_cache.changed()
     return RedirectResponse(url="/pushgate/pushover-config?msg=Config+deleted", status_code=303)
 
+@app.post("/pushover-config/{config_id}/reveal")
+def reveal_pushover_config(request: Request, config_id: int, db: Session = Depends(get_read_db), admin=Depends(get_current_admin), csrf_token: str = Form(...)):
+    # App token and user key of one config, for the Reveal buttons; served from the config cache
+    verify_csrf(request, csrf_token)
+    config = config_cache.get(db, config_id)
+    if not config:
+        raise HTTPException(status_code=404, detail="Config not found")
+    try:
+        app_token, user_key = credentials(config)
+    except Exception:
+        raise HTTPException(status_code=500, detail="Config could not be decrypted with the current key")
+    return _no_store({"id": config_id, "app_token": app_token, "user_key": user_key})
+
+@app.post("/pushover-config/default")
+def set_default_pushover_config(request: Request, config_id: int = Form(...), db: Session = Depends(get_db), admin=Depends(get_current_admin), csrf_token: str = Form(...)):
+    # The config /send uses when the request names none
+    verify_csrf(request, csrf_token)
+    if not db.query(PushoverConfig.id).filter(PushoverConfig.id == config_id).first():
+        return RedirectResponse(url="/pushgate/pushover-config?msg=Config+not+found", status_code=303)
+    db.query(PushoverConfig).update({PushoverConfig.is_default: PushoverConfig.id == config_id}, synchronize_session=False)
+    db.commit()
+    config_cache.changed()
+    return RedirectResponse(url="/pushgate/pushover-config?msg=Default+config+updated", status_code=303)
+
+def _save_group(db: Session, group: DeliveryGroup, name: str, config_ids):
+    # Name and members of a new or edited group; returns an error message or None
+    try:
+        name = clean_group_name(name)
+    except ValueError as e:
+        return str(e)
+    if db.query(DeliveryGroup.id).filter(DeliveryGroup.name == name, DeliveryGroup.id != (group.id or 0)).first():
+        return "Group name already in use"
+    config_ids = {i for (i,) in db.query(PushoverConfig.id).filter(PushoverConfig.id.in_(set(config_ids)))}
+    if not config_ids:
+        return "Choose at least one Pushover config"
+    group.name = name
+    group.members = [DeliveryGroupMember(config_id=i) for i in sorted(config_ids)]
+    db.add(group)
+    db.commit()
+    config_cache.changed()
+    return None
+
+@app.post("/delivery-groups/add")
+def add_delivery_group(request: Request, name: str = Form(...), config_ids: List[int] = Form([]), db: Session = Depends(get_db), admin=Depends(get_current_admin), csrf_token: str = Form(...)):
+    verify_csrf(request, csrf_token)
+    error = _save_group(db, DeliveryGroup(), name, config_ids)
+    return RedirectResponse(url=f"/pushgate/pushover-config?{urlencode({'msg': error or 'Group added'})}", status_code=303)
+
+@app.post("/delivery-groups/update")
+def update_delivery_group(request: Request, group_id: int = Form(...), name: str = Form(...), config_ids: List[int] = Form([]), db: Session = Depends(get_db), admin=Depends(get_current_admin), csrf_token: str = Form(...)):
+    verify_csrf(request, csrf_token)
+    group = db.query(DeliveryGroup).filter(DeliveryGroup.id == group_id).first()
+    if not group:
+        return RedirectResponse(url="/pushgate/pushover-config?msg=Group+not+found", status_code=303)
+    error = _save_group(db, group, name, config_ids)
+    return RedirectResponse(url=f"/pushgate/pushover-config?{urlencode({'msg': error or 'Group updated'})}", status_code=303)
+
+@app.post("/delivery-groups/delete")
+def delete_delivery_group(request: Request, group_id: int = Form(...), db: Session = Depends(get_db), admin=Depends(get_current_admin), csrf_token: str = Form(...)):
+    verify_csrf(request, csrf_token)
+    group = db.query(DeliveryGroup).filter(DeliveryGroup.id == group_id).first()
+    if not group:
+        return RedirectResponse(url="/pushgate/pushover-config?msg=Group+not+found", status_code=303)
+    db.delete(group)
+    db.commit()
+    config_cache.changed()
+    return RedirectResponse(url="/pushgate/pushover-config?msg=Group+deleted", status_code=303)
+
+def _authorize_send(db: Session, token: str, pushover_config_id: int = None, message: str = None, delivery_group: str = None, priority: int = 0):
+    # Token validation, config selection, dedup and rate limiting; runs in the threadpool.
+    # Returns (token, config or CachedGroup, dedup window or None, duplicate?)
+    with time_stage("token_lookup"):
+        valid_token = lookup_token(db, token)
+    if not valid_token:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    # Select pushover config, or the delivery group
+    with time_stage("config"):
+        if delivery_group:
+            config = config_cache.group(db, delivery_group)
+            if not config:
+                raise HTTPException(status_code=400, detail="Invalid delivery_group")
+            if not config.config_ids:
+                raise HTTPException(status_code=400, detail="Delivery group has no Pushover configs")
+        else:
+            config = get_pushover_config(db, pushover_config_id)
+    if pushover_config_id is not None and not config:
+        raise HTTPException(status_code=400, detail="Invalid pushover_config_id")
+
+    # Copies inside the token's dedup window are dropped before they use rate-limit budget
+    target_key = group_key(config) if delivery_group else (config.id if config else None)
+    window, duplicate = deduplicator.check(valid_token, target_key, message, priority) if message is not None else (None, False)
+    if duplicate:
+        db.close()
+        return valid_token, config, window, True
+
+    # Rate limit check (per-token); last, so rejected requests do not use up budget.
+    # A group send counts once, like the single message row it logs.
+    with time_stage("rate_limit"):
+        allowed = rate_limiter.consume(db, valid_token.id, valid_token.rate_limit_per_hour)
+    if not allowed:
+        RATE_LIMIT_REJECTIONS.inc()
+        if window:
+            deduplicator.discard(window)
+        raise HTTPException(status_code=429, detail=f"Rate limit exceeded. Max {valid_token.rate_limit_per_hour} messages per hour. Please try again later.")
+    # Hand the connection back before the Pushover round trip; the loaded rows stay usable
+    db.close()
+    return valid_token, config, window, False
+
+async def _send_to_group(db: Session, token_id: int, group, message: str, priority: int = 0, weight: float = 1):
+    # Fan one message out to every config in the group and log it with a delivery row per
+    # target. Returns (message id, [(config_id, status, detail, latency)]).
+    if queued_mode():
+        outcomes = [(config_id, DELIVERY_QUEUED, None, None) for config_id in group.config_ids]
+    else:
+        with time_stage("pushover"):
+            outcomes = await deliver_to_targets(db, group.config_ids, message, priority, token_id, weight)
+        # Targets behind an open circuit breaker are left to the delivery workers, or reported unavailable
+        outcomes = settle_held(outcomes, hold=BREAKER_OPEN_ACTION == "queue")
+    with time_stage("log"):
+        msg_id = await run_in_threadpool(log_group_message, db, token_id, message, group.id, outcomes, priority)
+    if any(status == DELIVERY_QUEUED for _, status, _, _ in outcomes):
+        delivery_workers.notify()
+    return msg_id, outcomes
+
+async def _send_group_response(db: Session, valid_token, group, message: str, window, priority: int = 0):
+    msg_id, outcomes = await _send_to_group(db, valid_token.id, group, message, priority, valid_token.dispatch_weight or 1)
+    status = combined_status(status for _, status, _, _ in outcomes)
+    if window:
+        # Kept while at least one target got (or may still get) the message
+        if status in ("200", STATUS_PARTIAL, DELIVERY_QUEUED):
+            deduplicator.opened(window, msg_id)
+        else:
+            deduplicator.discard(window)
+    body = {
+        "status": {"200": "ok", STATUS_PARTIAL: "partial", DELIVERY_QUEUED: DELIVERY_QUEUED}.get(status, "error"),
+        "id": msg_id,
+        "delivery_group": group.name,
+        "deliveries": [delivery_result(config_id, status_code, detail) for config_id, status_code, detail, _ in outcomes],
+    }
+    if status == DELIVERY_QUEUED:
+        return JSONResponse(body, status_code=202)
+    if status == DELIVERY_UNAVAILABLE:
+        # Every target's circuit breaker was open
+        return JSONResponse(body, status_code=503)
+    return JSONResponse(body, status_code=200 if body["status"] in ("ok", "partial") else 502)
+
+async def _schedule_response(db: Session, valid_token, target, message: str, deliver_at: datetime, priority: int = 0, group: bool = False, config_id: int = None):
+    # Store the message for the schedule timer; it is delivered like a queued message once due.
+    # Scheduled sends skip dedup: reminders with the same text at different times are all wanted.
+    # config_id is the caller's pushover_config_id: None stays None, so the default config is
+    # looked up at delivery time rather than fixed now.
+    with time_stage("enqueue"):
+        if group:
+            msg_id, scheduled_id = await run_in_threadpool(schedule_message, db, valid_token.id, message, deliver_at, None, target, priority)
+        else:
+            msg_id, scheduled_id = await run_in_threadpool(schedule_message, db, valid_token.id, message, deliver_at, config_id, None, priority)
+    schedule_timer.add(deliver_at, scheduled_id)
+    body = {"status": STATUS_SCHEDULED, "id": msg_id, "deliver_at": deliver_at.isoformat()}
+    if group:
+        body["delivery_group"] = target.name
+    return JSONResponse(body, status_code=202)
+
 @app.post("/send")
-def send_message(token: str = Form(...), message: str = Form(...), db: Session = Depends(get_db), pushover_config_id: int = Form(None)):
+async def send_message(token: str = Form(...), message: str = Form(...), db: Session = Depends(get_db), pushover_config_id: int = Form(None), delivery_group: str = Form(None), priority: int = Form(0), deliver_at: str = Form(None), delay: int = Form(None)):
     # Input validation (Pushover rules)
     if not message or len(message.encode('utf-8')) > 1024:
         raise HTTPException(status_code=400, detail="Message is required and must be at most 1024 UTF-8 bytes.")
     if not token or not re.fullmatch(r"[A-Za-z0-9]{30}", token):
         raise HTTPException(status_code=400, detail="Token must be 30 alphanumeric characters.")
+    if delivery_group and pushover_config_id is not None:
+        raise HTTPException(status_code=400, detail="Give either pushover_config_id or delivery_group, not both.")
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail="priority must be between -2 and 2.")
+    try:
+        scheduled_at = deliver_time(deliver_at, delay)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    # Validate token
-    token_objs = db.query(Token).all()
-    valid_token = None
-    for t in token_objs:
-        try:
-            if decrypt(t.encrypted_token) == token:
-                valid_token = t
-                break
-        except Exception:
-            continue
-    if not valid_token:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
-    # Rate limit check (per-token)
-    if not check_token_rate_limit(db, valid_token.id, valid_token.rate_limit_per_hour):
-        raise HTTPException(status_code=429, detail=f"Rate limit exceeded. Max {valid_token.rate_limit_per_hour} messages per hour. Please try again later.")
-
-    # Select pushover config
-    config = None
-    if pushover_config_id is not None:
-        config = db.query(PushoverConfig).filter(PushoverConfig.id == pushover_config_id).first()
-        if not config:
-            raise HTTPException(status_code=400, detail="Invalid pushover_config_id")
+    # DB work stays off the event loop; only the Pushover round trip is awaited here
+    dedup_text = message if scheduled_at is None else None
+    valid_token, config, window, duplicate = await run_in_threadpool(_authorize_send, db, token, pushover_config_id, dedup_text, delivery_group, priority)
+    if duplicate:
+        # Same text through the same token within its dedup window: counted, not sent
+        return {"status": "duplicate", "id": window.message_id, "suppressed": window.suppressed}
+    if scheduled_at is not None:
+        return await _schedule_response(db, valid_token, config, message, scheduled_at, priority, group=bool(delivery_group), config_id=pushover_config_id)
+    if delivery_group:
+        return await _send_group_response(db, valid_token, config, message, window, priority)
+    if queued_mode():
+        # Accept now, deliver from the background workers
+        with time_stage("enqueue"):
+            msg = await run_in_threadpool(enqueue_message, db, valid_token.id, message, config.id if config else None, priority)
+        delivery_workers.notify()
+        if window:
+            deduplicator.opened(window, msg.id)
+        return JSONResponse({"status": "queued", "id": msg.id}, status_code=202)
     # Send to Pushover
-    status_code, resp_text = send_pushover_message(db, message, config=config)
+    with time_stage("pushover"):
+        status_code, resp_text, latency = await deliver_timed(config, message, priority, valid_token.id, valid_token.dispatch_weight or 1)
+    if status_code == STATUS_CIRCUIT_OPEN:
+        # Pushover is failing or our quota is used up: fail fast, or hold the message for the workers
+        if BREAKER_OPEN_ACTION == "queue":
+            msg = await run_in_threadpool(enqueue_message, db, valid_token.id, message, config.id, priority)
+            if window:
+                deduplicator.opened(window, msg.id)
+            return JSONResponse({"status": "queued", "id": msg.id}, status_code=202)
+        if window:
+            deduplicator.discard(window)
+        retry_after = breakers.get(config.id).retry_after()
+        raise HTTPException(status_code=503, detail=resp_text, headers={"Retry-After": str(max(1, round(retry_after)))})
     # Log message
-    from .models import Message
-    msg = Message(token_id=valid_token.id, message=message, status=str(status_code), timestamp=datetime.utcnow())
-    db.add(msg)
-    db.commit()
+    with time_stage("log"):
+        msg_id = await log_message(valid_token.id, message, status_code, wait=window is not None, config_id=config.id, latency=latency, priority=priority)
+    if window:
+        if status_code == 200:
+            deduplicator.opened(window, msg_id)
+        else:
+            deduplicator.discard(window)
 
     if status_code == 200:
         return {"status": "ok", "pushover_response": resp_text}
     else:
         raise HTTPException(status_code=502, detail=f"Pushover error: {resp_text}")
 
+def _collapse_target(window):
+    # Config for a "(repeated xN)" summary, or None if the token is gone or out of budget
+    db = SessionLocal()
+    try:
+        token_obj = db.query(Token).filter(Token.id == window.token_id).first()
+        if not token_obj or not rate_limiter.consume(db, token_obj.id, token_obj.rate_limit_per_hour):
+            return None
+        return group_from_key(db, window.config_id) or get_pushover_config(db, window.config_id)
+    finally:
+        db.close()
+
+async def _send_collapsed(window):
+    config = await run_in_threadpool(_collapse_target, window)
+    if config is None:
+        return
+    text = collapsed_text(window.message, window.suppressed)
+    if isinstance(config, CachedGroup):
+        db = SessionLocal()
+        try:
+            await _send_to_group(db, window.token_id, config, text, window.priority)
+        finally:
+            db.close()
+        return
+    status_code, _, latency = await deliver_timed(config, text, window.priority, window.token_id)
+    await log_message(window.token_id, text, status_code, config_id=config.id, latency=latency, priority=window.priority)
+
+deduplicator.on_collapse = _send_collapsed
+
+BATCH_MAX_MESSAGES = int(os.getenv("PUSHGATE_BATCH_MAX_MESSAGES", "100"))
+
+class BatchItem(BaseModel):
+    message: str
+    pushover_config_id: Optional[int] = None
+    priority: int = 0
+
+class BatchRequest(BaseModel):
+    token: str
+    messages: List[BatchItem]
+
+def _message_error(item: BatchItem):
+    if not item.message or len(item.message.encode('utf-8')) > 1024:
+        return "Message is required and must be at most 1024 UTF-8 bytes."
+    if item.priority not in PRIORITIES:
+        return "priority must be between -2 and 2."
+    return None
+
+def _authorize_batch(db: Session, token: str, items):
+    # One token lookup and one rate-limit step for the whole batch; each item's config comes from
+    # the in-memory config cache.
+    # Returns (token, {index: config}, {index: error}, {index: dedup window}, {index: window of a duplicate})
+    # where only the items in the config map are sent.
+    valid_token = lookup_token(db, token)
+    if not valid_token:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    errors = {i: e for i, e in ((i, _message_error(item)) for i, item in enumerate(items)) if e}
+    targets = {}
+    for i, item in enumerate(items):
+        if i in errors:
+            continue
+        config = get_pushover_config(db, item.pushover_config_id)
+        if config is None and item.pushover_config_id is not None:
+            errors[i] = "Invalid pushover_config_id"
+        else:
+            targets[i] = config
+    # Copies inside the token's dedup window are answered as duplicates and use no budget, as on /send
+    windows, duplicates = {}, {}
+    for i in list(targets):
+        config = targets[i]
+        window, duplicate = deduplicator.check(valid_token, config.id if config else None, items[i].message, items[i].priority)
+        if duplicate:
+            duplicates[i] = window
+            del targets[i]
+        elif window:
+            windows[i] = window
+    if targets and not rate_limiter.consume(db, valid_token.id, valid_token.rate_limit_per_hour, count=len(targets)):
+        RATE_LIMIT_REJECTIONS.inc()
+        for window in windows.values():
+            deduplicator.discard(window)
+        raise HTTPException(status_code=429, detail=f"Rate limit exceeded. Max {valid_token.rate_limit_per_hour} messages per hour; this batch needs {len(targets)}. Please try again later.")
+    db.close()
+    return valid_token, targets, errors, windows, duplicates
+
+def _settle_windows(windows, sent):
+    # Keep the dedup windows of items that went out or were queued ({index: message id}); drop the rest
+    for i, window in windows.items():
+        if i in sent:
+            deduplicator.opened(window, sent[i])
+        else:
+            deduplicator.discard(window)
+
+def _log_messages(db: Session, token_id: int, entries):
+    # entries: [(message, status, config_id, latency, priority)]; all rows and their usage in one transaction
+    now = datetime.utcnow()
+    msgs = [Message(token_id=token_id, message=message, status=str(status_code), timestamp=now, priority=priority) for message, status_code, _, _, priority in entries]
+    db.add_all(msgs)
+    record_usage(db, [(now, token_id, config_id, str(status_code), latency) for _, status_code, config_id, latency, _ in entries])
+    db.commit()
+    return [m.id for m in msgs]
+
+async def _deliver_or_error(config, item: BatchItem, token):
+    if not config:
+        return "error", "Pushover config not set", None
+    return await deliver_timed(config, item.message, item.priority, token.id, token.dispatch_weight or 1)
+
+@app.post("/send/batch")
+async def send_batch(batch: BatchRequest, db: Session = Depends(get_db)):
+    if not re.fullmatch(r"[A-Za-z0-9]{30}", batch.token):
+        raise HTTPException(status_code=400, detail="Token must be 30 alphanumeric characters.")
+    if not batch.messages or len(batch.messages) > BATCH_MAX_MESSAGES:
+        raise HTTPException(status_code=400, detail=f"A batch must contain between 1 and {BATCH_MAX_MESSAGES} messages.")
+    items = batch.messages
+    valid_token, targets, errors, windows, duplicates = await run_in_threadpool(_authorize_batch, db, batch.token, items)
+    results = [{"index": i, "status": "invalid", "detail": errors[i]} if i in errors else None for i in range(len(items))]
+    for i, window in duplicates.items():
+        results[i] = {"index": i, "status": "duplicate", "id": window.message_id, "suppressed": window.suppressed}
+    indexes = sorted(targets)
+    sent = {}
+
+    if queued_mode():
+        msgs = await run_in_threadpool(enqueue_messages, db, valid_token.id, [(items[i].message, targets[i].id if targets[i] else None, items[i].priority) for i in indexes])
+        delivery_workers.notify()
+        for i, msg in zip(indexes, msgs):
+            results[i] = {"index": i, "status": "queued", "id": msg.id}
+            sent[i] = msg.id
+        _settle_windows(windows, sent)
+        return JSONResponse({"results": results}, status_code=202)
+
+    # Send concurrently over the shared connection pool, then log every row in one commit
+    outcomes = await asyncio.gather(*(_deliver_or_error(targets[i], items[i], valid_token) for i in indexes))
+    held = [(i, resp_text) for i, (status_code, resp_text, _) in zip(indexes, outcomes) if status_code == STATUS_CIRCUIT_OPEN]
+    if held:
+        # Items whose config has an open circuit breaker never reached Pushover
+        held_indexes = {i for i, _ in held}
+        if BREAKER_OPEN_ACTION == "queue":
+            msgs = await run_in_threadpool(enqueue_messages, db, valid_token.id, [(items[i].message, targets[i].id, items[i].priority) for i, _ in held])
+            for (i, _), msg in zip(held, msgs):
+                results[i] = {"index": i, "status": "queued", "id": msg.id}
+                sent[i] = msg.id
+        else:
+            for i, resp_text in held:
+                results[i] = {"index": i, "status": "unavailable", "detail": resp_text, "retry_after": round(breakers.get(targets[i].id).retry_after())}
+        outcomes = [o for i, o in zip(indexes, outcomes) if i not in held_indexes]
+        indexes = [i for i in indexes if i not in held_indexes]
+    entries = [(items[i].message, status_code, targets[i].id if targets[i] else None, latency, items[i].priority) for i, (status_code, _, latency) in zip(indexes, outcomes)]
+    ids = await run_in_threadpool(_log_messages, db, valid_token.id, entries)
+    for i, msg_id, (status_code, resp_text, _) in zip(indexes, ids, outcomes):
+        if status_code == 200:
+            results[i] = {"index": i, "status": "ok", "id": msg_id, "pushover_response": resp_text}
+            sent[i] = msg_id
+        else:
+            results[i] = {"index": i, "status": "error", "id": msg_id, "detail": f"Pushover error: {resp_text}"}
+    _settle_windows(windows, sent)
+    return {"results": results}
+
+@app.get("/send/{message_id}")
+def send_status(message_id: int, x_pushgate_token: str = Header(...), db: Session = Depends(get_db)):
+    # Delivery status of a message sent with this token (used with queued mode)
+    valid_token = lookup_token(db, x_pushgate_token)
+    if not valid_token:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    msg = db.query(Message).filter(Message.id == message_id, Message.token_id == valid_token.id).first()
+    if not msg:
+        raise HTTPException(status_code=404, detail="Message not found")
+    result = {"id": msg.id, "status": msg.status, "timestamp": msg.timestamp, "deliver_at": scheduled_for(db, msg.id), **queue_status(db, msg.id)}
+    deliveries = deliveries_for(db, [msg.id]).get(msg.id)
+    if deliveries:
+        # Group sends: one entry per target config
+        result["deliveries"] = [{"config_id": d.config_id, "status": d.status, "detail": d.detail, "updated_at": d.updated_at} for d in deliveries]
+    return result
+
+@app.delete("/send/{message_id}")
+def cancel_send(message_id: int, x_pushgate_token: str = Header(...), db: Session = Depends(get_db)):
+    # Cancel a scheduled message sent with this token, as long as it is not due yet
+    valid_token = lookup_token(db, x_pushgate_token)
+    if not valid_token:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    msg = db.query(Message).filter(Message.id == message_id, Message.token_id == valid_token.id).first()
+    if not msg:
+        raise HTTPException(status_code=404, detail="Message not found")
+    if not cancel_scheduled(db, msg.id):
+        raise HTTPException(status_code=409, detail="Message is not scheduled; it was already released for delivery or cancelled")
+    return {"id": message_id, "status": "cancelled"}
+
+def _queue_depth():
+    # {priority: rows waiting in the outbound queue}
+    db = SessionLocal()
+    try:
+        return dict(db.query(OutboundQueue.priority, func.count()).group_by(OutboundQueue.priority).all())
+    finally:
+        db.close()
+
+def _scheduled_count():
+    db = SessionLocal()
+    try:
+        return count_scheduled(db)
+    finally:
+        db.close()
+
+@app.get("/api/dispatch")
+async def dispatch_status(admin=Depends(get_current_admin)):
+    # This worker's dispatch scheduler (Pushover calls in flight, sends waiting per priority
+    # lane) and the shared outbound queue per priority
+    depth = await run_in_threadpool(_queue_depth)
+    return {**scheduler.snapshot(), "queued": {str(p): depth.get(p, 0) for p in reversed(PRIORITIES)}}
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus exposition; gauges that are cheaper to read than to maintain are sampled here
+    depth = await run_in_threadpool(_queue_depth)
+    QUEUE_DEPTH.set(sum(depth.values()))
+    SCHEDULED_MESSAGES.set(await run_in_threadpool(_scheduled_count))
+    for priority in PRIORITIES:
+        QUEUE_DEPTH_BY_PRIORITY.labels(str(priority)).set(depth.get(priority, 0))
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
+
 @app.get("/login", response_class=HTMLResponse)
 def login_page(request: Request, msg: str = Query(None)):
     csrf_token = get_csrf_token(request)
@@ -214,67 +773,146 @@ def logout(request: Request):
 @app.get("/messages", response_class=HTMLResponse)
 def messages_page(
     request: Request,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     admin=Depends(get_current_admin),
+    token: str = Query(None),
     token_id: int = Query(None),
     status: str = Query(None),
     search: str = Query(None),
-    page: int = Query(1, ge=1),
+    before: str = Query(None),
+    after: str = Query(None),
     page_size: int = Query(20, ge=1, le=100),
 ):
-    query = db.query(Message)
-    if token_id:
-        query = query.filter(Message.token_id == token_id)
-    if status:
-        query = query.filter(Message.status == status)
-    if search:
-        query = query.filter(Message.message.ilike(f"%{search}%"))
-    total = query.count()
-    messages = (
-        query.order_by(Message.timestamp.desc())
-        .offset((page - 1) * page_size)
-        .limit(page_size)
-        .all()
-    )
-    tokens = db.query(Token).all()
-    token_map = {t.id: decrypt(t.encrypted_token) for t in tokens}
+    # token is a token id or label; token_id is still accepted for old links
+    token = (token or (str(token_id) if token_id else "")).strip()
+    token_id = resolve_token_ref(db, token) if token else None
+    if token and token_id is None:
+        page = {"messages": [], "newer_cursor": None, "older_cursor": None}
+        total = 0
+    else:
+        page = message_page(db, token_id, status, search, page_size, before=before, after=after)
+        total = count_messages(db, token_id, status, search)
+    filters = {"token": token, "status": status or "", "search": search or "", "page_size": page_size}
+    newer_url = f"?{urlencode({**filters, 'after': page['newer_cursor']})}" if page["newer_cursor"] else None
+    older_url = f"?{urlencode({**filters, 'before': page['older_cursor']})}" if page["older_cursor"] else None
+    export_filters = {"token_id": token_id or "", "status": status or "", "search": search or ""}
+    export_query = urlencode({k: v for k, v in export_filters.items() if v})
     return templates.TemplateResponse(
         "messages.html",
         {
             "request": request,
-            "messages": messages,
-            "token_map": token_map,
-            "token_id": token_id,
+            "messages": page["messages"],
+            "token_names": token_names(db, {m.token_id for m in page["messages"]}),
+            "deliveries": deliveries_for(db, [m.id for m in page["messages"]]),
+            "config_names": {c.id: c.name for c in config_cache.all(db)},
+            "token": token,
+            "unknown_token": bool(token) and token_id is None,
             "status": status,
             "search": search,
-            "page": page,
             "page_size": page_size,
             "total": total,
+            "newer_url": newer_url,
+            "older_url": older_url,
+            "export_query": export_query,
         },
     )
 
+@app.get("/messages/export")
+def export_messages_route(
+    request: Request,
+    admin=Depends(get_current_admin),
+    format: str = Query("csv"),
+    token_id: int = Query(None),
+    status: str = Query(None),
+    search: str = Query(None),
+    since: datetime = Query(None),
+    until: datetime = Query(None),
+    gzip: bool = Query(False),
+):
+    # Same filters as the history view (plus a since/until time range), streamed oldest first.
+    # gzip=true downloads a .gz file; otherwise the body is gzip-encoded when the client accepts it.
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    encode = not gzip and "gzip" in request.headers.get("accept-encoding", "")
+    filename = f"messages-{datetime.utcnow():%Y%m%d-%H%M%S}.{format}" + (".gz" if gzip else "")
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if encode:
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+    media_type = "application/gzip" if gzip else ("text/csv" if format == "csv" else "application/x-ndjson")
+    body = export_messages(ReadSessionLocal, format, compress=gzip or encode, token_id=token_id, status=status, search=search, since=since, until=until)
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+STATS_RANGES = {"1h": 1, "6h": 6, "24h": 24, "7d": 24 * 7, "30d": 24 * 30}
+
+def _stats_range(range_: str, since: datetime, until: datetime):
+    if since:
+        return since, until
+    if range_ not in STATS_RANGES:
+        raise HTTPException(status_code=400, detail=f"range must be one of {', '.join(STATS_RANGES)}")
+    return datetime.utcnow() - timedelta(hours=STATS_RANGES[range_]), until
+
+@app.get("/stats", response_class=HTMLResponse)
+def stats_page(request: Request, db: Session = Depends(get_read_db), admin=Depends(get_current_admin), range: str = Query("24h"), token_id: int = Query(None)):
+    since, until = _stats_range(range, None, None)
+    stats = usage_stats(db, since, until, token_id=token_id)
+    config_names = {c.id: c.name for c in db.query(PushoverConfig.id, PushoverConfig.name)}
+    return templates.TemplateResponse("stats.html", {"request": request, "stats": stats, "range": range, "ranges": list(STATS_RANGES), "token_id": token_id, "config_names": config_names})
+
+@app.get("/api/stats")
+def stats_api(
+    db: Session = Depends(get_read_db),
+    admin=Depends(get_current_admin),
+    range: str = Query("24h"),
+    since: datetime = Query(None),
+    until: datetime = Query(None),
+    token_id: int = Query(None),
+    config_id: int = Query(None),
+):
+    # Served from the usage rollups; cost depends on the range, not on the size of the message log
+    since, until = _stats_range(range, since, until)
+    return usage_stats(db, since, until, token_id=token_id, config_id=config_id)
+
+@app.get("/api/messages/search")
+def search_messages_api(
+    db: Session = Depends(get_read_db),
+    admin=Depends(get_current_admin),
+    q: str = Query(..., min_length=1),
+    token_id: int = Query(None),
+    status: str = Query(None),
+    limit: int = Query(50, ge=1, le=500),
+):
+    # Ranked full-text search (best match first); newest-first substring search on non-SQLite backends
+    results = search_messages(db, q, limit=limit, token_id=token_id, status=status)
+    return {
+        "query": q,
+        "results": [
+            {"id": m.id, "token_id": m.token_id, "message": m.message, "status": m.status, "timestamp": m.timestamp, "score": None if score is None else -score}
+            for m, score in results
+        ],
+    }
+
 @app.get("/send-message", response_class=HTMLResponse)
-def send_message_form(request: Request, db: Session = Depends(get_db), admin=Depends(get_current_admin), msg: str = Query(None), error: str = Query(None)):
+def send_message_form(request: Request, db: Session = Depends(get_read_db), admin=Depends(get_current_admin), msg: str = Query(None), error: str = Query(None)):
     configs = db.query(PushoverConfig).all()
     return templates.TemplateResponse("send_message.html", {"request": request, "msg": msg, "error": error, "configs": configs})
 
+def _admin_send_target(db: Session, pushover_config_id: int):
+    token_obj = db.query(Token).first()
+    config = get_pushover_config(db, pushover_config_id)
+    return token_obj, config
+
 @app.post("/send-message", response_class=HTMLResponse)
-def send_message_admin(request: Request, message: str = Form(...), pushover_config_id: int = Form(...), db: Session = Depends(get_db), admin=Depends(get_current_admin)):
-    from .models import Token, PushoverConfig, Message
-    from .pushover import send_pushover_message
-    tokens = db.query(Token).all()
-    if not tokens:
+async def send_message_admin(request: Request, message: str = Form(...), pushover_config_id: int = Form(...), db: Session = Depends(get_db), admin=Depends(get_current_admin)):
+    token_obj, config = await run_in_threadpool(_admin_send_target, db, pushover_config_id)
+    if not token_obj:
         return RedirectResponse(url="/pushgate/send-message?error=No+tokens+available", status_code=303)
-    token = decrypt(tokens[0].encrypted_token)
-    config = db.query(PushoverConfig).filter(PushoverConfig.id == pushover_config_id).first()
     if not config:
         return RedirectResponse(url="/pushgate/send-message?error=Invalid+Pushover+config", status_code=303)
     try:
-        status_code, resp_text = send_pushover_message(db, message, config=config)
+        status_code, resp_text, latency = await deliver_timed(config, message)
         # Log message
-        msg = Message(token_id=tokens[0].id, message=message, status=str(status_code), timestamp=datetime.utcnow())
-        db.add(msg)
-        db.commit()
+        await log_message(token_obj.id, message, status_code, config_id=config.id, latency=latency)
         if status_code == 200:
             return RedirectResponse(url="/pushgate/send-message?msg=Message+sent", status_code=303)
         else:
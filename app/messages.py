@@ -0,0 +1,127 @@
+import base64
+import csv
+import io
+import json
+import os
+import zlib
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+from .cache import TTLCache
+from .models import Message
+from .search import search_filter
+
+# Totals for the history view are cached per filter, so paging and refreshing do not re-count the log
+MESSAGE_COUNT_CACHE_SECONDS = float(os.getenv("PUSHGATE_MESSAGE_COUNT_CACHE_SECONDS", "30"))
+_count_cache = TTLCache(maxsize=256, ttl=MESSAGE_COUNT_CACHE_SECONDS)
+# Rows fetched from the cursor at a time, and bytes buffered before a chunk goes out, during an export
+EXPORT_FETCH_SIZE = int(os.getenv("PUSHGATE_EXPORT_FETCH_SIZE", "1000"))
+EXPORT_CHUNK_BYTES = 64 * 1024
+EXPORT_FORMATS = ("csv", "jsonl")
+EXPORT_COLUMNS = ("id", "timestamp", "token_id", "status", "suppressed_count", "message")
+
+def filter_messages(query, token_id: int = None, status: str = None, search: str = None, since: datetime = None, until: datetime = None):
+    if since:
+        query = query.filter(Message.timestamp >= since)
+    if until:
+        query = query.filter(Message.timestamp < until)
+    if token_id:
+        query = query.filter(Message.token_id == token_id)
+    if status:
+        query = query.filter(Message.status == status)
+    if search:
+        query = query.filter(search_filter(query.session, search))
+    return query
+
+def encode_cursor(msg: Message) -> str:
+    raw = f"{msg.timestamp.isoformat()}|{msg.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, msg_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(ts), int(msg_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def message_page(db: Session, token_id: int = None, status: str = None, search: str = None, page_size: int = 20, before: str = None, after: str = None):
+    # Keyset pagination, newest first, on (timestamp, id). `before` pages towards older
+    # messages and `after` towards newer ones; either way only page_size + 1 rows are read.
+    query = filter_messages(db.query(Message), token_id, status, search)
+    if after:
+        ts, msg_id = decode_cursor(after)
+        query = query.filter(or_(Message.timestamp > ts, and_(Message.timestamp == ts, Message.id > msg_id)))
+        rows = query.order_by(Message.timestamp.asc(), Message.id.asc()).limit(page_size + 1).all()
+        has_more = len(rows) > page_size
+        rows = list(reversed(rows[:page_size]))
+        has_newer, has_older = has_more, True
+    else:
+        if before:
+            ts, msg_id = decode_cursor(before)
+            query = query.filter(or_(Message.timestamp < ts, and_(Message.timestamp == ts, Message.id < msg_id)))
+        rows = query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(page_size + 1).all()
+        has_older = len(rows) > page_size
+        rows = rows[:page_size]
+        has_newer = bool(before)
+    return {
+        "messages": rows,
+        "newer_cursor": encode_cursor(rows[0]) if rows and has_newer else None,
+        "older_cursor": encode_cursor(rows[-1]) if rows and has_older else None,
+    }
+
+def count_messages(db: Session, token_id: int = None, status: str = None, search: str = None):
+    key = (token_id or None, status or None, search or None)
+    total = _count_cache.get(key)
+    if total is None:
+        total = filter_messages(db.query(Message), token_id, status, search).count()
+        _count_cache.set(key, total)
+    return total
+
+def _export_lines(rows, fmt: str):
+    if fmt == "jsonl":
+        for row in rows:
+            record = dict(zip(EXPORT_COLUMNS, row))
+            record["timestamp"] = record["timestamp"].isoformat() if record["timestamp"] else None
+            yield json.dumps(record) + "\n"
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def export_messages(session_factory, fmt: str = "csv", compress: bool = False, token_id: int = None, status: str = None,
+                    search: str = None, since: datetime = None, until: datetime = None):
+    # Generator of output chunks, oldest message first. Rows come off one streamed query,
+    # EXPORT_FETCH_SIZE at a time, as plain tuples; neither the result nor the output is ever held
+    # whole, so memory stays flat whatever the row count. With compress, chunks are gzip data.
+    # The generator owns its session, since it outlives the request handler.
+    db = session_factory()
+    try:
+        columns = [getattr(Message, c) for c in EXPORT_COLUMNS]
+        query = filter_messages(db.query(*columns), token_id, status, search, since, until).order_by(Message.id)
+        rows = query.execution_options(stream_results=True, yield_per=EXPORT_FETCH_SIZE)
+        gzipper = zlib.compressobj(wbits=31) if compress else None
+        pending, size = [], 0
+        for line in _export_lines(rows, fmt):
+            pending.append(line)
+            size += len(line)
+            if size >= EXPORT_CHUNK_BYTES:
+                data = "".join(pending).encode()
+                pending, size = [], 0
+                data = gzipper.compress(data) if gzipper else data
+                if data:
+                    yield data
+        data = "".join(pending).encode()
+        if gzipper:
+            data = gzipper.compress(data) + gzipper.flush()
+        if data:
+            yield data
+    finally:
+        db.close()
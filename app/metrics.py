@@ -0,0 +1,105 @@
+import os
+import time
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import REGISTRY, multiprocess
+from sqlalchemy import event
+
+# With several uvicorn workers, set PROMETHEUS_MULTIPROC_DIR to an empty, writable directory;
+# every worker then writes its samples there and /metrics aggregates all of them.
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+SEND_STAGE_SECONDS = Histogram(
+    "pushgate_send_stage_seconds", "Time spent in each stage of a send", ["stage"], buckets=LATENCY_BUCKETS
+)
+PUSHOVER_REQUEST_SECONDS = Histogram(
+    "pushgate_pushover_request_seconds", "Pushover API round trip time", buckets=LATENCY_BUCKETS
+)
+PUSHOVER_RESPONSES = Counter(
+    "pushgate_pushover_responses_total", "Pushover API responses by HTTP status ('error' for transport failures)", ["status"]
+)
+HTTP_RESPONSES = Counter(
+    "pushgate_http_responses_total", "HTTP responses by route and status", ["method", "route", "status"]
+)
+DEDUP_SUPPRESSED = Counter("pushgate_dedup_suppressed_total", "Duplicate messages suppressed by per-token dedup windows")
+MESSAGES_ARCHIVED = Counter("pushgate_messages_archived_total", "Messages moved from the database to the archive by the retention job")
+RATE_LIMIT_REJECTIONS = Counter("pushgate_rate_limit_rejections_total", "Requests rejected by the per-token rate limit")
+QUEUE_DEPTH = Gauge("pushgate_queue_depth", "Messages waiting in the outbound queue", multiprocess_mode="mostrecent")
+QUEUE_DEPTH_BY_PRIORITY = Gauge(
+    "pushgate_queue_depth_by_priority", "Messages waiting in the outbound queue per priority lane", ["priority"], multiprocess_mode="mostrecent"
+)
+SCHEDULED_MESSAGES = Gauge("pushgate_scheduled_messages", "Messages waiting for their deliver_at time", multiprocess_mode="mostrecent")
+DISPATCH_BACKLOG = Gauge(
+    "pushgate_dispatch_backlog", "Sends waiting for a Pushover call slot, per priority lane", ["priority"], multiprocess_mode="livesum"
+)
+DISPATCH_INFLIGHT = Gauge("pushgate_dispatch_inflight", "Pushover calls in flight", multiprocess_mode="livesum")
+DISPATCH_WAIT_SECONDS = Histogram(
+    "pushgate_dispatch_wait_seconds", "Time a send waited for a Pushover call slot", ["priority"], buckets=LATENCY_BUCKETS
+)
+PUSHOVER_QUOTA_REMAINING = Gauge(
+    "pushgate_pushover_quota_remaining", "Messages left this month (X-Limit-App-Remaining)", ["config"], multiprocess_mode="mostrecent"
+)
+PUSHOVER_QUOTA_LIMIT = Gauge(
+    "pushgate_pushover_quota_limit", "Monthly message limit (X-Limit-App-Limit)", ["config"], multiprocess_mode="mostrecent"
+)
+CIRCUIT_STATE = Gauge(
+    "pushgate_circuit_state", "Circuit breaker state per Pushover config: 0 closed, 1 half open, 2 open", ["config"], multiprocess_mode="max"
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "pushgate_db_pool_checked_out", "Database connections currently checked out", ["pool"], multiprocess_mode="livesum"
+)
+
+class time_stage:
+    # with time_stage("token_lookup"): ...  -- observes into pushgate_send_stage_seconds
+    def __init__(self, stage: str):
+        self.histogram = SEND_STAGE_SECONDS.labels(stage)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+def observe_pushover(status, seconds: float):
+    PUSHOVER_REQUEST_SECONDS.observe(seconds)
+    PUSHOVER_RESPONSES.labels(str(status)).inc()
+
+def instrument_pool(engine, name: str):
+    gauge = DB_POOL_CHECKED_OUT.labels(name)
+    event.listen(engine, "checkout", lambda *args: gauge.inc())
+    event.listen(engine, "checkin", lambda *args: gauge.dec())
+
+class MetricsMiddleware:
+    # Plain ASGI middleware (no BaseHTTPMiddleware overhead) counting responses per route template
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status_holder = {}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_RESPONSES.labels(scope["method"], getattr(route, "path", "unmatched"), str(status_holder.get("status", 500))).inc()
+
+def render_metrics():
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+def mark_process_dead():
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,142 @@
+from datetime import datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+
+# Versioned schema migrations. create_all() only creates missing tables, so any change to an
+# existing table is added here as the next version. Each migration must be safe to run on a
+# database that create_all() just built from the current models (hence IF NOT EXISTS / column checks).
+MIGRATIONS = []
+
+def migration(version: int, description: str):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+def _columns(conn, table: str):
+    return {c["name"] for c in inspect(conn).get_columns(table)}
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, description VARCHAR NOT NULL, applied_at DATETIME NOT NULL)"
+    ))
+
+def applied_versions(engine):
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+def pending_migrations(engine):
+    applied = applied_versions(engine)
+    return [m for m in MIGRATIONS if m[0] not in applied]
+
+def migrate(engine, target: int = None, log=None):
+    # Apply pending migrations in order, each in its own transaction; returns the versions applied
+    done = []
+    for version, description, fn in pending_migrations(engine):
+        if target is not None and version > target:
+            break
+        try:
+            with engine.begin() as conn:
+                # Another process may have applied it since pending_migrations() looked
+                if conn.execute(text("SELECT 1 FROM schema_migrations WHERE version = :v"), {"v": version}).first():
+                    continue
+                if log:
+                    log(f"Applying migration {version}: {description}")
+                fn(conn)
+                conn.execute(
+                    text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)"),
+                    {"v": version, "d": description, "t": datetime.utcnow()},
+                )
+        except IntegrityError:
+            # ...or between that check and the insert; its copy stands and this one is rolled back
+            continue
+        done.append(version)
+    return done
+
+@migration(1, "Add tokens.token_digest lookup column")
+def _token_digest(conn):
+    if "token_digest" not in _columns(conn, "tokens"):
+        conn.execute(text("ALTER TABLE tokens ADD COLUMN token_digest VARCHAR(64)"))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_tokens_token_digest ON tokens (token_digest)"))
+
+@migration(2, "Add messages indexes for rate limiting and history filtering")
+def _message_indexes(conn):
+    # Rate limit: WHERE token_id = ? AND timestamp >= ?  (the index alone answers the COUNT)
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_token_id_timestamp ON messages (token_id, timestamp)"))
+    # History: WHERE status = ? ORDER BY timestamp, and the unfiltered ORDER BY timestamp
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_status_timestamp ON messages (status, timestamp)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_timestamp ON messages (timestamp)"))
+    conn.execute(text("ANALYZE messages"))
+
+@migration(3, "Add messages_fts full-text index (SQLite FTS5 only)")
+def _messages_fts(conn):
+    # External-content FTS5 table over messages.message, kept in sync by triggers. Skipped on other
+    # backends or SQLite builds without FTS5; search then falls back to ILIKE.
+    if conn.dialect.name != "sqlite":
+        return
+    try:
+        conn.exec_driver_sql("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(message, content='messages', content_rowid='id')")
+    except Exception:
+        return
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN "
+        "INSERT INTO messages_fts(rowid, message) VALUES (new.id, new.message); END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, message) VALUES ('delete', old.id, old.message); END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF message ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, message) VALUES ('delete', old.id, old.message); "
+        "INSERT INTO messages_fts(rowid, message) VALUES (new.id, new.message); END"
+    )
+    # Index the rows that existed before the table did
+    conn.exec_driver_sql("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+
+@migration(4, "Add per-token dedup settings and messages.suppressed_count")
+def _dedup_columns(conn):
+    tokens = _columns(conn, "tokens")
+    if "dedup_window_seconds" not in tokens:
+        conn.execute(text("ALTER TABLE tokens ADD COLUMN dedup_window_seconds INTEGER"))
+    if "dedup_mode" not in tokens:
+        conn.execute(text("ALTER TABLE tokens ADD COLUMN dedup_mode VARCHAR(16) DEFAULT 'drop'"))
+    if "suppressed_count" not in _columns(conn, "messages"):
+        conn.execute(text("ALTER TABLE messages ADD COLUMN suppressed_count INTEGER NOT NULL DEFAULT 0"))
+
+@migration(5, "Add tokens.retention_days")
+def _retention_days(conn):
+    if "retention_days" not in _columns(conn, "tokens"):
+        conn.execute(text("ALTER TABLE tokens ADD COLUMN retention_days INTEGER"))
+
+@migration(6, "Add pushover_config.is_default")
+def _config_default(conn):
+    if "is_default" not in _columns(conn, "pushover_config"):
+        conn.execute(text("ALTER TABLE pushover_config ADD COLUMN is_default BOOLEAN NOT NULL DEFAULT 0"))
+
+@migration(7, "Add tokens.token_prefix and tokens.label")
+def _token_label(conn):
+    tokens = _columns(conn, "tokens")
+    if "token_prefix" not in tokens:
+        conn.execute(text("ALTER TABLE tokens ADD COLUMN token_prefix VARCHAR(8)"))
+    if "label" not in tokens:
+        conn.execute(text("ALTER TABLE tokens ADD COLUMN label VARCHAR(64)"))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_tokens_label ON tokens (label)"))
+
+@migration(8, "Add outbound_queue.delivery_group_id")
+def _delivery_groups(conn):
+    # The delivery group tables themselves are new, so create_all() makes them
+    if "delivery_group_id" not in _columns(conn, "outbound_queue"):
+        conn.execute(text("ALTER TABLE outbound_queue ADD COLUMN delivery_group_id INTEGER"))
+
+@migration(9, "Add message priority and tokens.dispatch_weight")
+def _dispatch_priority(conn):
+    if "priority" not in _columns(conn, "messages"):
+        conn.execute(text("ALTER TABLE messages ADD COLUMN priority INTEGER NOT NULL DEFAULT 0"))
+    if "priority" not in _columns(conn, "outbound_queue"):
+        conn.execute(text("ALTER TABLE outbound_queue ADD COLUMN priority INTEGER NOT NULL DEFAULT 0"))
+    if "dispatch_weight" not in _columns(conn, "tokens"):
+        conn.execute(text("ALTER TABLE tokens ADD COLUMN dispatch_weight INTEGER NOT NULL DEFAULT 1"))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index, Float, Boolean
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .db import Base
@@ -7,9 +7,16 @@ class Token(Base):
     __tablename__ = "tokens"
     id = Column(Integer, primary_key=True, index=True)
     encrypted_token = Column(String, unique=True, nullable=False)
+    token_digest = Column(String(64), unique=True, index=True)  # HMAC of the plaintext token, used for lookup
+    token_prefix = Column(String(8))  # first characters of the plaintext token, shown instead of the secret
+    label = Column(String(64), unique=True, index=True)  # optional admin-chosen name; not secret
     created_at = Column(DateTime, default=datetime.utcnow)
     last_used = Column(DateTime)
     rate_limit_per_hour = Column(Integer, default=5)  # New: messages allowed per hour
+    dedup_window_seconds = Column(Integer)  # identical messages within this window are suppressed; None/0 = off
+    dedup_mode = Column(String(16), default="drop")  # "drop" or "collapse" (one "repeated xN" message when the window ends)
+    retention_days = Column(Integer)  # messages older than this are archived; None = PUSHGATE_RETENTION_DAYS, 0 = keep forever
+    dispatch_weight = Column(Integer, default=1, nullable=False, server_default="1")  # share of Pushover call slots within a priority lane
     # Optionally: rate_limit fields
     messages = relationship("Message", back_populates="token")
 
@@ -20,7 +27,15 @@ class Message(Base):
     message = Column(Text, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
     status = Column(String)
+    suppressed_count = Column(Integer, default=0, nullable=False, server_default="0")  # duplicates dropped by the token's dedup window
+    priority = Column(Integer, default=0, nullable=False, server_default="0")  # Pushover priority, -2 (lowest) to 2 (emergency)
     token = relationship("Token", back_populates="messages")
+    # Keep in sync with migration 2 in migrations.py
+    __table_args__ = (
+        Index("ix_messages_token_id_timestamp", "token_id", "timestamp"),
+        Index("ix_messages_status_timestamp", "status", "timestamp"),
+        Index("ix_messages_timestamp", "timestamp"),
+    )
 
 class PushoverConfig(Base):
     __tablename__ = "pushover_config"
@@ -28,6 +43,7 @@ class PushoverConfig(Base):
     name = Column(String, nullable=False, unique=True)  # New: human-friendly name
     encrypted_app_token = Column(String, nullable=False)
     encrypted_user_key = Column(String, nullable=False)
+    is_default = Column(Boolean, default=False, nullable=False, server_default="0")  # used when /send names no config
     updated_at = Column(DateTime, default=datetime.utcnow)
 
 class AdminSettings(Base):
@@ -35,3 +51,91 @@ class AdminSettings(Base):
     id = Column(Integer, primary_key=True, index=True)
     encrypted_password = Column(String, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow)
+
+class OutboundQueue(Base):
+    # Pending deliveries for queued mode; a row is deleted once its message is delivered or given up on
+    __tablename__ = "outbound_queue"
+    id = Column(Integer, primary_key=True, index=True)
+    message_id = Column(Integer, ForeignKey("messages.id"), nullable=False, unique=True)
+    pushover_config_id = Column(Integer)  # None means the default config at delivery time
+    delivery_group_id = Column(Integer)  # set for a group send: the message's "queued" deliveries are retried
+    priority = Column(Integer, default=0, nullable=False, server_default="0")  # copy of the message's; higher is claimed first
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    locked_until = Column(DateTime)  # lease held by the worker currently delivering this row
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    message = relationship("Message")
+
+class ScheduledMessage(Base):
+    # A message accepted for later delivery; at deliver_at it moves to the outbound queue. The
+    # (deliver_at, id) index is the timer's order: it reads the next few due rows, never the whole table.
+    __tablename__ = "scheduled_messages"
+    id = Column(Integer, primary_key=True)
+    message_id = Column(Integer, ForeignKey("messages.id"), nullable=False, unique=True)
+    deliver_at = Column(DateTime, nullable=False)
+    pushover_config_id = Column(Integer)  # None means the default config at delivery time
+    delivery_group_id = Column(Integer)  # set for a group send; its targets wait as "queued" deliveries
+    priority = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (Index("ix_scheduled_messages_deliver_at_id", "deliver_at", "id"),)
+
+class DeliveryGroup(Base):
+    # A named set of Pushover configs that one /send can target; each member gets its own copy
+    __tablename__ = "delivery_groups"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(64), nullable=False, unique=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    members = relationship("DeliveryGroupMember", cascade="all, delete-orphan")
+
+class DeliveryGroupMember(Base):
+    __tablename__ = "delivery_group_members"
+    group_id = Column(Integer, ForeignKey("delivery_groups.id"), primary_key=True)
+    config_id = Column(Integer, ForeignKey("pushover_config.id"), primary_key=True)
+
+class MessageDelivery(Base):
+    # Outcome of a group send for one of its targets; the Message row holds the combined status
+    __tablename__ = "message_deliveries"
+    message_id = Column(Integer, ForeignKey("messages.id"), primary_key=True)
+    config_id = Column(Integer, primary_key=True)
+    status = Column(String(16), nullable=False)  # Pushover HTTP status, "error", or "queued" while pending
+    latency = Column(Float)  # seconds the Pushover call took
+    detail = Column(Text)  # Pushover response or error of the latest attempt
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class SharedGeneration(Base):
+    # Version numbers for process-local caches; a process drops its copy when the number moves
+    __tablename__ = "shared_generations"
+    name = Column(String(64), primary_key=True)
+    value = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class RateLimitCounter(Base):
+    # Per-token message counts per fixed rate-limit window, shared by every worker process
+    __tablename__ = "rate_limit_counters"
+    token_id = Column(Integer, primary_key=True)
+    window_index = Column(Integer, primary_key=True)
+    count = Column(Integer, default=0, nullable=False)
+
+class UsageRollup(Base):
+    # Pre-aggregated send counts per token, config and status for one minute ("m") or hour ("h"),
+    # updated in the same transaction that logs the messages. Latency is kept as counts per
+    # bucket (upper bounds in usage.LATENCY_BOUNDS) so percentiles can be estimated from sums.
+    # The primary key starts with (granularity, bucket), which is what every stats query ranges over.
+    __tablename__ = "usage_rollups"
+    granularity = Column(String(1), primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    token_id = Column(Integer, primary_key=True)  # 0 when unknown
+    config_id = Column(Integer, primary_key=True)  # 0 when unknown
+    status = Column(String(16), primary_key=True)
+    count = Column(Integer, default=0, nullable=False)
+    latency_count = Column(Integer, default=0, nullable=False)
+    latency_sum = Column(Float, default=0, nullable=False)
+    latency_0 = Column(Integer, default=0, nullable=False)
+    latency_1 = Column(Integer, default=0, nullable=False)
+    latency_2 = Column(Integer, default=0, nullable=False)
+    latency_3 = Column(Integer, default=0, nullable=False)
+    latency_4 = Column(Integer, default=0, nullable=False)
+    latency_5 = Column(Integer, default=0, nullable=False)
+    latency_6 = Column(Integer, default=0, nullable=False)
+    latency_7 = Column(Integer, default=0, nullable=False)
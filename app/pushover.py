@@ -1,22 +1,125 @@
-import requests
+import asyncio
+import os
+import time
+import httpx
 from .db import get_db
-from .models import PushoverConfig
-from .crypto import decrypt
+from .configs import config_cache, credentials
+from .metrics import observe_pushover
+from .circuit import breakers, STATUS_CIRCUIT_OPEN
+from .dispatch import scheduler
 from sqlalchemy.orm import Session
 
-PUSHOVER_API_URL = "https://api.pushover.net/1/messages.json"
+PUSHOVER_API_URL = os.getenv("PUSHOVER_API_URL", "https://api.pushover.net/1/messages.json")
 
-def send_pushover_message(db: Session, message: str, config=None):
-    if config is None:
-        config = db.query(PushoverConfig).first()
-    if not config:
-        raise Exception("Pushover config not set")
-    app_token = decrypt(config.encrypted_app_token)
-    user_key = decrypt(config.encrypted_user_key)
-    data = {
+# Async client tuning (seconds / connection counts)
+PUSHOVER_TIMEOUT = float(os.getenv("PUSHOVER_TIMEOUT", "10"))
+PUSHOVER_CONNECT_TIMEOUT = float(os.getenv("PUSHOVER_CONNECT_TIMEOUT", "5"))
+PUSHOVER_MAX_CONNECTIONS = int(os.getenv("PUSHOVER_MAX_CONNECTIONS", "20"))
+PUSHOVER_MAX_KEEPALIVE = int(os.getenv("PUSHOVER_MAX_KEEPALIVE", "10"))
+PUSHOVER_KEEPALIVE_EXPIRY = float(os.getenv("PUSHOVER_KEEPALIVE_EXPIRY", "30"))
+# "auto" enables HTTP/2 when the optional h2 package is installed
+PUSHOVER_HTTP2 = os.getenv("PUSHOVER_HTTP2", "auto").lower()
+# Pushover requires these for emergency (priority 2) messages: seconds between re-alerts, and
+# seconds until it stops re-alerting
+PUSHOVER_EMERGENCY_RETRY = int(os.getenv("PUSHOVER_EMERGENCY_RETRY", "60"))
+PUSHOVER_EMERGENCY_EXPIRE = int(os.getenv("PUSHOVER_EMERGENCY_EXPIRE", "3600"))
+
+def get_pushover_config(db: Session, config_id: int = None):
+    # Decrypted config from the in-process cache; the default config when config_id is None
+    return config_cache.get(db, config_id)
+
+def _payload(config, message: str, priority: int = 0):
+    app_token, user_key = credentials(config)
+    payload = {
         "token": app_token,
         "user": user_key,
         "message": message
     }
-    resp = requests.post(PUSHOVER_API_URL, data=data)
+    if priority:
+        payload["priority"] = priority
+        if priority == 2:
+            payload["retry"] = PUSHOVER_EMERGENCY_RETRY
+            payload["expire"] = PUSHOVER_EMERGENCY_EXPIRE
+    return payload
+
+def _open_detail(config, breaker):
+    return f"Pushover config {config.id} is unavailable (circuit open); retry in {breaker.retry_after():.0f}s"
+
+# Shared async client: one connection pool with keep-alive for the whole process.
+# The pool is bound to the event loop it was created on, so it is rebuilt if the loop changes.
+_client = None
+_client_loop = None
+_transport = None  # tests swap in an ASGI transport pointing at the fake Pushover API
+
+def _http2_enabled():
+    if PUSHOVER_HTTP2 in ("0", "false", "no", "off"):
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        if PUSHOVER_HTTP2 in ("1", "true", "yes", "on"):
+            raise Exception("PUSHOVER_HTTP2 is enabled but the h2 package is not installed (pip install httpx[http2])")
+        return False
+    return True
+
+def get_client() -> httpx.AsyncClient:
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop or _client.is_closed:
+        _client = httpx.AsyncClient(
+            transport=_transport,
+            http2=_http2_enabled() if _transport is None else False,
+            timeout=httpx.Timeout(PUSHOVER_TIMEOUT, connect=PUSHOVER_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=PUSHOVER_MAX_CONNECTIONS,
+                max_keepalive_connections=PUSHOVER_MAX_KEEPALIVE,
+                keepalive_expiry=PUSHOVER_KEEPALIVE_EXPIRY,
+            ),
+        )
+        _client_loop = loop
+    return _client
+
+async def close_client():
+    global _client, _client_loop
+    if _client is not None and _client_loop is asyncio.get_running_loop():
+        await _client.aclose()
+    _client = None
+    _client_loop = None
+
+async def post_pushover_message(config, message: str, priority: int = 0):
+    # The caller resolves the config.
+    # Returns (STATUS_CIRCUIT_OPEN, detail) without calling Pushover while the config's breaker is open.
+    if not config:
+        raise Exception("Pushover config not set")
+    payload = _payload(config, message, priority)
+    breaker = breakers.get(config.id)
+    if not breaker.allow():
+        return STATUS_CIRCUIT_OPEN, _open_detail(config, breaker)
+    start = time.perf_counter()
+    try:
+        resp = await get_client().post(PUSHOVER_API_URL, data=payload)
+    except httpx.HTTPError:
+        observe_pushover("error", time.perf_counter() - start)
+        breaker.record("error")
+        raise
+    except BaseException:
+        breaker.abandon()
+        raise
+    observe_pushover(resp.status_code, time.perf_counter() - start)
+    breaker.record(resp.status_code, resp.headers)
     return resp.status_code, resp.text
+
+async def deliver_pushover_message(config, message: str, priority: int = 0):
+    # Like post_pushover_message, but transport failures are returned as ("error", detail)
+    try:
+        return await post_pushover_message(config, message, priority)
+    except httpx.HTTPError as e:
+        return "error", f"{type(e).__name__}: {e}"
+
+async def deliver_timed(config, message: str, priority: int = 0, token_id: int = None, weight: float = 1):
+    # deliver_pushover_message once the dispatch scheduler hands out a call slot (by priority,
+    # then fairly across tokens), plus the seconds the call took, for the usage rollups
+    async with scheduler.slot(config.id if config else None, priority, token_id, weight):
+        start = time.perf_counter()
+        status_code, resp_text = await deliver_pushover_message(config, message, priority)
+        return status_code, resp_text, time.perf_counter() - start
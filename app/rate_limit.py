@@ -1,14 +1,185 @@
+import os
+import threading
+import time
 from datetime import datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from .models import Message, Token
+from .db import SessionLocal
+from .models import Message, Token, RateLimitCounter
+from .shared_state import STATE_BACKEND, get_redis, REDIS_PREFIX
 
-def check_token_rate_limit(db: Session, token_id: int, rate_limit_per_hour: int):
+# "memory" keeps per-token counters in process; "db" counts logged messages on every check;
+# "shared" keeps the counters in the database and "redis" in Redis, so all workers share one budget.
+# The default follows PUSHGATE_STATE_BACKEND.
+_DEFAULT_BACKENDS = {"local": "memory", "db": "shared", "redis": "redis"}
+RATE_LIMIT_BACKEND = os.getenv("PUSHGATE_RATE_LIMIT_BACKEND", _DEFAULT_BACKENDS.get(STATE_BACKEND, "memory")).lower()
+RATE_LIMIT_WINDOW_SECONDS = 3600
+
+def check_token_rate_limit(db: Session, token_id: int, rate_limit_per_hour: int, count: int = 1):
     now = datetime.utcnow()
     window_start = now - timedelta(hours=1)
-    count = db.query(Message).filter(
+    sent = db.query(Message).filter(
         Message.token_id == token_id,
         Message.timestamp >= window_start
     ).count()
-    if count >= rate_limit_per_hour:
+    if sent + count > rate_limit_per_hour:
         return False
     return True
+
+class DatabaseRateLimiter:
+    # Exact sliding hour, but a COUNT per check and no atomicity between check and insert
+    def warm(self, db: Session):
+        pass
+
+    def consume(self, db: Session, token_id: int, limit: int, count: int = 1):
+        return check_token_rate_limit(db, token_id, limit, count)
+
+class MemoryRateLimiter:
+    # Sliding-window counter: a count for the current and the previous fixed hour, with the
+    # previous hour weighted by how much of it still overlaps the sliding window. O(1) per check,
+    # and check-and-consume happens under one lock so concurrent requests cannot both pass.
+    def __init__(self, window_seconds: int = RATE_LIMIT_WINDOW_SECONDS, clock=time.time):
+        self.window = window_seconds
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.counters = {}  # token_id -> [window index, current count, previous count]
+
+    def _counter(self, token_id: int, window_index: int):
+        counter = self.counters.get(token_id)
+        if counter is None:
+            counter = self.counters[token_id] = [window_index, 0, 0]
+        elif counter[0] != window_index:
+            # Roll forward; anything older than the previous window no longer counts
+            counter[2] = counter[1] if counter[0] == window_index - 1 else 0
+            counter[1] = 0
+            counter[0] = window_index
+        return counter
+
+    def consume(self, db: Session, token_id: int, limit: int, count: int = 1):
+        now = self.clock()
+        window_index, offset = divmod(now, self.window)
+        window_index = int(window_index)
+        with self.lock:
+            counter = self._counter(token_id, window_index)
+            estimate = counter[2] * (1 - offset / self.window) + counter[1]
+            if estimate + count > limit:
+                return False
+            counter[1] += count
+            return True
+
+    def warm(self, db: Session):
+        # Seed counters from the message log so a restart does not reset everyone's budget
+        now = self.clock()
+        window_index = int(now // self.window)
+        current_start = datetime.utcfromtimestamp(window_index * self.window)
+        previous_start = current_start - timedelta(seconds=self.window)
+        rows = (
+            db.query(Message.token_id, Message.timestamp >= current_start, func.count(Message.id))
+            .filter(Message.timestamp >= previous_start)
+            .group_by(Message.token_id, Message.timestamp >= current_start)
+            .all()
+        )
+        with self.lock:
+            self.counters = {}
+            for token_id, in_current, count in rows:
+                counter = self.counters.setdefault(token_id, [window_index, 0, 0])
+                counter[1 if in_current else 2] += count
+
+def _window(clock, window_seconds):
+    # (index of the current fixed window, weight of the previous window in the sliding estimate)
+    window_index, offset = divmod(clock(), window_seconds)
+    return int(window_index), 1 - offset / window_seconds
+
+class SharedCounterRateLimiter:
+    # The same sliding-window estimate as MemoryRateLimiter, with the counters in the
+    # rate_limit_counters table. Check-and-consume is one conditional UPDATE, so concurrent
+    # workers cannot both pass on the last unit of budget.
+    def __init__(self, window_seconds: int = RATE_LIMIT_WINDOW_SECONDS, session_factory=SessionLocal, clock=time.time):
+        self.window = window_seconds
+        self.session_factory = session_factory
+        self.clock = clock
+
+    def warm(self, db: Session):
+        pass  # counters are persistent
+
+    def consume(self, db: Session, token_id: int, limit: int, count: int = 1):
+        # Own short transaction, so the caller's session (and its loaded rows) is left alone
+        window_index, weight = _window(self.clock, self.window)
+        s = self.session_factory()
+        try:
+            previous = (
+                s.query(RateLimitCounter.count)
+                .filter(RateLimitCounter.token_id == token_id, RateLimitCounter.window_index == window_index - 1)
+                .scalar_subquery()
+            )
+            for _ in range(3):
+                updated = s.query(RateLimitCounter).filter(
+                    RateLimitCounter.token_id == token_id,
+                    RateLimitCounter.window_index == window_index,
+                    RateLimitCounter.count + count + func.coalesce(previous, 0) * weight <= limit,
+                ).update({RateLimitCounter.count: RateLimitCounter.count + count}, synchronize_session=False)
+                if updated:
+                    s.commit()
+                    return True
+                current = s.query(RateLimitCounter.count).filter(
+                    RateLimitCounter.token_id == token_id, RateLimitCounter.window_index == window_index
+                ).scalar()
+                if current is not None:
+                    s.rollback()
+                    return False
+                # First message in this window: start its row and drop windows that no longer count
+                prev_count = s.query(previous).scalar() or 0
+                if prev_count * weight + count > limit:
+                    s.rollback()
+                    return False
+                s.query(RateLimitCounter).filter(
+                    RateLimitCounter.token_id == token_id, RateLimitCounter.window_index < window_index - 1
+                ).delete(synchronize_session=False)
+                s.add(RateLimitCounter(token_id=token_id, window_index=window_index, count=count))
+                try:
+                    s.commit()
+                    return True
+                except IntegrityError:
+                    s.rollback()  # another worker created the row; go round and update it instead
+            return False
+        finally:
+            s.close()
+
+class RedisRateLimiter:
+    # Sliding-window counters in Redis: INCRBY the current window, and undo it if the estimate
+    # is over the limit. Racing requests can only be refused too eagerly, never let through.
+    def __init__(self, window_seconds: int = RATE_LIMIT_WINDOW_SECONDS, client_factory=get_redis, prefix: str = REDIS_PREFIX, clock=time.time):
+        self.window = window_seconds
+        self.client_factory = client_factory
+        self.prefix = prefix
+        self.clock = clock
+
+    def warm(self, db: Session):
+        pass
+
+    def consume(self, db: Session, token_id: int, limit: int, count: int = 1):
+        window_index, weight = _window(self.clock, self.window)
+        client = self.client_factory()
+        key = f"{self.prefix}rl:{token_id}:{window_index}"
+        current = int(client.incrby(key, count))
+        if current == count:
+            client.expire(key, 2 * self.window)
+        previous = int(client.get(f"{self.prefix}rl:{token_id}:{window_index - 1}") or 0)
+        if previous * weight + current > limit:
+            client.decrby(key, count)
+            return False
+        return True
+
+def _create_rate_limiter():
+    if RATE_LIMIT_BACKEND == "db":
+        return DatabaseRateLimiter()
+    if RATE_LIMIT_BACKEND == "memory":
+        return MemoryRateLimiter()
+    if RATE_LIMIT_BACKEND == "shared":
+        return SharedCounterRateLimiter()
+    if RATE_LIMIT_BACKEND == "redis":
+        return RedisRateLimiter()
+    raise Exception(f"Unknown PUSHGATE_RATE_LIMIT_BACKEND: {RATE_LIMIT_BACKEND}")
+
+rate_limiter = _create_rate_limiter()
@@ -0,0 +1,265 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, text
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from .db import SessionLocal
+from .metrics import MESSAGES_ARCHIVED
+from .models import Message, MessageDelivery, OutboundQueue, ScheduledMessage, Token
+from .shared_state import acquire_lease, release_lease
+from .usage import prune_minute_rollups
+
+logger = logging.getLogger(__name__)
+
+# Days a message is kept in the database before it is archived; 0 keeps messages forever.
+# A token's retention_days overrides this (0 there keeps that token's messages forever).
+RETENTION_DAYS = int(os.getenv("PUSHGATE_RETENTION_DAYS", "0"))
+# Archived messages go to one gzip JSONL file per month: messages-YYYY-MM.jsonl.gz
+ARCHIVE_DIR = os.getenv("PUSHGATE_ARCHIVE_DIR", "./archive")
+# Seconds between retention passes
+RETENTION_INTERVAL = float(os.getenv("PUSHGATE_RETENTION_INTERVAL", "3600"))
+# Rows archived and deleted per transaction, and the pause between batches, so the write lock
+# is only ever held briefly and /send keeps getting its turn
+RETENTION_BATCH_SIZE = int(os.getenv("PUSHGATE_RETENTION_BATCH_SIZE", "500"))
+RETENTION_BATCH_PAUSE = float(os.getenv("PUSHGATE_RETENTION_BATCH_PAUSE_MS", "50")) / 1000
+# Free pages handed back to the filesystem after each pass (SQLite with auto_vacuum=INCREMENTAL)
+VACUUM_PAGES = int(os.getenv("PUSHGATE_RETENTION_VACUUM_PAGES", "2000"))
+
+LEASE_NAME = "retention"
+
+def archive_path(archive_dir: str, month: str) -> str:
+    return os.path.join(archive_dir, f"messages-{month}.jsonl.gz")
+
+def to_record(row, deliveries=None) -> dict:
+    record = {
+        "id": row.id,
+        "token_id": row.token_id,
+        "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+        "status": row.status,
+        "suppressed_count": row.suppressed_count,
+        "priority": row.priority,
+        "message": row.message,
+    }
+    if deliveries:
+        # Per-target outcomes of a delivery group send
+        record["deliveries"] = [{"config_id": d.config_id, "status": d.status, "latency": d.latency, "detail": d.detail} for d in deliveries]
+    return record
+
+def expired_condition(db: Session, now: datetime, default_days: int = RETENTION_DAYS):
+    # WHERE clause matching messages past their retention, or None if nothing can expire
+    overrides = db.query(Token.id, Token.retention_days).filter(Token.retention_days.isnot(None)).all()
+    conditions = [
+        and_(Message.token_id == token_id, Message.timestamp < now - timedelta(days=days))
+        for token_id, days in overrides if days > 0
+    ]
+    if default_days > 0:
+        expired = Message.timestamp < now - timedelta(days=default_days)
+        overridden = [token_id for token_id, _ in overrides]
+        if overridden:
+            # Messages of deleted tokens (token_id NULL or dangling) fall under the global setting
+            expired = and_(or_(Message.token_id.is_(None), Message.token_id.notin_(overridden)), expired)
+        conditions.append(expired)
+    if not conditions:
+        return None
+    return or_(*conditions)
+
+def append_records(archive_dir: str, records):
+    # Append to the month files; each append adds a gzip member, which gzip readers concatenate.
+    # Synced before the caller deletes the rows, so a crash can repeat a row but never lose one.
+    os.makedirs(archive_dir, exist_ok=True)
+    by_month = {}
+    for record in records:
+        by_month.setdefault((record["timestamp"] or "unknown")[:7], []).append(record)
+    for month, month_records in by_month.items():
+        with open(archive_path(archive_dir, month), "ab") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                for record in month_records:
+                    f.write(json.dumps(record, separators=(",", ":")).encode() + b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+
+def archive_batch(db: Session, condition, archive_dir: str = ARCHIVE_DIR, batch_size: int = RETENTION_BATCH_SIZE) -> int:
+    # Archive and delete up to batch_size expired messages in one transaction; returns the count.
+    # Messages still waiting in the outbound queue or for their scheduled time are left alone until they are delivered.
+    rows = (
+        db.query(Message)
+        .filter(condition, ~Message.id.in_(db.query(OutboundQueue.message_id)), ~Message.id.in_(db.query(ScheduledMessage.message_id)))
+        .order_by(Message.id)
+        .limit(batch_size)
+        .all()
+    )
+    if not rows:
+        return 0
+    ids = [r.id for r in rows]
+    deliveries = {}
+    for d in db.query(MessageDelivery).filter(MessageDelivery.message_id.in_(ids)).order_by(MessageDelivery.config_id):
+        deliveries.setdefault(d.message_id, []).append(d)
+    append_records(archive_dir, [to_record(r, deliveries.get(r.id)) for r in rows])
+    db.query(MessageDelivery).filter(MessageDelivery.message_id.in_(ids)).delete(synchronize_session=False)
+    db.query(Message).filter(Message.id.in_(ids)).delete(synchronize_session=False)
+    db.commit()
+    MESSAGES_ARCHIVED.inc(len(rows))
+    return len(rows)
+
+def incremental_vacuum(db: Session, pages: int = VACUUM_PAGES) -> bool:
+    # Return up to `pages` free pages to the filesystem. Only SQLite databases created with (or
+    # VACUUMed into) auto_vacuum=INCREMENTAL support this; others keep the pages for reuse.
+    if db.get_bind().dialect.name != "sqlite" or pages <= 0:
+        return False
+    if db.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+        return False
+    db.commit()
+    # Through executescript: sqlite3's execute() steps this pragma once, which frees a single page
+    db.connection().connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+    db.commit()
+    return True
+
+def run_retention(session_factory=SessionLocal, archive_dir: str = ARCHIVE_DIR, default_days: int = RETENTION_DAYS,
+                  batch_size: int = RETENTION_BATCH_SIZE, pause: float = RETENTION_BATCH_PAUSE,
+                  vacuum_pages: int = VACUUM_PAGES, now: datetime = None) -> int:
+    # One full pass: archive every expired message, batch by batch, then vacuum; returns the count
+    now = now or datetime.utcnow()
+    archived = 0
+    db = session_factory()
+    try:
+        condition = expired_condition(db, now, default_days)
+        db.rollback()
+        if condition is None:
+            return 0
+        while True:
+            count = archive_batch(db, condition, archive_dir, batch_size)
+            archived += count
+            if count < batch_size:
+                break
+            time.sleep(pause)
+        if archived:
+            incremental_vacuum(db, vacuum_pages)
+        return archived
+    finally:
+        db.close()
+
+def archive_files(archive_dir: str = ARCHIVE_DIR):
+    if not os.path.isdir(archive_dir):
+        return []
+    return sorted(
+        os.path.join(archive_dir, name) for name in os.listdir(archive_dir)
+        if name.startswith("messages-") and name.endswith(".jsonl.gz")
+    )
+
+def iter_archive(archive_dir: str = ARCHIVE_DIR, token_id: int = None, since: datetime = None,
+                 until: datetime = None, contains: str = None):
+    # Archived records matching the filters, oldest file first. Month files outside since/until
+    # are not opened. A row archived twice (crash between archive and delete) is yielded once.
+    first = since.strftime("%Y-%m") if since else None
+    last = until.strftime("%Y-%m") if until else None
+    needle = contains.lower() if contains else None
+    seen = set()
+    for path in archive_files(archive_dir):
+        month = os.path.basename(path)[len("messages-"):-len(".jsonl.gz")]
+        if (first and month < first) or (last and month > last):
+            continue
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if record["id"] in seen:
+                    continue
+                if token_id is not None and record["token_id"] != token_id:
+                    continue
+                stamp = datetime.fromisoformat(record["timestamp"]) if record["timestamp"] else None
+                if since and (stamp is None or stamp < since):
+                    continue
+                if until and (stamp is None or stamp >= until):
+                    continue
+                if needle and needle not in record["message"].lower():
+                    continue
+                seen.add(record["id"])
+                yield record
+
+def restore_records(db: Session, records, batch_size: int = RETENTION_BATCH_SIZE) -> int:
+    # Insert archived records back into messages with their original ids; ids that already
+    # exist are skipped, so restoring twice is harmless. Returns the number of rows inserted.
+    restored = 0
+    batch = []
+
+    def flush():
+        nonlocal restored
+        existing = {i for (i,) in db.query(Message.id).filter(Message.id.in_([r["id"] for r in batch]))}
+        rows = [
+            {
+                "id": r["id"],
+                "token_id": r["token_id"],
+                "message": r["message"],
+                "timestamp": datetime.fromisoformat(r["timestamp"]) if r["timestamp"] else None,
+                "status": r["status"],
+                "suppressed_count": r.get("suppressed_count") or 0,
+                "priority": r.get("priority") or 0,
+            }
+            for r in batch if r["id"] not in existing
+        ]
+        if rows:
+            db.bulk_insert_mappings(Message, rows)
+            restored_ids = {row["id"] for row in rows}
+            db.bulk_insert_mappings(MessageDelivery, [
+                {"message_id": r["id"], **d} for r in batch if r["id"] in restored_ids for d in r.get("deliveries") or []
+            ])
+        db.commit()
+        restored += len(rows)
+        batch.clear()
+
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return restored
+
+class RetentionJob:
+    # Background task running a retention pass (and dropping old minute usage rollups) every
+    # RETENTION_INTERVAL seconds. With several
+    # worker processes a shared lease makes sure only one of them archives at a time.
+    def __init__(self, interval: float = RETENTION_INTERVAL):
+        self.interval = interval
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def run_once(self) -> int:
+        if not acquire_lease(LEASE_NAME, max(self.interval, 600)):
+            return 0
+        try:
+            archived = run_retention()
+            db = SessionLocal()
+            try:
+                prune_minute_rollups(db)
+            finally:
+                db.close()
+        finally:
+            release_lease(LEASE_NAME)
+        if archived:
+            logger.info("Archived %d expired messages to %s", archived, ARCHIVE_DIR)
+        return archived
+
+    async def _run(self):
+        while True:
+            try:
+                await run_in_threadpool(self.run_once)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Retention pass failed")
+            await asyncio.sleep(self.interval)
+
+retention_job = RetentionJob()
@@ -0,0 +1,240 @@
+import asyncio
+import heapq
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from .cache import TTLCache
+from .db import SessionLocal
+from .delivery import STATUS_QUEUED, QUEUE_POLL_INTERVAL, workers as delivery_workers
+from .groups import DELIVERY_QUEUED
+from .models import Message, MessageDelivery, OutboundQueue, ScheduledMessage
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_MAX_DAYS = int(os.getenv("PUSHGATE_SCHEDULE_MAX_DAYS", "365"))  # how far ahead deliver_at may be
+SCHEDULE_WINDOW = int(os.getenv("PUSHGATE_SCHEDULE_WINDOW", "1000"))  # pending messages the timer holds in memory
+SCHEDULE_RESYNC_SECONDS = float(os.getenv("PUSHGATE_SCHEDULE_RESYNC_SECONDS", "300"))  # re-read the table at least this often
+SCHEDULE_RELEASE_BATCH = 500
+# The pending count for /metrics is cached, so scrapes do not count a large table each time
+SCHEDULE_COUNT_CACHE_SECONDS = float(os.getenv("PUSHGATE_SCHEDULE_COUNT_CACHE_SECONDS", "30"))
+_count_cache = TTLCache(maxsize=1, ttl=SCHEDULE_COUNT_CACHE_SECONDS)
+
+STATUS_SCHEDULED = "scheduled"
+STATUS_CANCELLED = "cancelled"
+
+def _parse_time(value: str) -> datetime:
+    try:
+        return datetime.fromtimestamp(float(value), timezone.utc).replace(tzinfo=None)
+    except ValueError:
+        pass
+    except (OverflowError, OSError):
+        raise ValueError("deliver_at is out of range")
+    try:
+        at = datetime.fromisoformat(value.strip())
+    except ValueError:
+        raise ValueError("deliver_at must be an ISO 8601 time or a Unix timestamp")
+    if at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    return at
+
+def deliver_time(deliver_at: str = None, delay: int = None, now: datetime = None):
+    # When a /send should go out, in naive UTC like every other timestamp here, or None for now.
+    # deliver_at is ISO 8601 (UTC unless it carries an offset) or Unix seconds; delay is seconds
+    # from now. Raises ValueError for bad or conflicting values.
+    if deliver_at and delay is not None:
+        raise ValueError("Give either deliver_at or delay, not both")
+    now = now or datetime.utcnow()
+    if delay is not None:
+        if delay < 0:
+            raise ValueError("delay must not be negative")
+        at = now + timedelta(seconds=min(delay, (SCHEDULE_MAX_DAYS + 1) * 86400))
+    elif deliver_at:
+        at = _parse_time(deliver_at)
+    else:
+        return None
+    if at - now > timedelta(days=SCHEDULE_MAX_DAYS):
+        raise ValueError(f"Messages can be scheduled at most {SCHEDULE_MAX_DAYS} days ahead")
+    return at if at > now else None
+
+def schedule_message(db: Session, token_id: int, message: str, deliver_at: datetime, config_id: int = None, group=None, priority: int = 0):
+    # Store a message for later: the Message row (status "scheduled") and its schedule row in one
+    # transaction. A group send records its targets as "queued" deliveries now, so later changes to
+    # the group do not change who gets it. Returns (message id, schedule row id).
+    msg = Message(token_id=token_id, message=message, status=STATUS_SCHEDULED, timestamp=datetime.utcnow(), priority=priority)
+    db.add(msg)
+    db.flush()
+    if group is not None:
+        db.add_all([MessageDelivery(message_id=msg.id, config_id=config_id, status=DELIVERY_QUEUED) for config_id in group.config_ids])
+    job = ScheduledMessage(
+        message_id=msg.id, deliver_at=deliver_at, priority=priority,
+        pushover_config_id=None if group is not None else config_id,
+        delivery_group_id=group.id if group is not None else None,
+    )
+    db.add(job)
+    db.flush()
+    ids = msg.id, job.id
+    db.commit()
+    return ids
+
+def release_due(db: Session, ids, now: datetime = None) -> int:
+    # Move due schedule rows to the outbound queue; returns how many this call released. Each row
+    # is taken with a conditional DELETE, so when several processes' timers fire for the same row
+    # (or a cancel gets there first) only one of them queues it.
+    now = now or datetime.utcnow()
+    rows = db.query(ScheduledMessage).filter(ScheduledMessage.id.in_(list(ids)), ScheduledMessage.deliver_at <= now).all()
+    released = []
+    for row in rows:
+        result = db.execute(delete(ScheduledMessage).where(ScheduledMessage.id == row.id).execution_options(synchronize_session=False))
+        if result.rowcount == 1:
+            released.append(row.message_id)
+            db.add(OutboundQueue(
+                message_id=row.message_id, pushover_config_id=row.pushover_config_id,
+                delivery_group_id=row.delivery_group_id, priority=row.priority, next_attempt_at=now,
+            ))
+    if released:
+        db.query(Message).filter(Message.id.in_(released)).update({Message.status: STATUS_QUEUED}, synchronize_session=False)
+    db.commit()
+    db.expunge_all()
+    return len(released)
+
+def cancel_scheduled(db: Session, message_id: int) -> bool:
+    # False if the message is no longer waiting (already released to the queue, or cancelled)
+    result = db.execute(delete(ScheduledMessage).where(ScheduledMessage.message_id == message_id).execution_options(synchronize_session=False))
+    if result.rowcount != 1:
+        db.rollback()
+        return False
+    db.query(Message).filter(Message.id == message_id).update({Message.status: STATUS_CANCELLED}, synchronize_session=False)
+    db.query(MessageDelivery).filter(MessageDelivery.message_id == message_id).update({MessageDelivery.status: STATUS_CANCELLED}, synchronize_session=False)
+    db.commit()
+    return True
+
+def scheduled_for(db: Session, message_id: int):
+    return db.query(ScheduledMessage.deliver_at).filter(ScheduledMessage.message_id == message_id).scalar()
+
+def count_scheduled(db: Session) -> int:
+    count = _count_cache.get("pending")
+    if count is None:
+        count = db.query(ScheduledMessage).count()
+        _count_cache.set("pending", count)
+    return count
+
+class ScheduleTimer:
+    # One asyncio task per process that sleeps until the earliest scheduled message is due, then
+    # hands everything due to the outbound queue and the delivery workers. Only the first `window`
+    # rows by (deliver_at, id) are held in memory, as a heap; the rest stay in the indexed table and
+    # are read in when the window runs dry, so memory and startup cost do not grow with the number
+    # of pending messages. New messages due before the end of the window go straight into the heap.
+    # The table is re-read every `resync` seconds as well, to pick up messages scheduled by other
+    # worker processes; each row is released once however many timers see it.
+    def __init__(self, window: int = SCHEDULE_WINDOW, resync: float = SCHEDULE_RESYNC_SECONDS):
+        self.window = window
+        self.resync = resync
+        self.heap = []  # (deliver_at, scheduled id)
+        self.ids = set()
+        self.horizon = None  # deliver_at of the last row read when the table holds more; None = all read
+        self.synced_at = 0.0
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        self.heap, self.ids, self.horizon = [], set(), None
+        self.wakeup = asyncio.Event()
+
+    def add(self, deliver_at: datetime, scheduled_id: int):
+        # Called after a schedule row is committed. Rows past the window are found on a later read.
+        if self.task is None or scheduled_id in self.ids or (self.horizon is not None and deliver_at > self.horizon):
+            return
+        heapq.heappush(self.heap, (deliver_at, scheduled_id))
+        self.ids.add(scheduled_id)
+        if len(self.heap) > 2 * self.window:
+            self._trim()
+        if self.heap[0][1] == scheduled_id:
+            self.wakeup.set()
+
+    def _trim(self):
+        # Back to one window's worth; what is dropped is after the new horizon and read in again later
+        self.heap = heapq.nsmallest(self.window, self.heap)
+        self.ids = {i for _, i in self.heap}
+        self.horizon = self.heap[-1][0]
+
+    def _read_window(self):
+        db = SessionLocal()
+        try:
+            return db.query(ScheduledMessage.deliver_at, ScheduledMessage.id).order_by(ScheduledMessage.deliver_at, ScheduledMessage.id).limit(self.window).all()
+        finally:
+            db.close()
+
+    async def sync(self):
+        rows = await run_in_threadpool(self._read_window)
+        horizon = rows[-1][0] if len(rows) == self.window else None
+        # Keep what add() pushed while the read was running
+        entries = {i: at for at, i in rows}
+        for at, i in self.heap:
+            if horizon is None or at <= horizon:
+                entries.setdefault(i, at)
+        self.heap = [(at, i) for i, at in entries.items()]
+        heapq.heapify(self.heap)
+        self.ids = set(entries)
+        self.horizon = horizon
+        self.synced_at = time.monotonic()
+
+    def _pop_due(self, now: datetime):
+        due = []
+        while self.heap and self.heap[0][0] <= now and len(due) < SCHEDULE_RELEASE_BATCH:
+            _, scheduled_id = heapq.heappop(self.heap)
+            self.ids.discard(scheduled_id)
+            due.append(scheduled_id)
+        return due
+
+    async def _release(self, ids):
+        db = SessionLocal()
+        try:
+            released = await run_in_threadpool(release_due, db, ids)
+        finally:
+            db.close()
+        if released:
+            delivery_workers.start()
+            delivery_workers.notify()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sync()
+                while True:
+                    due = self._pop_due(datetime.utcnow())
+                    if due:
+                        await self._release(due)
+                        continue
+                    if not self.heap and self.horizon is not None:
+                        break  # the window ran dry; read the next one
+                    since_sync = time.monotonic() - self.synced_at
+                    if since_sync >= self.resync:
+                        break
+                    timeout = self.resync - since_sync
+                    if self.heap:
+                        timeout = min(timeout, (self.heap[0][0] - datetime.utcnow()).total_seconds())
+                    self.wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), max(timeout, 0))
+                    except asyncio.TimeoutError:
+                        pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Releasing scheduled messages failed")
+                # Whatever was popped is still in the table and comes back with the next read
+                await asyncio.sleep(QUEUE_POLL_INTERVAL)
+
+timer = ScheduleTimer()
@@ -0,0 +1,52 @@
+import re
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from .models import Message
+
+_fts_available = {}  # engine url -> bool; the table only appears through a migration
+
+def fts_available(db: Session):
+    bind = db.get_bind()
+    key = str(bind.url)
+    if key not in _fts_available:
+        if bind.dialect.name != "sqlite":
+            _fts_available[key] = False
+        else:
+            row = db.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'")).first()
+            _fts_available[key] = row is not None
+    return _fts_available[key]
+
+def fts_query(search: str):
+    # Turn free text into an FTS5 query: every word is matched as a prefix, all words must match.
+    # Words are quoted so FTS5 operators and punctuation in user input are taken literally.
+    terms = re.findall(r"\w+", search)
+    return " ".join(f'"{t}"*' for t in terms)
+
+def search_filter(db: Session, search: str):
+    # Filter expression for Message rows matching `search`, using the FTS index when there is one
+    match = fts_query(search) if fts_available(db) else ""
+    if not match:
+        return Message.message.ilike(f"%{search}%")
+    return Message.id.in_(text("SELECT rowid FROM messages_fts WHERE messages_fts MATCH :match").bindparams(match=match))
+
+def search_messages(db: Session, search: str, limit: int = 50, token_id: int = None, status: str = None):
+    # Best matches first (bm25) when FTS is available, otherwise newest ILIKE matches first
+    match = fts_query(search) if fts_available(db) else ""
+    if not match:
+        query = db.query(Message).filter(Message.message.ilike(f"%{search}%"))
+        if token_id:
+            query = query.filter(Message.token_id == token_id)
+        if status:
+            query = query.filter(Message.status == status)
+        return [(m, None) for m in query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit).all()]
+    sql = (
+        "SELECT m.id, bm25(messages_fts) AS score FROM messages_fts "
+        "JOIN messages m ON m.id = messages_fts.rowid "
+        "WHERE messages_fts MATCH :match"
+        + (" AND m.token_id = :token_id" if token_id else "")
+        + (" AND m.status = :status" if status else "")
+        + " ORDER BY score LIMIT :limit"
+    )
+    rows = db.execute(text(sql), {"match": match, "token_id": token_id, "status": status, "limit": limit}).all()
+    by_id = {m.id: m for m in db.query(Message).filter(Message.id.in_([r.id for r in rows])).all()}
+    return [(by_id[r.id], r.score) for r in rows if r.id in by_id]
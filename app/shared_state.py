@@ -0,0 +1,215 @@
+import logging
+import os
+import threading
+import time
+from sqlalchemy.exc import IntegrityError
+from . import crypto
+from .db import SessionLocal
+from .models import SharedGeneration
+
+logger = logging.getLogger(__name__)
+
+# Where state that must agree across worker processes lives:
+#   "local" - in this process only; fine for a single uvicorn worker (default)
+#   "db"    - tables in the main database (rate_limit_counters, shared_generations)
+#   "redis" - a Redis-compatible server at PUSHGATE_REDIS_URL
+STATE_BACKEND = os.getenv("PUSHGATE_STATE_BACKEND", "local").lower()
+REDIS_URL = os.getenv("PUSHGATE_REDIS_URL", "redis://localhost:6379/0")
+REDIS_PREFIX = os.getenv("PUSHGATE_REDIS_PREFIX", "pushgate:")
+# How often (seconds) a process checks whether a shared generation moved
+STATE_CHECK_INTERVAL = float(os.getenv("PUSHGATE_STATE_CHECK_INTERVAL", "1.0"))
+WORKERS = int(os.getenv("PUSHGATE_WORKERS", "1"))
+
+_redis = None
+
+def get_redis():
+    # Tests assign a stand-in to _redis; only incr/incrby/decrby/get/set/delete/expire are used
+    global _redis
+    if _redis is None:
+        try:
+            import redis
+        except ImportError:
+            raise Exception("PUSHGATE_STATE_BACKEND=redis needs the 'redis' package (pip install redis)")
+        _redis = redis.Redis.from_url(REDIS_URL)
+    return _redis
+
+class LocalGenerations:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def get(self, name: str) -> int:
+        return self.values.get(name, 0)
+
+    def bump(self, name: str) -> int:
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + 1
+            return self.values[name]
+
+    def acquire_lease(self, name: str, seconds: float) -> bool:
+        with self.lock:
+            now = time.time()
+            if self.values.get(f"lease:{name}", 0) > now:
+                return False
+            self.values[f"lease:{name}"] = now + seconds
+            return True
+
+    def release_lease(self, name: str):
+        with self.lock:
+            self.values.pop(f"lease:{name}", None)
+
+class DatabaseGenerations:
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+
+    def get(self, name: str) -> int:
+        db = self.session_factory()
+        try:
+            return db.query(SharedGeneration.value).filter(SharedGeneration.name == name).scalar() or 0
+        finally:
+            db.close()
+
+    def bump(self, name: str) -> int:
+        db = self.session_factory()
+        try:
+            for _ in range(3):
+                updated = db.query(SharedGeneration).filter(SharedGeneration.name == name).update(
+                    {SharedGeneration.value: SharedGeneration.value + 1}, synchronize_session=False
+                )
+                if not updated:
+                    db.add(SharedGeneration(name=name, value=1))
+                try:
+                    db.commit()
+                except IntegrityError:
+                    # Another process inserted the row first; increment that one instead
+                    db.rollback()
+                    continue
+                return db.query(SharedGeneration.value).filter(SharedGeneration.name == name).scalar()
+            raise Exception(f"Could not bump shared generation {name}")
+        finally:
+            db.close()
+
+    def acquire_lease(self, name: str, seconds: float) -> bool:
+        # The row's value holds the epoch second the current lease runs out
+        db = self.session_factory()
+        try:
+            now = int(time.time())
+            key = f"lease:{name}"
+            updated = db.query(SharedGeneration).filter(SharedGeneration.name == key, SharedGeneration.value <= now).update(
+                {SharedGeneration.value: now + int(seconds)}, synchronize_session=False
+            )
+            if not updated:
+                if db.query(SharedGeneration.name).filter(SharedGeneration.name == key).first():
+                    db.rollback()
+                    return False
+                db.add(SharedGeneration(name=key, value=now + int(seconds)))
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                return False
+            return True
+        finally:
+            db.close()
+
+    def release_lease(self, name: str):
+        db = self.session_factory()
+        try:
+            db.query(SharedGeneration).filter(SharedGeneration.name == f"lease:{name}").update(
+                {SharedGeneration.value: 0}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+class RedisGenerations:
+    def __init__(self, client_factory=get_redis, prefix: str = REDIS_PREFIX):
+        self.client_factory = client_factory
+        self.prefix = prefix
+
+    def get(self, name: str) -> int:
+        return int(self.client_factory().get(f"{self.prefix}gen:{name}") or 0)
+
+    def bump(self, name: str) -> int:
+        return int(self.client_factory().incr(f"{self.prefix}gen:{name}"))
+
+    def acquire_lease(self, name: str, seconds: float) -> bool:
+        return bool(self.client_factory().set(f"{self.prefix}lease:{name}", 1, nx=True, ex=max(1, int(seconds))))
+
+    def release_lease(self, name: str):
+        self.client_factory().delete(f"{self.prefix}lease:{name}")
+
+def _create_generations():
+    if STATE_BACKEND == "local":
+        return LocalGenerations()
+    if STATE_BACKEND == "db":
+        return DatabaseGenerations()
+    if STATE_BACKEND == "redis":
+        return RedisGenerations()
+    raise Exception(f"Unknown PUSHGATE_STATE_BACKEND: {STATE_BACKEND}")
+
+generations = _create_generations()
+
+def bump_generation(name: str) -> int:
+    # Tell every process that its cached copy of `name` is out of date
+    return generations.bump(name)
+
+def acquire_lease(name: str, seconds: float) -> bool:
+    # At most one process at a time holds `name` (for background jobs every worker would otherwise
+    # run); the lease lapses after `seconds` if its holder dies without releasing it
+    return generations.acquire_lease(name, seconds)
+
+def release_lease(name: str):
+    generations.release_lease(name)
+
+class GenerationWatcher:
+    # Cheap "has anyone invalidated this?" check for a process-local cache: reads the shared
+    # generation at most once per interval, and changed() is True once each time it moves.
+    def __init__(self, name: str, interval: float = STATE_CHECK_INTERVAL, store=None, clock=time.monotonic):
+        self.name = name
+        self.interval = interval
+        self.store = store
+        self.clock = clock
+        self.seen = None
+        self.checked_at = None
+
+    def current(self):
+        store = self.store or generations
+        try:
+            return store.get(self.name)
+        except Exception:
+            logger.warning("Could not read shared generation %s", self.name, exc_info=True)
+            return self.seen
+
+    def changed(self) -> bool:
+        now = self.clock()
+        if self.checked_at is not None and now - self.checked_at < self.interval:
+            return False
+        self.checked_at = now
+        value = self.current()
+        if self.seen is None:
+            self.seen = value
+            return False
+        if value != self.seen:
+            self.seen = value
+            return True
+        return False
+
+def _fernet_key_generation():
+    try:
+        return generations.get("fernet_keys")
+    except Exception:
+        logger.warning("Could not read the shared Fernet key generation", exc_info=True)
+        return None
+
+if STATE_BACKEND != "local":
+    # Key rotation bumps this, so every worker re-reads the key file on its next check
+    crypto.key_generation_source = _fernet_key_generation
+
+def check_deployment():
+    # Warn when several workers would each keep their own copy of state that must be shared
+    if WORKERS > 1 and STATE_BACKEND == "local":
+        logger.warning(
+            "PUSHGATE_WORKERS=%d with PUSHGATE_STATE_BACKEND=local: rate limits are enforced per worker. "
+            "Set PUSHGATE_STATE_BACKEND=db or redis.", WORKERS
+        )
@@ -0,0 +1,124 @@
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+from .models import Token
+from .crypto import decrypt, token_digest, token_digests
+
+# Characters of the plaintext kept in token_prefix. Enough to tell tokens apart at a glance,
+# too few to matter for a 43-character random token.
+TOKEN_PREFIX_LENGTH = 6
+LABEL_MAX_LENGTH = 64
+# Columns the admin pages read; the encrypted token is left out, as it is never shown
+TOKEN_LIST_COLUMNS = ("id", "label", "token_prefix", "created_at", "last_used", "rate_limit_per_hour",
+                      "dedup_window_seconds", "dedup_mode", "retention_days", "dispatch_weight")
+
+def token_prefix(token: str) -> str:
+    return token[:TOKEN_PREFIX_LENGTH]
+
+def clean_label(label: str):
+    # Normalized label, or None for an empty one. Raises ValueError for labels that cannot be
+    # told apart from a token id (all digits) or are too long.
+    label = (label or "").strip()
+    if not label:
+        return None
+    if label.isdigit():
+        raise ValueError("Label cannot be only digits")
+    if len(label) > LABEL_MAX_LENGTH:
+        raise ValueError(f"Label is longer than {LABEL_MAX_LENGTH} characters")
+    return label
+
+def resolve_token_ref(db: Session, ref: str):
+    # Token id for "42" or for a label; None if no such token. Reads no secrets.
+    ref = (ref or "").strip()
+    if ref.isdigit():
+        row = db.query(Token.id).filter(Token.id == int(ref)).first()
+    else:
+        row = db.query(Token.id).filter(Token.label == ref).first()
+    return row.id if row else None
+
+def token_names(db: Session, token_ids):
+    # {id: label, or prefix followed by an ellipsis} for the given ids only
+    ids = {i for i in token_ids if i}
+    if not ids:
+        return {}
+    rows = db.query(Token.id, Token.label, Token.token_prefix).filter(Token.id.in_(ids))
+    return {r.id: r.label or (f"{r.token_prefix}…" if r.token_prefix else f"#{r.id}") for r in rows}
+
+def token_page(db: Session, q: str = None, page_size: int = 50, before: int = None, after: int = None):
+    # Keyset pagination by id, oldest first. `after` pages forward, `before` back; only
+    # page_size + 1 rows are read and nothing is decrypted. q matches an id, part of a label,
+    # or the start of a token.
+    columns = [getattr(Token, c) for c in TOKEN_LIST_COLUMNS]
+    query = db.query(*columns)
+    q = (q or "").strip()
+    if q:
+        matches = [Token.label.ilike(f"%{q}%"), Token.token_prefix == q[:TOKEN_PREFIX_LENGTH]]
+        if q.isdigit():
+            matches.append(Token.id == int(q))
+        query = query.filter(or_(*matches))
+    if before:
+        rows = query.filter(Token.id < before).order_by(Token.id.desc()).limit(page_size + 1).all()
+        has_previous = len(rows) > page_size
+        rows = list(reversed(rows[:page_size]))
+        has_next = True
+    else:
+        if after:
+            query = query.filter(Token.id > after)
+        rows = query.order_by(Token.id).limit(page_size + 1).all()
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_previous = bool(after)
+    return {
+        "tokens": [dict(zip(TOKEN_LIST_COLUMNS, row)) for row in rows],
+        "previous_cursor": rows[0].id if rows and has_previous else None,
+        "next_cursor": rows[-1].id if rows and has_next else None,
+    }
+
+def lookup_token(db: Session, token: str):
+    # Indexed lookup by keyed digest; one query regardless of how many tokens exist
+    digests = token_digests(token)
+    token_obj = db.query(Token).filter(Token.token_digest.in_(digests)).first()
+    if token_obj:
+        if token_obj.token_prefix is None:
+            # Created before prefixes were stored; one write on its first use
+            token_obj.token_prefix = token_prefix(token)
+            db.commit()
+        return token_obj
+    digest = digests[0]
+    # Rows created before the digest column existed are matched the old way once,
+    # then get their digest filled in so the next lookup hits the index.
+    for t in db.query(Token).filter(Token.token_digest.is_(None)).all():
+        try:
+            if decrypt(t.encrypted_token) == token:
+                t.token_digest = digest
+                t.token_prefix = token_prefix(token)
+                db.commit()
+                return t
+        except Exception:
+            continue
+    return None
+
+def backfill_token_digests(db: Session, batch_size: int = 500):
+    # Fill token_digest and token_prefix for legacy rows; returns (updated, failed)
+    updated = failed = 0
+    last_id = 0
+    while True:
+        rows = (
+            db.query(Token)
+            .filter(or_(Token.token_digest.is_(None), Token.token_prefix.is_(None)), Token.id > last_id)
+            .order_by(Token.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        for t in rows:
+            last_id = t.id
+            try:
+                plain = decrypt(t.encrypted_token)
+                t.token_digest = token_digest(plain)
+                t.token_prefix = token_prefix(plain)
+                updated += 1
+            except Exception:
+                failed += 1
+        db.commit()
+    return updated, failed
@@ -0,0 +1,185 @@
+import os
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+from .models import Message, UsageRollup
+
+# Upper bounds (seconds) of the Pushover latency buckets kept per rollup row (columns latency_0..7)
+LATENCY_BOUNDS = (0.1, 0.25, 0.5, 1, 2, 5, 10, float("inf"))
+LATENCY_COLUMNS = [f"latency_{i}" for i in range(len(LATENCY_BOUNDS))]
+# Minute rows are dropped after this many hours (by the retention job); hour rows are kept
+USAGE_MINUTE_RETENTION_HOURS = int(os.getenv("PUSHGATE_USAGE_MINUTE_RETENTION_HOURS", "48"))
+# Stats for ranges up to this long are answered from minute rows, longer ones from hour rows
+STATS_MINUTE_RANGE_HOURS = 6
+SUM_COLUMNS = ["count", "latency_count", "latency_sum"] + LATENCY_COLUMNS
+KEY_COLUMNS = ["granularity", "bucket", "token_id", "config_id", "status"]
+# Message statuses that are not a delivery outcome: still waiting ("queued", "scheduled"), or never sent
+UNCOUNTED_STATUSES = ("queued", "scheduled", "cancelled")
+
+def _floor(when: datetime, granularity: str) -> datetime:
+    if granularity == "m":
+        return when.replace(second=0, microsecond=0)
+    return when.replace(minute=0, second=0, microsecond=0)
+
+def _upsert(db: Session, key, sums):
+    values = dict(zip(KEY_COLUMNS, key), **sums)
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(UsageRollup).values(**values)
+        columns = UsageRollup.__table__.c
+        stmt = stmt.on_conflict_do_update(
+            index_elements=KEY_COLUMNS, set_={c: columns[c] + stmt.excluded[c] for c in SUM_COLUMNS}
+        )
+        db.execute(stmt)
+        return
+    filters = [getattr(UsageRollup, c) == v for c, v in zip(KEY_COLUMNS, key)]
+    updated = db.query(UsageRollup).filter(*filters).update(
+        {getattr(UsageRollup, c): getattr(UsageRollup, c) + v for c, v in sums.items()}, synchronize_session=False
+    )
+    if not updated:
+        db.add(UsageRollup(**values))
+        db.flush()
+
+def record_usage(db: Session, entries):
+    # Add sends to the minute and hour rollups; the caller commits, normally together with the
+    # Message rows, so rollups and the log agree. entries: (timestamp, token_id, config_id,
+    # status, Pushover latency in seconds or None). Increments are additive, so concurrent
+    # writers (other workers) never overwrite each other.
+    totals = {}
+    for when, token_id, config_id, status, latency in entries:
+        for granularity in ("m", "h"):
+            key = (granularity, _floor(when, granularity), token_id or 0, config_id or 0, str(status)[:16])
+            sums = totals.get(key)
+            if sums is None:
+                sums = totals[key] = dict.fromkeys(SUM_COLUMNS, 0)
+            sums["count"] += 1
+            if latency is not None:
+                sums["latency_count"] += 1
+                sums["latency_sum"] += latency
+                sums[LATENCY_COLUMNS[bisect_left(LATENCY_BOUNDS, latency)]] += 1
+    for key, sums in totals.items():
+        _upsert(db, key, sums)
+
+def prune_minute_rollups(db: Session, now: datetime = None) -> int:
+    cutoff = (now or datetime.utcnow()) - timedelta(hours=USAGE_MINUTE_RETENTION_HOURS)
+    deleted = db.query(UsageRollup).filter(UsageRollup.granularity == "m", UsageRollup.bucket < cutoff).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+def latency_percentile(buckets, fraction: float = 0.95):
+    # Estimate from bucket counts, interpolating linearly inside the bucket that holds it.
+    # Past the last finite bound the bound itself is returned (a lower limit).
+    total = sum(buckets)
+    if not total:
+        return None
+    target = fraction * total
+    seen, lower = 0, 0.0
+    for upper, count in zip(LATENCY_BOUNDS, buckets):
+        if count and seen + count >= target:
+            if upper == float("inf"):
+                return lower
+            return lower + (upper - lower) * (target - seen) / count
+        seen += count
+        lower = upper
+    return lower
+
+def _summary(rows):
+    # rows: (status, count, latency_count, latency_sum, latency_0..7) for one group
+    count = errors = latency_count = 0
+    latency_sum = 0.0
+    buckets = [0] * len(LATENCY_BOUNDS)
+    for row in rows:
+        count += row.count
+        if row.status != "200":
+            errors += row.count
+        latency_count += row.latency_count or 0
+        latency_sum += row.latency_sum or 0
+        buckets = [b + (getattr(row, c) or 0) for b, c in zip(buckets, LATENCY_COLUMNS)]
+    return {
+        "count": count,
+        "errors": errors,
+        "error_rate": errors / count if count else 0.0,
+        "avg_latency": latency_sum / latency_count if latency_count else None,
+        "p95_latency": latency_percentile(buckets, 0.95),
+    }
+
+def _grouped(db: Session, granularity: str, since: datetime, until: datetime, group, token_id=None, config_id=None):
+    sums = [func.sum(getattr(UsageRollup, c)).label(c) for c in SUM_COLUMNS]
+    query = db.query(group.label("group"), UsageRollup.status, *sums).filter(
+        UsageRollup.granularity == granularity, UsageRollup.bucket >= since, UsageRollup.bucket < until
+    )
+    if token_id is not None:
+        query = query.filter(UsageRollup.token_id == token_id)
+    if config_id is not None:
+        query = query.filter(UsageRollup.config_id == config_id)
+    by_group = {}
+    for row in query.group_by(group, UsageRollup.status):
+        by_group.setdefault(row.group, []).append(row)
+    return by_group
+
+def usage_stats(db: Session, since: datetime, until: datetime = None, token_id: int = None, config_id: int = None):
+    # Volume, error rate and latency for a time range: overall, per token, per config and as a
+    # time series. Reads only rollup rows, so the cost depends on the range, not the log size.
+    until = until or datetime.utcnow()
+    use_minutes = (
+        until - since <= timedelta(hours=STATS_MINUTE_RANGE_HOURS)
+        and since >= datetime.utcnow() - timedelta(hours=USAGE_MINUTE_RETENTION_HOURS)
+    )
+    granularity = "m" if use_minutes else "h"
+    since = _floor(since, granularity)
+    args = (db, granularity, since, until)
+    tokens = _grouped(*args, UsageRollup.token_id, token_id=token_id, config_id=config_id)
+    configs = _grouped(*args, UsageRollup.config_id, token_id=token_id, config_id=config_id)
+    series = db.query(
+        UsageRollup.bucket,
+        func.sum(UsageRollup.count).label("count"),
+        func.sum(case((UsageRollup.status != "200", UsageRollup.count), else_=0)).label("errors"),
+    ).filter(UsageRollup.granularity == granularity, UsageRollup.bucket >= since, UsageRollup.bucket < until)
+    if token_id is not None:
+        series = series.filter(UsageRollup.token_id == token_id)
+    if config_id is not None:
+        series = series.filter(UsageRollup.config_id == config_id)
+    series = series.group_by(UsageRollup.bucket).order_by(UsageRollup.bucket)
+    return {
+        "since": since,
+        "until": until,
+        "granularity": "minute" if use_minutes else "hour",
+        "total": _summary([row for rows in tokens.values() for row in rows]),
+        "tokens": sorted(({"token_id": k, **_summary(v)} for k, v in tokens.items()), key=lambda s: -s["count"]),
+        "configs": sorted(({"config_id": k, **_summary(v)} for k, v in configs.items()), key=lambda s: -s["count"]),
+        "series": [{"bucket": row.bucket, "count": row.count, "errors": row.errors} for row in series],
+    }
+
+def rebuild_rollups(db: Session, since: datetime, batch_size: int = 1000, on_batch=None) -> int:
+    # Recompute rollups from the message log for messages at or after `since` (floored to the
+    # hour), e.g. for history logged before rollups existed. The log holds no config id or
+    # latency, so rebuilt rows have config_id 0 and no latency data. Messages still queued or
+    # scheduled are skipped, as they are counted once delivered, and so are cancelled ones.
+    # Returns the number of messages counted.
+    since = _floor(since, "h")
+    db.query(UsageRollup).filter(UsageRollup.bucket >= since).delete(synchronize_session=False)
+    db.commit()
+    last_id, counted = 0, 0
+    while True:
+        rows = (
+            db.query(Message.id, Message.timestamp, Message.token_id, Message.status)
+            .filter(Message.id > last_id, Message.timestamp >= since, Message.status.notin_(UNCOUNTED_STATUSES))
+            .order_by(Message.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        last_id = rows[-1].id
+        record_usage(db, [(r.timestamp, r.token_id, None, r.status, None) for r in rows])
+        db.commit()
+        counted += len(rows)
+        if on_batch:
+            on_batch(last_id, counted)
+    prune_minute_rollups(db)
+    return counted
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Benchmark message logging under burst load: one commit per message (the old
+/send behaviour) against the group-commit log writer in "wait" mode.
+
+Many threads log messages at once against a throwaway SQLite database; the
+script reports throughput, commit count and per-write latency.
+
+Usage:
+    python bench/bench_log_writer.py [--threads 32] [--per-thread 100]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+def run(write, threads, per_thread):
+    latencies = []
+
+    def worker(t):
+        local = []
+        for i in range(per_thread):
+            start = time.perf_counter()
+            write(t, i)
+            local.append(time.perf_counter() - start)
+        return local
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for local in pool.map(worker, range(threads)):
+            latencies += local
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "rows/s": len(latencies) / elapsed,
+        "mean ms": statistics.mean(latencies) * 1000,
+        "p99 ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="message log write benchmark")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--per-thread", type=int, default=100)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pushgate-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    from sqlalchemy.exc import OperationalError
+    from app.db import init_db
+    from app.log_writer import LogWriter, _write_now
+
+    init_db()
+    total = args.threads * args.per_thread
+    errors = []
+
+    def per_row(t, i):
+        try:
+            _write_now(1, f"bench {t}/{i}", 200)
+        except OperationalError as e:  # "database is locked" under contention
+            errors.append(e)
+
+    direct = run(per_row, args.threads, args.per_thread)
+    direct["commits"] = total - len(errors)
+    direct["errors"] = len(errors)
+
+    writer = LogWriter()
+    grouped = run(lambda t, i: writer.submit(1, f"bench {t}/{i}", 200).result(), args.threads, args.per_thread)
+    writer.stop()
+    grouped["commits"] = writer.flushes
+    grouped["errors"] = 0
+
+    print(f"{total} rows from {args.threads} threads")
+    print(f"{'':<22} {'rows/s':>9} {'mean ms':>9} {'p99 ms':>9} {'commits':>8} {'errors':>7}")
+    for name, r in (("commit per message", direct), ("group commit (wait)", grouped)):
+        print(f"{name:<22} {r['rows/s']:>9.0f} {r['mean ms']:>9.2f} {r['p99 ms']:>9.2f} {r['commits']:>8} {r['errors']:>7}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark the rate-limit check and the message history queries on a large
+messages table, before and after migration 2 (messages indexes).
+
+Seeds a throwaway SQLite database, drops the indexes to simulate a database
+created before the migration, times the queries, applies the migration and
+times them again.
+
+Usage:
+    python bench/bench_message_indexes.py [--rows 2000000] [--tokens 100] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+STATUSES = ["200"] * 90 + ["429"] * 4 + ["502"] * 3 + ["error"] * 2 + ["400"]
+
+def seed(path, rows, tokens, days):
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO tokens (id, encrypted_token, rate_limit_per_hour) VALUES (?, ?, 1000000)", [(i, f"bench-{i}") for i in range(1, tokens + 1)])
+    start = datetime.utcnow() - timedelta(days=days)
+    span = days * 86400
+    batch = []
+    for i in range(rows):
+        ts = start + timedelta(seconds=span * i / rows)
+        batch.append((random.randint(1, tokens), f"bench message {i} host{random.randint(1, 500)} disk usage high", ts.isoformat(" "), random.choice(STATUSES)))
+        if len(batch) == 50000:
+            conn.executemany("INSERT INTO messages (token_id, message, timestamp, status) VALUES (?, ?, ?, ?)", batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT INTO messages (token_id, message, timestamp, status) VALUES (?, ?, ?, ?)", batch)
+    conn.commit()
+    conn.close()
+
+def timed(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+def run_queries(SessionLocal, Message, check_token_rate_limit, tokens, repeat):
+    db = SessionLocal()
+    results = {
+        "rate limit check": timed(lambda: check_token_rate_limit(db, random.randint(1, tokens), 1000000), repeat),
+        "history page (status filter)": timed(lambda: (
+            db.query(Message).filter(Message.status == "502").count(),
+            db.query(Message).filter(Message.status == "502").order_by(Message.timestamp.desc()).limit(20).all(),
+        ), repeat),
+        "history page (no filter)": timed(lambda: db.query(Message).order_by(Message.timestamp.desc()).limit(20).all(), repeat),
+    }
+    db.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="messages index benchmark")
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pushgate-bench-")
+    db_path = os.path.join(workdir, "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    from sqlalchemy import text
+    from app.db import SessionLocal, engine, init_db
+    from app.models import Message
+    from app.migrations import migrate
+    from app.rate_limit import check_token_rate_limit
+
+    init_db()
+    # Simulate a database from before migration 2
+    with engine.begin() as conn:
+        for name in ("ix_messages_token_id_timestamp", "ix_messages_status_timestamp", "ix_messages_timestamp"):
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        conn.execute(text("DELETE FROM schema_migrations WHERE version = 2"))
+    print(f"Seeding {args.rows} messages...")
+    start = time.perf_counter()
+    seed(db_path, args.rows, args.tokens, args.days)
+    print(f"Seeded in {time.perf_counter() - start:.1f}s")
+
+    before = run_queries(SessionLocal, Message, check_token_rate_limit, args.tokens, args.repeat)
+    start = time.perf_counter()
+    migrate(engine)
+    print(f"Migration built indexes in {time.perf_counter() - start:.1f}s")
+    after = run_queries(SessionLocal, Message, check_token_rate_limit, args.tokens, args.repeat)
+
+    print(f"{'query':<32} {'before ms':>10} {'after ms':>10}")
+    for name in before:
+        print(f"{name:<32} {before[name]:>10.2f} {after[name]:>10.2f}")
+
+if __name__ == "__main__":
+    main()
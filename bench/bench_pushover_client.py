@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Compare Pushover delivery throughput: the old per-request requests.post path
+(run from a thread pool, like a sync FastAPI handler; kept here as the baseline,
+the app no longer has it) against the shared async httpx client with a
+keep-alive connection pool.
+
+Starts the fake Pushover API (bench/fake_pushover.py) locally with a fixed latency.
+
+Usage:
+    python bench/bench_pushover_client.py [--requests 2000] [--concurrency 20] [--latency-ms 20]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+def start_fake_pushover(port, latency_ms):
+    # Separate process so the stand-in does not compete with the client for the GIL
+    import socket
+    proc = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(__file__), "fake_pushover.py"), "--port", str(port), "--latency-ms", str(latency_ms)])
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise Exception("fake Pushover API did not start")
+
+def send_sync(config, message):
+    # The old send path: decrypt the config and make a fresh requests.post for every message
+    import requests
+    from app.crypto import decrypt
+    from app.pushover import PUSHOVER_API_URL
+    payload = {"token": decrypt(config.encrypted_app_token), "user": decrypt(config.encrypted_user_key), "message": message}
+    resp = requests.post(PUSHOVER_API_URL, data=payload)
+    return resp.status_code, resp.text
+
+def bench_sync(config, n, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(lambda i: send_sync(config, f"bench {i}"), range(n)))
+        elapsed = time.perf_counter() - start
+    assert all(status == 200 for status, _ in results)
+    return n / elapsed
+
+async def bench_async(config, n, concurrency):
+    from app.pushover import post_pushover_message, close_client
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            return await post_pushover_message(config, f"bench {i}")
+
+    await one(-1)  # warm the pool
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(n)))
+    elapsed = time.perf_counter() - start
+    await close_client()
+    assert all(status == 200 for status, _ in results)
+    return n / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Pushover client throughput")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20, help="Threadpool size / in-flight async requests")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--port", type=int, default=8099)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pushgate-bench-")
+    from cryptography.fernet import Fernet
+    key_path = os.path.join(workdir, "fernet_key")
+    with open(key_path, "wb") as f:
+        f.write(Fernet.generate_key())
+    os.environ["FERNET_KEY_FILE"] = key_path
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["PUSHOVER_API_URL"] = f"http://127.0.0.1:{args.port}/1/messages.json"
+
+    from app.crypto import encrypt
+    config = SimpleNamespace(id=0, encrypted_app_token=encrypt("bench-app"), encrypted_user_key=encrypt("bench-user"))
+    fake = start_fake_pushover(args.port, args.latency_ms)
+    try:
+        sync_rps = bench_sync(config, args.requests, args.concurrency)
+        async_rps = asyncio.run(bench_async(config, args.requests, args.concurrency))
+    finally:
+        fake.terminate()
+    print(f"requests={args.requests} concurrency={args.concurrency} upstream latency={args.latency_ms}ms")
+    print(f"sync requests.post per call : {sync_rps:8.1f} req/s")
+    print(f"async pooled httpx client   : {async_rps:8.1f} req/s ({async_rps / sync_rps:.1f}x)")
+
+if __name__ == "__main__":
+    main()
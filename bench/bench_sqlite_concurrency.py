@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Concurrency benchmark for the SQLite engine profile: writer threads commit
+message rows while reader threads load history pages, first with SQLite's
+defaults (PUSHGATE_DB_PROFILE=default) and then with the tuned profile
+(WAL, synchronous=NORMAL, busy_timeout, cache and mmap sizing, read pool).
+
+Each profile runs in its own subprocess because the engine is configured at import.
+
+Usage:
+    python bench/bench_sqlite_concurrency.py [--writers 8] [--readers 8] [--seconds 10] [--rows 200000]
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+def child(args):
+    from datetime import datetime
+    from sqlalchemy.exc import OperationalError
+    from app.db import SessionLocal, ReadSessionLocal, init_db
+    from app.models import Message
+
+    init_db()
+    db = SessionLocal()
+    if db.query(Message).count() < args.rows:
+        db.bulk_insert_mappings(Message, [
+            {"token_id": random.randint(1, 50), "message": f"seed {i}", "status": random.choice(["200", "200", "200", "502"]), "timestamp": datetime.utcnow()}
+            for i in range(args.rows)
+        ])
+        db.commit()
+    db.close()
+
+    stop = time.monotonic() + args.seconds
+    stats = {"writes": 0, "reads": 0, "errors": 0, "write_latencies": []}
+    lock = threading.Lock()
+
+    def writer():
+        while time.monotonic() < stop:
+            s = SessionLocal()
+            start = time.perf_counter()
+            try:
+                s.add(Message(token_id=random.randint(1, 50), message="bench", status="200", timestamp=datetime.utcnow()))
+                s.commit()
+                with lock:
+                    stats["writes"] += 1
+                    stats["write_latencies"].append(time.perf_counter() - start)
+            except OperationalError:
+                s.rollback()
+                with lock:
+                    stats["errors"] += 1
+            finally:
+                s.close()
+
+    def reader():
+        while time.monotonic() < stop:
+            s = ReadSessionLocal()
+            try:
+                s.query(Message).filter(Message.status == "502").order_by(Message.timestamp.desc()).limit(20).all()
+                s.query(Message).filter(Message.token_id == random.randint(1, 50)).count()
+                with lock:
+                    stats["reads"] += 1
+            except OperationalError:
+                with lock:
+                    stats["errors"] += 1
+            finally:
+                s.close()
+
+    threads = [threading.Thread(target=writer) for _ in range(args.writers)] + [threading.Thread(target=reader) for _ in range(args.readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    lat = sorted(stats.pop("write_latencies")) or [0]
+    stats["p99_write_ms"] = lat[int(len(lat) * 0.99) - 1] * 1000
+    print(json.dumps(stats))
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite engine profile concurrency benchmark")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+
+    print(f"{'profile':<10} {'writes/s':>9} {'reads/s':>9} {'p99 write ms':>13} {'errors':>7}")
+    for profile in ("default", "tuned"):
+        workdir = tempfile.mkdtemp(prefix="pushgate-bench-")
+        env = dict(os.environ, PUSHGATE_DB_PROFILE=profile, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", "--writers", str(args.writers), "--readers", str(args.readers), "--seconds", str(args.seconds), "--rows", str(args.rows)],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout.strip().splitlines()[-1]
+        r = json.loads(out)
+        print(f"{profile:<10} {r['writes'] / args.seconds:>9.0f} {r['reads'] / args.seconds:>9.0f} {r['p99_write_ms']:>13.1f} {r['errors']:>7}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark /send token validation against the number of stored tokens.
+Compares the indexed digest lookup with the old decrypt-every-row scan.
+
+Uses a throwaway SQLite database and Fernet key in a temp directory.
+
+Usage:
+    python bench/bench_token_lookup.py [--sizes 10,100,1000,10000,100000] [--lookups 200] [--scan-max 10000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+def setup_env(workdir):
+    from cryptography.fernet import Fernet
+    key_path = os.path.join(workdir, "fernet_key")
+    with open(key_path, "wb") as f:
+        f.write(Fernet.generate_key())
+    os.environ["FERNET_KEY_FILE"] = key_path
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+def seed(db, Token, encrypt, token_digest, start, stop):
+    plain = []
+    rows = []
+    for _ in range(start, stop):
+        t = "".join(random.choices("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789", k=30))
+        plain.append(t)
+        rows.append(Token(encrypted_token=encrypt(t), token_digest=token_digest(t), rate_limit_per_hour=5))
+    db.add_all(rows)
+    db.commit()
+    return plain
+
+def linear_scan(db, Token, decrypt, token):
+    for t in db.query(Token).all():
+        if decrypt(t.encrypted_token) == token:
+            return t
+    return None
+
+def timed(fn, tokens):
+    start = time.perf_counter()
+    for t in tokens:
+        assert fn(t) is not None
+    return (time.perf_counter() - start) / len(tokens) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="10,100,1000,10000,100000")
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--scan-max", type=int, default=10000, help="Skip the linear scan above this many tokens")
+    args = parser.parse_args()
+    sizes = sorted(int(s) for s in args.sizes.split(","))
+
+    workdir = tempfile.mkdtemp(prefix="pushgate-bench-")
+    setup_env(workdir)
+    from app.db import SessionLocal, init_db
+    from app.models import Token
+    from app.crypto import encrypt, decrypt, token_digest
+    from app.tokens import lookup_token
+
+    init_db()
+    db = SessionLocal()
+    plain = []
+    print(f"{'tokens':>8} {'indexed ms':>12} {'scan ms':>12}")
+    for size in sizes:
+        plain += seed(db, Token, encrypt, token_digest, len(plain), size)
+        sample = random.choices(plain, k=args.lookups)
+        indexed = timed(lambda t: lookup_token(db, t), sample)
+        scan = "-"
+        if size <= args.scan_max:
+            scan_sample = sample[: max(1, min(len(sample), 2000 // max(1, size // 100)))]
+            scan = f"{timed(lambda t: linear_scan(db, Token, decrypt, t), scan_sample):.3f}"
+        print(f"{size:>8} {indexed:>12.3f} {scan:>12}")
+    db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Pushover messages API, for tests and benchmarks.
+Accepts POST /1/messages.json, checks that token/user/message are present and
+answers like Pushover does, after an optional artificial delay. Failures can be
+injected: a fraction of requests answered with 500 or 429, and a per-app message
+quota reported through the X-Limit-App-* headers (429 once it is used up).
+
+Usage:
+    python bench/fake_pushover.py [--port 8099] [--latency-ms 50] [--jitter-ms 10]
+                                  [--error-rate 0.01] [--throttle-rate 0.01] [--app-limit 10000]
+
+Then point Pushgate at it:
+    PUSHOVER_API_URL=http://127.0.0.1:8099/1/messages.json uvicorn app.main:app
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+def create_app(latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0, throttle_rate: float = 0, app_limit: int = None, seed: int = None):
+    received = []
+    used = {}  # app token -> messages accepted
+    rng = random.Random(seed)
+    reset_at = int(time.time()) + 30 * 86400
+
+    async def messages(request: Request):
+        form = await request.form()
+        delay = latency_ms + (rng.uniform(0, jitter_ms) if jitter_ms else 0)
+        if delay:
+            await asyncio.sleep(delay / 1000)
+        request_id = str(uuid.uuid4())
+        app_token = form.get("token")
+        headers = {}
+        if app_limit is not None:
+            remaining = max(app_limit - used.get(app_token, 0), 0)
+            headers = {"X-Limit-App-Limit": str(app_limit), "X-Limit-App-Remaining": str(remaining), "X-Limit-App-Reset": str(reset_at)}
+            if not remaining:
+                return JSONResponse({"status": 0, "errors": ["application is over its message limit"], "request": request_id}, status_code=429, headers=headers)
+        roll = rng.random()
+        if roll < error_rate:
+            return JSONResponse({"status": 0, "errors": ["internal error"], "request": request_id}, status_code=500)
+        if roll < error_rate + throttle_rate:
+            return JSONResponse({"status": 0, "errors": ["too many requests"], "request": request_id}, status_code=429, headers=headers)
+        missing = [f for f in ("token", "user", "message") if not form.get(f)]
+        if missing:
+            return JSONResponse({"status": 0, "errors": [f"{f} is invalid" for f in missing], "request": request_id}, status_code=400, headers=headers)
+        received.append(dict(form))
+        if app_limit is not None:
+            used[app_token] = used.get(app_token, 0) + 1
+            headers["X-Limit-App-Remaining"] = str(app_limit - used[app_token])
+        return JSONResponse({"status": 1, "request": request_id}, headers=headers)
+
+    app = Starlette(routes=[Route("/1/messages.json", messages, methods=["POST"])])
+    app.state.received = received
+    return app
+
+def main():
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Fake Pushover API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0, help="extra random delay, uniform in [0, jitter]")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0, help="fraction of requests answered with 429")
+    parser.add_argument("--app-limit", type=int, default=None, help="messages per app token before every request gets 429")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    app = create_app(args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rate, args.app_limit, args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
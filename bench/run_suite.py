@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test: seeds a database (bench/seed.py), starts the fake Pushover
+API (bench/fake_pushover.py) and Pushgate itself under uvicorn, then drives HTTP
+scenarios against it and writes the results as JSON.
+
+Scenarios:
+    send             POST /send, one message per request
+    send_batch       POST /send/batch, --batch-size messages per request
+    messages_page    GET /messages, following "Older" links --page-depth pages deep
+    messages_search  GET /api/messages/search for a random word
+    tokens_page      GET /tokens
+
+Every scenario reports request count, status codes, throughput and latency
+percentiles. --compare checks the run against an earlier results file and exits
+with status 1 if throughput dropped or p95 latency grew by more than --tolerance.
+
+Usage:
+    python bench/run_suite.py [--messages 200000] [--requests 2000] [--concurrency 20]
+        [--latency-ms 20] [--error-rate 0] [--throttle-rate 0] [--workers 1] [--state-backend db]
+        [--scenarios send,send_batch,messages_page,messages_search,tokens_page]
+        [--output bench_results.json] [--compare baseline.json] [--tolerance 0.2]
+"""
+import argparse
+import asyncio
+import html
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+BENCH = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ["send", "send_batch", "messages_page", "messages_search", "tokens_page"]
+SEARCH_WORDS = ["backup", "disk", "deploy", "alert", "latency", "nightly", "failed", "restart"]
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port, proc, name, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise Exception(f"{name} exited with status {proc.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise Exception(f"{name} did not start listening on port {port}")
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def summarize(latencies, statuses, elapsed):
+    latencies = sorted(latencies)
+    counts = {}
+    for code in statuses:
+        counts[str(code)] = counts.get(str(code), 0) + 1
+    return {
+        "requests": len(statuses),
+        "errors": sum(1 for code in statuses if not (isinstance(code, int) and 200 <= code < 400)),
+        "status_counts": counts,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(statuses) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+            **{f"p{p}": round(percentile(latencies, p) * 1000, 2) if latencies else None for p in (50, 95, 99)},
+            "max": round(latencies[-1] * 1000, 2) if latencies else None,
+        },
+    }
+
+class Recorder:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = []
+
+    async def call(self, coro):
+        start = time.perf_counter()
+        try:
+            resp = await coro
+            status = resp.status_code
+        except httpx.HTTPError as e:
+            resp, status = None, type(e).__name__
+        self.latencies.append(time.perf_counter() - start)
+        self.statuses.append(status)
+        return resp
+
+async def run_concurrently(n, concurrency, one):
+    # one(i, recorder) performs request number i; at most `concurrency` in flight
+    recorder = Recorder()
+    sem = asyncio.Semaphore(concurrency)
+
+    async def guarded(i):
+        async with sem:
+            await one(i, recorder)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(guarded(i) for i in range(n)))
+    return summarize(recorder.latencies, recorder.statuses, time.perf_counter() - start)
+
+async def admin_login(client, password):
+    resp = await client.get("/pushgate/login")
+    match = re.search(r'name="csrf_token" value="([^"]+)"', resp.text)
+    if resp.status_code != 200 or not match:
+        return f"login page returned HTTP {resp.status_code}"
+    resp = await client.post("/pushgate/login", data={"password": password, "csrf_token": match.group(1)}, follow_redirects=False)
+    if resp.status_code != 303 or "Login+successful" not in resp.headers.get("location", ""):
+        return f"login returned HTTP {resp.status_code}"
+    return None
+
+async def run_scenarios(args, base_url, seed_info):
+    tokens, config_ids = seed_info["tokens"], seed_info["config_ids"]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results = {}
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        login_error = None
+        if any(s in args.scenarios for s in ("messages_page", "messages_search", "tokens_page")):
+            login_error = await admin_login(client, seed_info["admin_password"])
+
+        async def send(i, rec):
+            data = {"token": random.choice(tokens), "message": f"load test {i}", "pushover_config_id": random.choice(config_ids)}
+            await rec.call(client.post("/pushgate/send", data=data))
+
+        async def send_batch(i, rec):
+            body = {"token": random.choice(tokens), "messages": [{"message": f"load test {i}.{j}", "pushover_config_id": random.choice(config_ids)} for j in range(args.batch_size)]}
+            await rec.call(client.post("/pushgate/send/batch", json=body))
+
+        async def messages_page(i, rec):
+            # One chain of pages: newest page first, then keep following the "Older" link
+            url = "/pushgate/messages?page_size=50"
+            for _ in range(args.page_depth):
+                resp = await rec.call(client.get(url))
+                match = resp is not None and re.search(r'href="(\?[^"]*before=[^"]*)"', resp.text)
+                if not match:
+                    return
+                url = "/pushgate/messages" + html.unescape(match.group(1))
+
+        async def messages_search(i, rec):
+            await rec.call(client.get("/pushgate/api/messages/search", params={"q": random.choice(SEARCH_WORDS), "limit": 50}))
+
+        async def tokens_page(i, rec):
+            await rec.call(client.get("/pushgate/tokens"))
+
+        plans = {
+            "send": (args.requests, send),
+            "send_batch": (max(1, args.requests // args.batch_size), send_batch),
+            "messages_page": (max(1, args.admin_requests // args.page_depth), messages_page),
+            "messages_search": (args.admin_requests, messages_search),
+            "tokens_page": (args.admin_requests, tokens_page),
+        }
+        for name in args.scenarios:
+            if name != "send" and name != "send_batch" and login_error:
+                results[name] = {"skipped": f"admin login failed: {login_error}"}
+                print(f"{name:16s} skipped ({login_error})")
+                continue
+            n, one = plans[name]
+            results[name] = await run_concurrently(n, args.concurrency, one)
+            r = results[name]
+            print(f"{name:16s} {r['requests']:6d} req  {r['throughput_rps']:8.1f} req/s  p50 {r['latency_ms']['p50']:8.2f} ms  p95 {r['latency_ms']['p95']:8.2f} ms  p99 {r['latency_ms']['p99']:8.2f} ms  errors {r['errors']}")
+    return results
+
+def compare(results, baseline, tolerance):
+    # Returns a list of human-readable regressions (empty when the run is within tolerance)
+    regressions = []
+    for name, current in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before or "skipped" in before:
+            continue
+        if "skipped" in current:
+            # Measured before but not now (e.g. admin login broke): that is a regression too
+            regressions.append(f"{name}: not measured ({current['skipped']})")
+            continue
+        if before["throughput_rps"] and current["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput_rps']} -> {current['throughput_rps']} req/s")
+        p95_before, p95_now = before["latency_ms"]["p95"], current["latency_ms"]["p95"]
+        if p95_before and p95_now > p95_before * (1 + tolerance):
+            regressions.append(f"{name}: p95 latency {p95_before} -> {p95_now} ms")
+    return regressions
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Pushgate load-test suite")
+    parser.add_argument("--workdir", default=None, help="where the database, key file and seed data live (default: a temp dir)")
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--requests", type=int, default=2000, help="messages sent by the send scenarios")
+    parser.add_argument("--admin-requests", type=int, default=200, help="requests per admin scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--page-depth", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--throttle-rate", type=float, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--state-backend", default=None, help="PUSHGATE_STATE_BACKEND for the server (default: db when --workers > 1)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", default=None, help="earlier results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    random.seed(args.seed)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="pushgate-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    db_path = os.path.join(workdir, "bench.db")
+    key_file = os.path.join(workdir, "fernet_key")
+    seed_file = os.path.join(workdir, "seed.json")
+    database_url = f"sqlite:///{db_path}"
+
+    if not os.path.exists(seed_file):
+        print(f"Seeding {args.messages} messages into {db_path} ...")
+        subprocess.run([sys.executable, os.path.join(BENCH, "seed.py"), "--database-url", database_url, "--key-file", key_file,
+                        "--tokens", str(args.tokens), "--messages", str(args.messages), "--seed", str(args.seed), "--out", seed_file],
+                       check=True, stdout=subprocess.DEVNULL)
+    with open(seed_file) as f:
+        seed_info = json.load(f)
+
+    fake_port, app_port = free_port(), free_port()
+    fake = subprocess.Popen([sys.executable, os.path.join(BENCH, "fake_pushover.py"), "--port", str(fake_port), "--latency-ms", str(args.latency_ms),
+                             "--jitter-ms", str(args.jitter_ms), "--error-rate", str(args.error_rate), "--throttle-rate", str(args.throttle_rate), "--seed", str(args.seed)])
+    env = dict(os.environ, DATABASE_URL=database_url, FERNET_KEY_FILE=key_file, PUSHOVER_API_URL=f"http://127.0.0.1:{fake_port}/1/messages.json",
+               PUSHGATE_WORKERS=str(args.workers), PUSHGATE_STATE_BACKEND=args.state_backend or ("db" if args.workers > 1 else "local"))
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(app_port), "--workers", str(args.workers), "--log-level", "warning"], cwd=ROOT, env=env)
+    try:
+        wait_for_port(fake_port, fake, "fake Pushover API")
+        wait_for_port(app_port, server, "pushgate")
+        scenario_results = asyncio.run(run_scenarios(args, f"http://127.0.0.1:{app_port}", seed_info))
+    finally:
+        server.terminate()
+        fake.terminate()
+        server.wait(10)
+        fake.wait(10)
+
+    results = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "seeded_messages": seed_info["messages"],
+            "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "workdir")},
+        },
+        "scenarios": scenario_results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    failed = False
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            failed = True
+        else:
+            print(f"No regressions beyond {args.tolerance:.0%} against {args.compare}")
+    skipped = [name for name, r in scenario_results.items() if "skipped" in r]
+    if skipped:
+        # A requested scenario that could not run fails the run, baseline or not
+        print(f"FAILED scenarios not run: {', '.join(skipped)}")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
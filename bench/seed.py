@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Seed a Pushgate database for load tests: an admin password, Pushover configs,
+tokens and a large message history (spread over the last --days days, with a
+small vocabulary so history searches have hits).
+
+The plaintext tokens and the admin password are written to --out as JSON for
+the load-test runner (bench/run_suite.py).
+
+Usage:
+    python bench/seed.py --database-url sqlite:///./bench.db --key-file ./bench_fernet_key \\
+        [--tokens 50] [--messages 1000000] [--configs 2] [--out bench_seed.json]
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+WORDS = ["backup", "disk", "deploy", "alert", "cpu", "memory", "latency", "nightly", "report", "failed",
+         "succeeded", "restart", "cert", "expiring", "queue", "worker", "database", "login", "warning", "ok"]
+STATUSES = ["200"] * 18 + ["429", "500"]
+
+def configure_env(database_url: str, key_file: str):
+    # The app reads both at import time, so this must run before anything from app/ is imported
+    if not os.path.exists(key_file):
+        from cryptography.fernet import Fernet
+        with open(key_file, "wb") as f:
+            f.write(Fernet.generate_key())
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["FERNET_KEY_FILE"] = os.path.abspath(key_file)
+
+def random_token():
+    return "".join(random.choices(string.ascii_letters + string.digits, k=30))
+
+def seed(tokens: int, messages: int, configs: int, days: int, admin_password: str, rate_limit_per_hour: int, chunk: int = 20000, log=print):
+    from app.db import SessionLocal, init_db
+    from app.models import AdminSettings, Message, PushoverConfig, Token
+    from app.crypto import encrypt, token_digest
+
+    init_db()
+    db = SessionLocal()
+    try:
+        db.add(AdminSettings(encrypted_password=encrypt(admin_password)))
+        config_ids = []
+        for i in range(configs):
+            config = PushoverConfig(name=f"bench-{i}", encrypted_app_token=encrypt(f"bench-app-{i}"), encrypted_user_key=encrypt(f"bench-user-{i}"))
+            db.add(config)
+            db.flush()
+            config_ids.append(config.id)
+        plain_tokens, token_ids = [], []
+        for _ in range(tokens):
+            plain = random_token()
+            token = Token(encrypted_token=encrypt(plain), token_digest=token_digest(plain), created_at=datetime.utcnow(), rate_limit_per_hour=rate_limit_per_hour)
+            db.add(token)
+            db.flush()
+            plain_tokens.append(plain)
+            token_ids.append(token.id)
+        db.commit()
+
+        now = datetime.utcnow()
+        span = days * 86400
+        start = time.perf_counter()
+        written = 0
+        while written < messages:
+            n = min(chunk, messages - written)
+            rows = [
+                {
+                    "token_id": random.choice(token_ids),
+                    "message": " ".join(random.choices(WORDS, k=random.randint(3, 8))),
+                    "status": random.choice(STATUSES),
+                    "timestamp": now - timedelta(seconds=random.uniform(0, span)),
+                }
+                for _ in range(n)
+            ]
+            db.bulk_insert_mappings(Message, rows)
+            db.commit()
+            written += n
+            log(f"  {written}/{messages} messages ({written / (time.perf_counter() - start):.0f} rows/s)")
+        return {"admin_password": admin_password, "tokens": plain_tokens, "config_ids": config_ids, "messages": messages}
+    finally:
+        db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a Pushgate database for load tests")
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--key-file", required=True, help="Fernet key file; created if it does not exist")
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--configs", type=int, default=2)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--rate-limit", type=int, default=1_000_000, help="rate_limit_per_hour for every seeded token")
+    parser.add_argument("--admin-password", default="bench-admin")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--out", default="bench_seed.json")
+    args = parser.parse_args()
+    random.seed(args.seed)
+    configure_env(args.database_url, args.key_file)
+    result = seed(args.tokens, args.messages, args.configs, args.days, args.admin_password, args.rate_limit)
+    with open(args.out, "w") as f:
+        json.dump(result, f)
+    print(f"Seeded {args.tokens} tokens and {args.messages} messages; credentials in {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import os
+import tempfile
+
+from cryptography.fernet import Fernet
+
+# Point the app at a throwaway database and Fernet key before it is imported
+_workdir = tempfile.mkdtemp(prefix="pushgate-test-")
+_key_path = os.path.join(_workdir, "fernet_key")
+with open(_key_path, "wb") as f:
+    f.write(Fernet.generate_key())
+os.environ.setdefault("FERNET_KEY_FILE", _key_path)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_workdir, 'test.db')}")
+
+from app.db import init_db  # noqa: E402
+
+init_db()
+
+import pytest  # noqa: E402
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from app.db import Base  # noqa: E402
+
+@pytest.fixture
+def memory_sessions():
+    # Session factory for a separate in-memory database with the full schema, for tests that
+    # rewrite or count whole tables and must not see rows from other tests
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+@pytest.fixture
+def memory_db(memory_sessions):
+    session = memory_sessions()
+    yield session
+    session.close()
+
+import random  # noqa: E402
+import string  # noqa: E402
+import httpx  # noqa: E402
+from app import pushover  # noqa: E402
+from app.configs import config_cache  # noqa: E402
+from app.crypto import encrypt, token_digest  # noqa: E402
+from app.db import SessionLocal  # noqa: E402
+from app.models import DeliveryGroup, DeliveryGroupMember, PushoverConfig, Token  # noqa: E402
+from bench.fake_pushover import create_app as create_fake_pushover  # noqa: E402
+
+@pytest.fixture
+def fake_pushover(monkeypatch):
+    # Route Pushover calls to bench/fake_pushover.py; fake.state.received lists what was sent
+    fake = create_fake_pushover()
+    monkeypatch.setattr(pushover, "_transport", httpx.ASGITransport(app=fake))
+    monkeypatch.setattr(pushover, "_client", None)
+    yield fake
+    pushover._client = None
+
+@pytest.fixture
+def make_token():
+    # make_token(rate_limit_per_hour=5) -> (plaintext, id) of a new token in the shared test database
+    def make(rate_limit_per_hour=5):
+        plain = "".join(random.choices(string.ascii_letters + string.digits, k=30))
+        db = SessionLocal()
+        t = Token(encrypted_token=encrypt(plain), token_digest=token_digest(plain), rate_limit_per_hour=rate_limit_per_hour)
+        db.add(t)
+        db.commit()
+        token_id = t.id
+        db.close()
+        return plain, token_id
+    return make
+
+@pytest.fixture
+def make_config():
+    # make_config(name) -> id of a new config with app token "app-<name>" and user key "user-<name>"
+    def make(name):
+        db = SessionLocal()
+        config = PushoverConfig(name=name, encrypted_app_token=encrypt("app-" + name), encrypted_user_key=encrypt("user-" + name))
+        db.add(config)
+        db.commit()
+        config_id = config.id
+        db.close()
+        # As the admin handlers do, so the new id is found without waiting for a miss reload
+        config_cache.changed()
+        return config_id
+    return make
+
+@pytest.fixture
+def make_group():
+    # make_group(name, config_ids) -> id of a new delivery group
+    def make(name, config_ids):
+        db = SessionLocal()
+        group = DeliveryGroup(name=name, members=[DeliveryGroupMember(config_id=i) for i in config_ids])
+        db.add(group)
+        db.commit()
+        group_id = group.id
+        db.close()
+        config_cache.changed()
+        return group_id
+    return make
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class FakeRedis:
+    # Stand-in for the few Redis commands the shared-state backends use
+    def __init__(self):
+        self.data = {}
+
+    def incrby(self, key, amount):
+        self.data[key] = int(self.data.get(key, 0)) + amount
+        return self.data[key]
+
+    def incr(self, key):
+        return self.incrby(key, 1)
+
+    def decrby(self, key, amount):
+        return self.incrby(key, -amount)
+
+    def get(self, key):
+        value = self.data.get(key)
+        return None if value is None else str(value).encode()
+
+    def expire(self, key, seconds):
+        return True
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def delete(self, key):
+        return 1 if self.data.pop(key, None) is not None else 0
+
+@pytest.fixture
+def fake_clock():
+    # fake_clock(start) -> a clock callable whose .now the test moves forward
+    return FakeClock
+
+@pytest.fixture
+def fake_redis():
+    # fake_redis() -> an in-memory stand-in for a Redis client
+    return FakeRedis
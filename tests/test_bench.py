@@ -0,0 +1,40 @@
+import asyncio
+import httpx
+import pytest
+from bench.fake_pushover import create_app
+from bench.run_suite import compare, summarize
+
+def post(app, token="app"):
+    transport = httpx.ASGITransport(app=app)
+
+    async def go():
+        async with httpx.AsyncClient(transport=transport, base_url="http://fake") as client:
+            return await client.post("/1/messages.json", data={"token": token, "user": "u", "message": "m"})
+    return asyncio.run(go())
+
+def test_fake_pushover_enforces_app_limit():
+    app = create_app(app_limit=2)
+    assert post(app).headers["X-Limit-App-Remaining"] == "1"
+    assert post(app).status_code == 200
+    resp = post(app)
+    assert resp.status_code == 429
+    assert resp.headers["X-Limit-App-Remaining"] == "0"
+    assert post(app, token="other").status_code == 200
+
+@pytest.mark.parametrize("rates, expected", [((1, 0), 500), ((0, 1), 429)])
+def test_fake_pushover_injects_failures(rates, expected):
+    error_rate, throttle_rate = rates
+    assert post(create_app(error_rate=error_rate, throttle_rate=throttle_rate)).status_code == expected
+
+def test_compare_flags_regressions_beyond_tolerance():
+    baseline = {"scenarios": {"send": summarize([0.010] * 100, [200] * 100, 1.0)}}
+    same = {"scenarios": {"send": summarize([0.011] * 100, [200] * 100, 1.05)}}
+    slower = {"scenarios": {"send": summarize([0.020] * 100, [200] * 100, 2.0)}}
+    assert compare(same, baseline, 0.2) == []
+    assert len(compare(slower, baseline, 0.2)) == 2
+
+def test_compare_flags_scenarios_skipped_since_the_baseline():
+    measured = summarize([0.010] * 100, [200] * 100, 1.0)
+    baseline = {"scenarios": {"send": measured, "tokens_page": measured}}
+    current = {"scenarios": {"send": measured, "tokens_page": {"skipped": "admin login failed: HTTP 500"}}}
+    assert compare(current, baseline, 0.2) == ["tokens_page: not measured (admin login failed: HTTP 500)"]
@@ -0,0 +1,59 @@
+import httpx
+from fastapi.testclient import TestClient
+from app import pushover
+from app.circuit import CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+from app.main import app
+from bench.fake_pushover import create_app as create_fake_pushover
+
+client = TestClient(app, root_path="/pushgate")
+
+def test_breaker_opens_after_consecutive_failures_and_probes(fake_clock):
+    clock = fake_clock(1000.0)
+    breaker = CircuitBreaker(1, failures=3, cooldown=10, cooldown_max=40, clock=clock)
+    for status in (500, 429, "error"):
+        assert breaker.allow()
+        breaker.record(status)
+    assert breaker.state == OPEN and not breaker.allow()
+    assert breaker.retry_after() == 10
+    clock.now += 10
+    # One probe at a time once the cooldown is over
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record(502)
+    # A failed probe doubles the wait
+    assert breaker.state == OPEN and breaker.retry_after() == 20
+    clock.now += 20
+    assert breaker.allow()
+    breaker.record(200)
+    assert breaker.state == CLOSED and breaker.allow()
+
+def test_success_resets_the_failure_count(fake_clock):
+    breaker = CircuitBreaker(1, failures=2, clock=fake_clock(0.0))
+    breaker.record(500)
+    breaker.record(200)
+    breaker.record(500)
+    assert breaker.state == CLOSED
+
+def test_exhausted_quota_opens_until_reset(fake_clock):
+    clock = fake_clock(1000.0)
+    breaker = CircuitBreaker(1, reserve=5, clock=clock)
+    breaker.record(200, {"X-Limit-App-Limit": "10000", "X-Limit-App-Remaining": "6", "X-Limit-App-Reset": "5000"})
+    assert breaker.state == CLOSED
+    breaker.record(200, {"X-Limit-App-Limit": "10000", "X-Limit-App-Remaining": "5", "X-Limit-App-Reset": "5000"})
+    assert breaker.state == OPEN and breaker.retry_after() == 4000
+    assert breaker.snapshot()["quota_remaining"] == 5
+
+def test_send_fails_fast_once_quota_is_used_up(monkeypatch, make_token, make_config):
+    fake = create_fake_pushover(app_limit=1)
+    monkeypatch.setattr(pushover, "_transport", httpx.ASGITransport(app=fake))
+    monkeypatch.setattr(pushover, "_client", None)
+    plain, _ = make_token()
+    config_id = make_config("quota")
+    first = client.post("/pushgate/send", data={"token": plain, "message": "one", "pushover_config_id": config_id})
+    assert first.status_code == 200
+    second = client.post("/pushgate/send", data={"token": plain, "message": "two", "pushover_config_id": config_id})
+    assert second.status_code == 503
+    assert int(second.headers["Retry-After"]) > 0
+    # The second message never reached the fake API
+    assert len(fake.state.received) == 1
+    pushover._client = None
@@ -0,0 +1,68 @@
+from fastapi.testclient import TestClient
+from app import configs, main
+from app.auth import get_current_admin
+from app.configs import ConfigCache
+from app.db import SessionLocal
+from app.main import app
+from app.models import PushoverConfig
+from app.shared_state import DatabaseGenerations, GenerationWatcher
+
+client = TestClient(app, root_path="/pushgate")
+
+def counting_decrypt(monkeypatch):
+    calls = []
+    real = configs.decrypt
+    monkeypatch.setattr(configs, "decrypt", lambda value: calls.append(value) or real(value))
+    return calls
+
+def test_configs_are_decrypted_once_and_new_ids_are_found(monkeypatch, make_config, fake_clock):
+    calls = counting_decrypt(monkeypatch)
+    config_id = make_config("cache-hit")
+    clock = fake_clock(0.0)
+    cache = ConfigCache(miss_reload=5, clock=clock)
+    db = SessionLocal()
+    first = cache.get(db, config_id)
+    decrypted = len(calls)
+    assert (first.app_token, first.user_key) == ("app-cache-hit", "user-cache-hit")
+    assert cache.get(db, config_id) is first
+    assert len(calls) == decrypted
+    # An unknown id reloads, but not more often than miss_reload: bad ids cost no decrypts
+    later_id = make_config("cache-later")
+    assert cache.get(db, later_id) is None and cache.group(db, "no-such-group") is None
+    assert len(calls) == decrypted
+    clock.now += 5
+    assert cache.get(db, later_id).name == "cache-later"
+    decrypted = len(calls)
+    for _ in range(3):
+        assert cache.get(db, 10 ** 9) is None
+    assert len(calls) == decrypted
+    db.close()
+
+def test_generation_bump_reaches_another_process(make_config, fake_clock):
+    config_id = make_config("cache-shared")
+    store, clock = DatabaseGenerations(), fake_clock(0.0)
+    # Stands in for a second worker: its own cache, watching the shared generation
+    other = ConfigCache(GenerationWatcher("configs", interval=1.0, store=store, clock=clock))
+    db = SessionLocal()
+    assert other.get(db, config_id).name == "cache-shared"
+    db.query(PushoverConfig).filter(PushoverConfig.id == config_id).update({"name": "cache-renamed"})
+    db.commit()
+    # The admin handlers' call; it reaches the database even with PUSHGATE_STATE_BACKEND=local, as here
+    configs.config_cache.changed()
+    assert other.get(db, config_id).name == "cache-shared"
+    clock.now += 1.0
+    assert other.get(db, config_id).name == "cache-renamed"
+    db.close()
+
+def test_default_config_setting_is_used_by_send(fake_pushover, monkeypatch, make_token, make_config):
+    plain, _ = make_token()
+    config_id = make_config("cache-default")
+    monkeypatch.setattr(main, "verify_csrf", lambda request, token: None)
+    app.dependency_overrides[get_current_admin] = lambda: True
+    try:
+        response = client.post("/pushgate/pushover-config/default", data={"config_id": config_id, "csrf_token": "x"}, follow_redirects=False)
+        assert response.status_code == 303 and "Default" in response.headers["location"]
+    finally:
+        app.dependency_overrides.clear()
+    assert client.post("/pushgate/send", data={"token": plain, "message": "to the default"}).status_code == 200
+    assert fake_pushover.state.received[-1]["token"] == "app-cache-default"
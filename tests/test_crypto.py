@@ -0,0 +1,33 @@
+import os
+import pytest
+from cryptography.fernet import Fernet
+from app import crypto
+
+@pytest.fixture
+def key_file(tmp_path, monkeypatch):
+    path = tmp_path / "fernet_key"
+    path.write_bytes(Fernet.generate_key())
+    monkeypatch.setattr(crypto, "FERNET_KEY_FILE", str(path))
+    monkeypatch.setattr(crypto, "FERNET_KEY_CHECK_INTERVAL", 0)
+    crypto.reload_keys()
+    yield path
+    crypto.reload_keys()
+
+def test_cipher_is_cached_until_key_file_changes(key_file):
+    assert crypto.get_fernet() is crypto.get_fernet()
+
+def test_rotated_key_file_is_picked_up_without_restart(key_file):
+    old_key = key_file.read_bytes()
+    old_ciphertext = crypto.encrypt("secret")
+    old_digest = crypto.token_digest("A" * 30)
+    new_key = Fernet.generate_key()
+    tmp = str(key_file) + ".new"
+    with open(tmp, "wb") as f:
+        f.write(new_key + b"\n" + old_key + b"\n")
+    os.replace(tmp, key_file)
+    # Old ciphertext still decrypts through the key ring, new data uses the new primary key
+    assert crypto.decrypt(old_ciphertext) == "secret"
+    assert Fernet(new_key).decrypt(crypto.encrypt("fresh").encode()) == b"fresh"
+    digests = crypto.token_digests("A" * 30)
+    assert digests[0] == crypto.token_digest_for_key(new_key, "A" * 30)
+    assert old_digest in digests
@@ -0,0 +1,16 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from app.db import engine, read_engine
+
+def test_tuned_sqlite_profile_is_applied():
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar().lower() == "wal"
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+
+def test_read_engine_is_query_only():
+    with read_engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM messages")).scalar() >= 0
+        with pytest.raises(OperationalError):
+            conn.execute(text("DELETE FROM messages WHERE id = -1"))
@@ -0,0 +1,99 @@
+import asyncio
+from types import SimpleNamespace
+from fastapi.testclient import TestClient
+from app.db import SessionLocal
+from app.dedup import Deduplicator, collapsed_text, deduplicator
+from app.main import app
+from app.models import Message, Token
+
+client = TestClient(app, root_path="/pushgate")
+
+def set_dedup(token_id, seconds, mode="drop"):
+    db = SessionLocal()
+    db.query(Token).filter(Token.id == token_id).update({"dedup_window_seconds": seconds, "dedup_mode": mode})
+    db.commit()
+    db.close()
+
+def test_check_counts_copies_inside_the_window_only(fake_clock):
+    clock = fake_clock(0.0)
+    dedup = Deduplicator(maxsize=10, clock=clock)
+    token = SimpleNamespace(id=1, dedup_window_seconds=30, dedup_mode="drop")
+    window, duplicate = dedup.check(token, 5, "disk full")
+    assert window is not None and not duplicate
+    assert dedup.check(token, 5, "disk full") == (window, True)
+    # Other text, config or token open their own windows
+    assert not dedup.check(token, 6, "disk full")[1]
+    assert not dedup.check(token, 5, "disk ok")[1]
+    assert window.suppressed == 1
+    clock.now += 30
+    assert dedup.check(token, 5, "disk full")[1] is False
+
+def test_dedup_off_and_bounded_cache(fake_clock):
+    dedup = Deduplicator(maxsize=2, clock=fake_clock(0.0))
+    assert dedup.check(SimpleNamespace(id=1, dedup_window_seconds=None, dedup_mode="drop"), 1, "x") == (None, False)
+    token = SimpleNamespace(id=1, dedup_window_seconds=30, dedup_mode="drop")
+    for text in ("a", "b", "c"):
+        dedup.check(token, 1, text)
+    assert len(dedup.cache) == 2
+    # "a" was evicted, so it is no longer treated as a duplicate
+    assert dedup.check(token, 1, "a")[1] is False
+
+def test_collapsed_text_fits_pushover_limit():
+    text = collapsed_text("é" * 600, 12)
+    assert text.endswith(" (repeated x12)")
+    assert len(text.encode("utf-8")) <= 1024
+
+def test_send_drops_duplicates_without_using_budget(fake_pushover, make_token, make_config):
+    plain, token_id = make_token(rate_limit_per_hour=1)
+    config_id = make_config("dedup-drop")
+    set_dedup(token_id, 60)
+    data = {"token": plain, "message": "flapping", "pushover_config_id": config_id}
+    first = client.post("/pushgate/send", data=data)
+    assert first.status_code == 200
+    for n in (1, 2):
+        response = client.post("/pushgate/send", data=data)
+        assert response.status_code == 200
+        assert response.json()["status"] == "duplicate" and response.json()["suppressed"] == n
+    assert [r["message"] for r in fake_pushover.state.received].count("flapping") == 1
+    window = deduplicator.cache.get(Deduplicator.key(token_id, config_id, "flapping"))
+    asyncio.run(deduplicator.close(window))
+    db = SessionLocal()
+    rows = db.query(Message).filter(Message.token_id == token_id).all()
+    db.close()
+    assert len(rows) == 1 and rows[0].suppressed_count == 2
+
+def test_collapse_mode_sends_one_summary(fake_pushover, make_token, make_config):
+    plain, token_id = make_token(rate_limit_per_hour=10)
+    config_id = make_config("dedup-collapse")
+    set_dedup(token_id, 60, "collapse")
+    data = {"token": plain, "message": "cpu high", "pushover_config_id": config_id}
+    for _ in range(4):
+        assert client.post("/pushgate/send", data=data).status_code == 200
+    window = deduplicator.cache.get(Deduplicator.key(token_id, config_id, "cpu high"))
+    asyncio.run(deduplicator.close(window))
+    assert fake_pushover.state.received[-1]["message"] == "cpu high (repeated x3)"
+
+def test_higher_priority_copy_is_not_a_duplicate(fake_pushover, make_token, make_config):
+    plain, token_id = make_token(rate_limit_per_hour=10)
+    config_id = make_config("dedup-priority")
+    set_dedup(token_id, 60)
+    data = {"token": plain, "message": "db down", "pushover_config_id": config_id}
+    assert client.post("/pushgate/send", data=data).json()["status"] == "ok"
+    # The escalation goes out even though the same text was just sent at normal priority
+    assert client.post("/pushgate/send", data={**data, "priority": 2}).json()["status"] == "ok"
+    assert client.post("/pushgate/send", data={**data, "priority": 2}).json()["status"] == "duplicate"
+    assert [r.get("priority") for r in fake_pushover.state.received if r["message"] == "db down"] == [None, "2"]
+
+def test_batch_items_are_deduplicated(fake_pushover, make_token, make_config):
+    plain, token_id = make_token(rate_limit_per_hour=2)
+    config_id = make_config("dedup-batch")
+    set_dedup(token_id, 60)
+    messages = [{"message": text, "pushover_config_id": config_id} for text in ("swap full", "swap full", "load high")]
+    response = client.post("/pushgate/send/batch", json={"token": plain, "messages": messages})
+    # Three items fit a budget of two: the copy uses none
+    assert response.status_code == 200
+    assert [r["status"] for r in response.json()["results"]] == ["ok", "duplicate", "ok"]
+    assert sorted(r["message"] for r in fake_pushover.state.received) == ["load high", "swap full"]
+    # The windows opened by the batch apply to /send too
+    response = client.post("/pushgate/send", data={"token": plain, "message": "swap full", "pushover_config_id": config_id})
+    assert response.json()["status"] == "duplicate" and response.json()["suppressed"] == 2
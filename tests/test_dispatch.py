@@ -0,0 +1,106 @@
+import asyncio
+from fastapi.testclient import TestClient
+from app import pushover
+from app.auth import get_current_admin
+from app.dispatch import DispatchScheduler
+from app.main import app
+
+client = TestClient(app, root_path="/pushgate")
+
+async def _grant_order(scheduler, requests, config_of=lambda name: 1):
+    # Holds every slot, queues `requests` [(name, priority, token, weight)], then releases one
+    # slot at a time and returns the names in the order they were let through
+    order = []
+    gate = asyncio.Event()
+    blockers = [asyncio.create_task(_hold(scheduler, gate, config_id=99)) for _ in range(scheduler.max_inflight)]
+    await asyncio.sleep(0)
+
+    async def send(name, priority, token, weight):
+        async with scheduler.slot(config_of(name), priority, token, weight):
+            order.append(name)
+
+    tasks = []
+    for request in requests:
+        tasks.append(asyncio.create_task(send(*request)))
+        await asyncio.sleep(0)
+    assert sum(scheduler.waiting.values()) == len(requests)
+    gate.set()
+    await asyncio.gather(*blockers, *tasks)
+    return order
+
+async def _hold(scheduler, gate, config_id):
+    async with scheduler.slot(config_id):
+        await gate.wait()
+
+def test_higher_priority_goes_first():
+    scheduler = DispatchScheduler(max_inflight=1, per_config=10)
+    order = asyncio.run(_grant_order(scheduler, [("low", -1, 1, 1), ("normal", 0, 1, 1), ("emergency", 2, 2, 1), ("high", 1, 3, 1)]))
+    assert order == ["emergency", "high", "normal", "low"]
+
+def test_tokens_share_a_lane_by_weight():
+    scheduler = DispatchScheduler(max_inflight=1, per_config=10)
+    # Token 1 queues a burst before token 2 and 3 send anything; token 3 has twice the weight
+    burst = [(f"a{i}", 0, 1, 1) for i in range(4)] + [("b0", 0, 2, 1), ("b1", 0, 2, 1)] + [(f"c{i}", 0, 3, 2) for i in range(4)]
+    order = asyncio.run(_grant_order(scheduler, burst))
+    # Every token gets in early; token 3's half-size steps put its first send ahead
+    assert order[:4] == ["c0", "a0", "b0", "c1"]
+    # and token 3 is done after about half the slots despite queueing last
+    assert order.index("c3") < order.index("a2")
+
+def test_config_at_its_cap_does_not_block_others():
+    scheduler = DispatchScheduler(max_inflight=2, per_config=1)
+
+    async def run():
+        gate = asyncio.Event()
+        busy = asyncio.create_task(_hold(scheduler, gate, config_id=1))
+        await asyncio.sleep(0)
+        order = []
+
+        async def send(name, config_id):
+            async with scheduler.slot(config_id):
+                order.append(name)
+
+        first = asyncio.create_task(send("config1", 1))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(send("config2", 2))
+        await asyncio.sleep(0)
+        await second
+        assert order == ["config2"]
+        gate.set()
+        await asyncio.gather(busy, first)
+        return order
+
+    assert asyncio.run(run()) == ["config2", "config1"]
+
+def test_cancelled_waiter_is_skipped():
+    scheduler = DispatchScheduler(max_inflight=1, per_config=10)
+
+    async def run():
+        gate = asyncio.Event()
+        busy = asyncio.create_task(_hold(scheduler, gate, config_id=1))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(_hold(scheduler, asyncio.Event(), config_id=1))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert scheduler.waiting[0] == 0
+        gate.set()
+        await busy
+        return scheduler.inflight
+
+    assert asyncio.run(run()) == 0
+
+def test_priority_reaches_pushover_and_the_log(fake_pushover, make_token, make_config):
+    plain, _ = make_token()
+    config_id = make_config("dispatch-priority")
+    response = client.post("/pushgate/send", data={"token": plain, "message": "wake up", "pushover_config_id": config_id, "priority": 2})
+    assert response.status_code == 200
+    sent = fake_pushover.state.received[-1]
+    assert sent["priority"] == "2" and sent["retry"] == str(pushover.PUSHOVER_EMERGENCY_RETRY)
+    assert client.post("/pushgate/send", data={"token": plain, "message": "x", "priority": 3}).status_code == 400
+    app.dependency_overrides[get_current_admin] = lambda: True
+    try:
+        status = client.get("/pushgate/api/dispatch").json()
+    finally:
+        app.dependency_overrides.clear()
+    assert set(status["waiting"]) == {"2", "1", "0", "-1", "-2"} and status["inflight"] == 0
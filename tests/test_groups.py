@@ -0,0 +1,99 @@
+import time
+import httpx
+from fastapi.testclient import TestClient
+from app import delivery, main, pushover
+from app.auth import get_current_admin
+from app.circuit import STATUS_CIRCUIT_OPEN
+from app.configs import config_cache
+from app.crypto import encrypt
+from app.db import SessionLocal
+from app.groups import combined_status, log_group_message, pending_config_ids
+from app.main import app
+from app.models import Message, MessageDelivery, OutboundQueue, PushoverConfig
+from bench.fake_pushover import create_app as create_fake_pushover
+
+client = TestClient(app, root_path="/pushgate")
+
+def test_combined_status():
+    assert combined_status(["200", "200"]) == "200"
+    assert combined_status(["200", "400"]) == "207"
+    assert combined_status(["502", "400"]) == "502"
+    assert combined_status(["200", "queued"]) == "queued"
+
+def test_group_send_is_concurrent_and_records_each_target(monkeypatch, make_token, make_config, make_group):
+    monkeypatch.setattr(pushover, "_transport", httpx.ASGITransport(app=create_fake_pushover(latency_ms=200)))
+    monkeypatch.setattr(pushover, "_client", None)
+    plain, token_id = make_token()
+    config_ids = [make_config(f"fanout-{i}") for i in range(3)]
+    # A config the fake API rejects (no user key), so one target fails for good
+    db = SessionLocal()
+    broken = PushoverConfig(name="fanout-broken", encrypted_app_token=encrypt("app-broken"), encrypted_user_key=encrypt(""))
+    db.add(broken)
+    db.commit()
+    config_ids.append(broken.id)
+    db.close()
+    make_group("fanout", config_ids)
+    start = time.perf_counter()
+    response = client.post("/pushgate/send", data={"token": plain, "message": "to everyone", "delivery_group": "fanout"})
+    elapsed = time.perf_counter() - start
+    pushover._client = None
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "partial" and body["delivery_group"] == "fanout"
+    assert [d["status"] for d in body["deliveries"]] == ["ok", "ok", "ok", "error"]
+    # Four 200 ms calls side by side, not one after another
+    assert elapsed < 0.6
+    db = SessionLocal()
+    msg = db.query(Message).filter(Message.id == body["id"]).one()
+    assert (msg.token_id, msg.status) == (token_id, "207")
+    statuses = {d.config_id: d.status for d in db.query(MessageDelivery).filter(MessageDelivery.message_id == msg.id)}
+    assert statuses == {**{i: "200" for i in config_ids[:3]}, config_ids[3]: "400"}
+    db.close()
+    status = client.get(f"/pushgate/send/{body['id']}", headers={"X-Pushgate-Token": plain}).json()
+    assert len(status["deliveries"]) == 4
+
+def test_group_send_validation(fake_pushover, make_token, make_config):
+    plain, _ = make_token()
+    config_id = make_config("group-validation")
+    assert client.post("/pushgate/send", data={"token": plain, "message": "x", "delivery_group": "no-such-group"}).status_code == 400
+    response = client.post("/pushgate/send", data={"token": plain, "message": "x", "delivery_group": "g", "pushover_config_id": config_id})
+    assert response.status_code == 400
+
+def test_queued_group_retries_only_pending_targets(make_token, make_config, make_group):
+    _, token_id = make_token()
+    ok_id, flaky_id, held_id = (make_config(f"group-retry-{i}") for i in range(3))
+    group_id = make_group("group-retry", [ok_id, flaky_id, held_id])
+    db = SessionLocal()
+    msg_id = log_group_message(db, token_id, "later", group_id, [(i, "queued", None, None) for i in (ok_id, flaky_id, held_id)])
+    job = db.query(OutboundQueue).filter(OutboundQueue.message_id == msg_id).one()
+    assert job.delivery_group_id == group_id
+    delivery.record_group_attempt(db, job, [(ok_id, 200, "{}", 0.1), (flaky_id, 503, "busy", 0.2), (held_id, STATUS_CIRCUIT_OPEN, "open", None)])
+    db.expire_all()
+    assert db.query(Message).filter(Message.id == msg_id).one().status == "queued"
+    assert job.attempts == 1 and db.query(OutboundQueue).filter(OutboundQueue.id == job.id).count() == 1
+    assert pending_config_ids(db, msg_id) == [flaky_id, held_id]
+    delivery.record_group_attempt(db, job, [(flaky_id, 200, "{}", 0.1), (held_id, 400, "bad", 0.1)])
+    db.expire_all()
+    assert db.query(Message).filter(Message.id == msg_id).one().status == "207"
+    assert db.query(OutboundQueue).filter(OutboundQueue.message_id == msg_id).count() == 0
+    db.close()
+
+def test_group_admin_routes(monkeypatch, make_config):
+    first, second = make_config("group-admin-1"), make_config("group-admin-2")
+    monkeypatch.setattr(main, "verify_csrf", lambda request, token: None)
+    app.dependency_overrides[get_current_admin] = lambda: True
+    try:
+        response = client.post("/pushgate/delivery-groups/add", data={"name": "oncall", "config_ids": [first, second], "csrf_token": "x"}, follow_redirects=False)
+        assert "Group+added" in response.headers["location"]
+        response = client.post("/pushgate/delivery-groups/add", data={"name": "empty", "csrf_token": "x"}, follow_redirects=False)
+        assert "at+least+one" in response.headers["location"]
+        db = SessionLocal()
+        group = config_cache.group(db, "oncall")
+        assert group.config_ids == [first, second]
+        client.post("/pushgate/pushover-config/delete", data={"config_id": second, "csrf_token": "x"}, follow_redirects=False)
+        assert config_cache.group(db, group.id).config_ids == [first]
+        client.post("/pushgate/delivery-groups/delete", data={"group_id": group.id, "csrf_token": "x"}, follow_redirects=False)
+        assert config_cache.group(db, "oncall") is None
+        db.close()
+    finally:
+        app.dependency_overrides.clear()
@@ -0,0 +1,68 @@
+from cryptography.fernet import Fernet, InvalidToken
+import pytest
+from app import key_rotation
+from app.models import Token, PushoverConfig, AdminSettings
+from app.crypto import token_digest_for_key
+from app.key_rotation import Checkpoint, count_not_current, read_key_file, reencrypt_all, write_key_file
+
+OLD, NEW = Fernet.generate_key(), Fernet.generate_key()
+
+@pytest.fixture
+def db(memory_db):
+    # Separate database: rotation rewrites every encrypted value in it
+    session = memory_db
+    old = Fernet(OLD)
+    for i in range(7):
+        plain = f"token-{i}"
+        session.add(Token(encrypted_token=old.encrypt(plain.encode()).decode(), token_digest=token_digest_for_key(OLD, plain)))
+    session.add(PushoverConfig(name="c", encrypted_app_token=old.encrypt(b"app").decode(), encrypted_user_key=old.encrypt(b"user").decode()))
+    session.add(AdminSettings(encrypted_password=old.encrypt(b"pw").decode()))
+    session.commit()
+    return session
+
+def test_reencrypt_moves_everything_to_the_new_key(db):
+    assert count_not_current(db, NEW) == {"tokens": 7, "pushover_config": 2, "admin_settings": 1}
+    results = reencrypt_all(db, [NEW, OLD], batch_size=3)
+    assert results == {"tokens": (7, 0), "pushover_config": (1, 0), "admin_settings": (1, 0)}
+    assert count_not_current(db, NEW) == {"tokens": 0, "pushover_config": 0, "admin_settings": 0}
+    token = db.query(Token).order_by(Token.id).first()
+    assert Fernet(NEW).decrypt(token.encrypted_token.encode()) == b"token-0"
+    assert token.token_digest == token_digest_for_key(NEW, "token-0")
+    with pytest.raises(InvalidToken):
+        Fernet(OLD).decrypt(token.encrypted_token.encode())
+    # A second pass has nothing left to do
+    assert reencrypt_all(db, [NEW, OLD])["tokens"] == (0, 0)
+
+def test_reencrypt_resumes_from_checkpoint(db, tmp_path):
+    path = str(tmp_path / "fernet_key.rotation")
+    third_id = [t.id for t in db.query(Token.id).order_by(Token.id).limit(3)][-1]
+    # An interrupted run that got through the first three tokens
+    Checkpoint(path, NEW).save("tokens", third_id)
+    resumed = Checkpoint(path, NEW)
+    assert resumed.last_id("tokens") == third_id
+    results = reencrypt_all(db, [NEW, OLD], checkpoint=resumed, batch_size=3)
+    assert results["tokens"] == (4, 0)
+    assert count_not_current(db, NEW)["tokens"] == 3
+    assert Checkpoint(path, NEW).last_id("tokens") == db.query(Token.id).order_by(Token.id.desc()).first().id
+    # A checkpoint made for another primary key is ignored
+    assert Checkpoint(path, OLD).done == {}
+
+def test_reencrypt_does_not_overwrite_a_concurrent_edit(db, monkeypatch):
+    token_id = db.query(Token.id).order_by(Token.id).first().id
+    edited = Fernet(NEW).encrypt(b"edited").decode()
+    real_decrypt = key_rotation._decrypt
+
+    def decrypt_while_admin_edits(primary, multi, ciphertext):
+        # The app rotates the token between the tool's read and its update
+        db.query(Token).filter(Token.id == token_id).update({"encrypted_token": edited}, synchronize_session=False)
+        monkeypatch.setattr(key_rotation, "_decrypt", real_decrypt)
+        return real_decrypt(primary, multi, ciphertext)
+
+    monkeypatch.setattr(key_rotation, "_decrypt", decrypt_while_admin_edits)
+    reencrypt_all(db, [NEW, OLD])
+    assert db.query(Token.encrypted_token).filter(Token.id == token_id).scalar() == edited
+
+def test_key_file_round_trip(tmp_path):
+    path = str(tmp_path / "fernet_key")
+    write_key_file(path, [NEW, OLD])
+    assert read_key_file(path) == [NEW, OLD]
@@ -0,0 +1,23 @@
+from concurrent.futures import ThreadPoolExecutor
+from app.db import SessionLocal
+from app.log_writer import LogWriter
+from app.models import Message
+
+def test_log_writer_groups_concurrent_writes():
+    writer = LogWriter(flush_size=50, flush_interval=0.05)
+    with ThreadPoolExecutor(max_workers=20) as pool:
+        futures = list(pool.map(lambda i: writer.submit(None, f"grouped {i}", 200), range(100)))
+    ids = [f.result(timeout=5) for f in futures]
+    writer.stop()
+    assert len(set(ids)) == 100
+    assert writer.rows_written == 100
+    assert writer.flushes < 100
+    db = SessionLocal()
+    assert db.query(Message).filter(Message.id.in_(ids), Message.status == "200").count() == 100
+    db.close()
+
+def test_log_writer_stop_flushes_pending_rows():
+    writer = LogWriter(flush_size=1000, flush_interval=10)
+    future = writer.submit(None, "flushed on stop", 200)
+    writer.stop()
+    assert future.result(timeout=5)
@@ -36,3 +36,32 @@ def test_no_pushover_key_files(monkeypatch):
     response = client.get("/pushgate/pushover-config")
     # Should still load the config page (may be empty)
     assert response.status_code in (200, 303)
+
+def test_send_looks_up_token_by_digest():
+    from app.db import SessionLocal
+    from app.models import Token
+    from app.crypto import encrypt, token_digest
+    from app.tokens import lookup_token
+    db = SessionLocal()
+    plain = "B" * 30
+    t = Token(encrypted_token=encrypt(plain), token_digest=token_digest(plain), rate_limit_per_hour=5)
+    db.add(t)
+    db.commit()
+    assert lookup_token(db, plain).id == t.id
+    assert lookup_token(db, "C" * 30) is None
+    db.close()
+
+def test_lookup_backfills_legacy_token_digest():
+    from app.db import SessionLocal
+    from app.models import Token
+    from app.crypto import encrypt, token_digest
+    from app.tokens import lookup_token
+    db = SessionLocal()
+    plain = "D" * 30
+    t = Token(encrypted_token=encrypt(plain), rate_limit_per_hour=5)
+    db.add(t)
+    db.commit()
+    assert lookup_token(db, plain).id == t.id
+    db.refresh(t)
+    assert t.token_digest == token_digest(plain)
+    db.close()
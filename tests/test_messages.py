@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+from app.db import SessionLocal
+from app.models import Token, Message
+from app.messages import message_page, count_messages
+
+def seed_messages(n, status="200"):
+    db = SessionLocal()
+    token = Token(encrypted_token=f"paging-{datetime.utcnow().timestamp()}", rate_limit_per_hour=5)
+    db.add(token)
+    db.commit()
+    base = datetime(2020, 1, 1)
+    # Pairs of messages share a timestamp so the id tie-breaker matters
+    db.add_all([Message(token_id=token.id, message=f"msg {i}", status=status, timestamp=base + timedelta(minutes=i // 2)) for i in range(n)])
+    db.commit()
+    token_id = token.id
+    db.close()
+    return token_id
+
+def test_keyset_pagination_walks_all_rows_both_ways():
+    token_id = seed_messages(25)
+    db = SessionLocal()
+    seen = []
+    page = message_page(db, token_id=token_id, page_size=10)
+    assert page["newer_cursor"] is None
+    pages = [page]
+    while page["older_cursor"]:
+        page = message_page(db, token_id=token_id, page_size=10, before=page["older_cursor"])
+        pages.append(page)
+    seen = [m.message for p in pages for m in p["messages"]]
+    assert seen == [f"msg {i}" for i in reversed(range(25))]
+    # Walking back from the last page returns the previous page unchanged
+    back = message_page(db, token_id=token_id, page_size=10, after=pages[-1]["newer_cursor"])
+    assert [m.id for m in back["messages"]] == [m.id for m in pages[1]["messages"]]
+    db.close()
+
+def test_message_count_is_cached_per_filter():
+    token_id = seed_messages(3, status="555")
+    db = SessionLocal()
+    assert count_messages(db, token_id=token_id, status="555") == 3
+    db.add(Message(token_id=token_id, message="late", status="555", timestamp=datetime.utcnow()))
+    db.commit()
+    assert count_messages(db, token_id=token_id, status="555") == 3
+    assert count_messages(db, token_id=token_id) == 4
+    db.close()
+
+def test_search_uses_fts_with_prefix_matching():
+    from app.search import fts_available, search_messages
+    from app.messages import filter_messages
+    token_id = seed_messages(0)
+    db = SessionLocal()
+    assert fts_available(db)
+    db.add_all([
+        Message(token_id=token_id, message="Disk usage critical on backup01", status="200", timestamp=datetime.utcnow()),
+        Message(token_id=token_id, message="backup finished; backup backup", status="200", timestamp=datetime.utcnow()),
+        Message(token_id=token_id, message="CPU load normal", status="200", timestamp=datetime.utcnow()),
+    ])
+    db.commit()
+    found = filter_messages(db.query(Message), token_id=token_id, search="backu").all()
+    assert {m.message for m in found} == {"Disk usage critical on backup01", "backup finished; backup backup"}
+    ranked = search_messages(db, "backup", token_id=token_id)
+    assert ranked[0][0].message == "backup finished; backup backup"
+    # FTS operators in user input are treated as text
+    assert filter_messages(db.query(Message), token_id=token_id, search='disk" OR "cpu').all() == []
+    db.close()
+
+def test_export_streams_csv_and_jsonl_with_filters():
+    import csv
+    import gzip
+    import io
+    import json
+    from app.messages import export_messages
+    token_id = seed_messages(7)
+    rows = list(csv.reader(io.StringIO(b"".join(export_messages(SessionLocal, "csv", token_id=token_id)).decode())))
+    assert rows[0] == ["id", "timestamp", "token_id", "status", "suppressed_count", "message"]
+    assert [r[5] for r in rows[1:]] == [f"msg {i}" for i in range(7)]
+    since = datetime(2020, 1, 1, 0, 1)
+    until = datetime(2020, 1, 1, 0, 3)
+    compressed = b"".join(export_messages(SessionLocal, "jsonl", compress=True, token_id=token_id, since=since, until=until))
+    records = [json.loads(line) for line in gzip.decompress(compressed).splitlines()]
+    assert [r["message"] for r in records] == ["msg 2", "msg 3", "msg 4", "msg 5"]
+    assert records[0]["timestamp"] == "2020-01-01T00:01:00" and records[0]["token_id"] == token_id
+
+def test_export_route_requires_admin_and_sets_download_headers():
+    from fastapi.testclient import TestClient
+    from app.auth import get_current_admin
+    from app.main import app
+    token_id = seed_messages(3)
+    client = TestClient(app, root_path="/pushgate")
+    assert client.get("/pushgate/messages/export").status_code == 401
+    app.dependency_overrides[get_current_admin] = lambda: True
+    try:
+        response = client.get(f"/pushgate/messages/export?format=jsonl&token_id={token_id}&gzip=true")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/gzip"
+        assert ".jsonl.gz" in response.headers["content-disposition"]
+        assert client.get("/pushgate/messages/export?format=xml").status_code == 400
+        # Transparent compression for clients that accept it
+        encoded = client.get(f"/pushgate/messages/export?token_id={token_id}", headers={"Accept-Encoding": "gzip"})
+        assert encoded.headers["content-encoding"] == "gzip"
+        assert encoded.text.splitlines()[1].endswith("msg 0")
+    finally:
+        app.dependency_overrides.clear()
@@ -0,0 +1,38 @@
+from prometheus_client import REGISTRY
+from fastapi.testclient import TestClient
+from app.main import app
+
+client = TestClient(app, root_path="/pushgate")
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+def test_send_records_stage_latencies_and_statuses(fake_pushover, make_token, make_config):
+    plain, _ = make_token()
+    config_id = make_config("metrics")
+    before_ok = sample("pushgate_http_responses_total", method="POST", route="/send", status="200")
+    before_stage = sample("pushgate_send_stage_seconds_count", stage="pushover")
+    before_pushover = sample("pushgate_pushover_responses_total", status="200")
+    response = client.post("/pushgate/send", data={"token": plain, "message": "Hello", "pushover_config_id": config_id})
+    assert response.status_code == 200
+    assert sample("pushgate_http_responses_total", method="POST", route="/send", status="200") == before_ok + 1
+    assert sample("pushgate_send_stage_seconds_count", stage="pushover") == before_stage + 1
+    assert sample("pushgate_pushover_responses_total", status="200") == before_pushover + 1
+    for stage in ("token_lookup", "config", "rate_limit", "log"):
+        assert sample("pushgate_send_stage_seconds_count", stage=stage) > 0
+
+def test_rate_limit_rejections_are_counted(fake_pushover, make_token, make_config):
+    plain, _ = make_token(rate_limit_per_hour=1)
+    config_id = make_config("metrics-limit")
+    before = sample("pushgate_rate_limit_rejections_total")
+    client.post("/pushgate/send", data={"token": plain, "message": "one", "pushover_config_id": config_id})
+    response = client.post("/pushgate/send", data={"token": plain, "message": "two", "pushover_config_id": config_id})
+    assert response.status_code == 429
+    assert sample("pushgate_rate_limit_rejections_total") == before + 1
+
+def test_metrics_endpoint_exposes_text_format():
+    response = client.get("/pushgate/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    for name in ("pushgate_send_stage_seconds", "pushgate_queue_depth", "pushgate_db_pool_checked_out", "pushgate_http_responses_total"):
+        assert name in response.text
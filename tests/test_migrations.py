@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from app.db import Base
+from app import models  # noqa: F401
+from app.migrations import MIGRATIONS, migrate, pending_migrations
+
+def _create_baseline_schema(engine):
+    with engine.begin() as conn:
+        # Schema as created by the original create_all()
+        conn.execute(text("CREATE TABLE tokens (id INTEGER PRIMARY KEY, encrypted_token VARCHAR NOT NULL UNIQUE, created_at DATETIME, last_used DATETIME, rate_limit_per_hour INTEGER)"))
+        conn.execute(text("CREATE TABLE messages (id INTEGER PRIMARY KEY, token_id INTEGER REFERENCES tokens(id), message TEXT NOT NULL, timestamp DATETIME, status VARCHAR)"))
+        conn.execute(text("CREATE TABLE pushover_config (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL UNIQUE, encrypted_app_token VARCHAR NOT NULL, encrypted_user_key VARCHAR NOT NULL, updated_at DATETIME)"))
+        conn.execute(text("CREATE TABLE admin_settings (id INTEGER PRIMARY KEY, encrypted_password VARCHAR NOT NULL, updated_at DATETIME)"))
+
+def test_migrations_upgrade_pre_migration_schema(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    _create_baseline_schema(engine)
+    # Same order as init_db: create_all adds new tables only, migrations alter the old ones
+    Base.metadata.create_all(bind=engine)
+    assert migrate(engine) == [m[0] for m in MIGRATIONS]
+    inspector = inspect(engine)
+    assert "token_digest" in {c["name"] for c in inspector.get_columns("tokens")}
+    indexes = {i["name"] for i in inspector.get_indexes("messages")}
+    assert {"ix_messages_token_id_timestamp", "ix_messages_status_timestamp"} <= indexes
+    assert pending_migrations(engine) == []
+    assert migrate(engine) == []
+
+@pytest.mark.parametrize("baseline", [False, True])
+def test_workers_starting_together_set_up_the_schema_once(tmp_path, baseline):
+    # As uvicorn --workers does: several processes run init_db() against the same file at once
+    path = tmp_path / "workers.db"
+    if baseline:
+        _create_baseline_schema(create_engine(f"sqlite:///{path}"))
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{path}"}
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    workers = [subprocess.Popen([sys.executable, "-c", "from app.db import init_db; init_db()"], cwd=root, env=env, stderr=subprocess.PIPE) for _ in range(4)]
+    errors = [w.communicate()[1].decode() for w in workers]
+    assert [w.returncode for w in workers] == [0] * 4, errors
+    engine = create_engine(f"sqlite:///{path}")
+    assert pending_migrations(engine) == []
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM schema_migrations")).scalar() == len(MIGRATIONS)
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+from app.db import SessionLocal
+from app.models import Token, Message
+from app.rate_limit import MemoryRateLimiter, DatabaseRateLimiter
+
+def test_memory_limiter_enforces_limit_within_window(fake_clock):
+    clock = fake_clock(3600 * 1000)
+    limiter = MemoryRateLimiter(clock=clock)
+    assert all(limiter.consume(None, 1, 5) for _ in range(5))
+    assert not limiter.consume(None, 1, 5)
+    # Other tokens have their own budget
+    assert limiter.consume(None, 2, 5)
+
+def test_memory_limiter_previous_window_decays(fake_clock):
+    clock = fake_clock(3600 * 1000)
+    limiter = MemoryRateLimiter(clock=clock)
+    assert limiter.consume(None, 1, 4, count=4)
+    # Half way through the next hour, half of the previous hour's usage still counts
+    clock.now += 3600 + 1800
+    assert limiter.consume(None, 1, 4, count=2)
+    assert not limiter.consume(None, 1, 4)
+    # Two windows later the old usage is gone entirely
+    clock.now += 3600 * 2
+    assert limiter.consume(None, 1, 4, count=4)
+
+def test_memory_limiter_warms_from_message_log():
+    db = SessionLocal()
+    token = Token(encrypted_token="warm-test", rate_limit_per_hour=3)
+    db.add(token)
+    db.commit()
+    now = datetime.utcnow()
+    db.add_all([Message(token_id=token.id, message="m", status="200", timestamp=now - timedelta(seconds=i)) for i in range(3)])
+    db.commit()
+    limiter = MemoryRateLimiter()
+    limiter.warm(db)
+    assert not limiter.consume(db, token.id, 3)
+    assert not DatabaseRateLimiter().consume(db, token.id, 3)
+    db.close()
+
+def test_shared_counter_limiter_is_shared_between_instances(fake_clock):
+    from app.rate_limit import SharedCounterRateLimiter
+    clock = fake_clock(3600 * 2000)
+    # Two limiters stand in for two worker processes using the same database
+    first, second = SharedCounterRateLimiter(clock=clock), SharedCounterRateLimiter(clock=clock)
+    assert first.consume(None, 901, 4, count=3)
+    assert second.consume(None, 901, 4)
+    assert not first.consume(None, 901, 4)
+    assert not second.consume(None, 901, 4)
+    # Half way through the next hour, half of the previous hour still counts
+    clock.now += 3600 + 1800
+    assert first.consume(None, 901, 4, count=2)
+    assert not second.consume(None, 901, 4)
+
+def test_shared_counter_limiter_drops_old_windows(fake_clock):
+    from app.models import RateLimitCounter
+    from app.rate_limit import SharedCounterRateLimiter
+    clock = fake_clock(3600 * 3000)
+    limiter = SharedCounterRateLimiter(clock=clock)
+    for _ in range(4):
+        assert limiter.consume(None, 902, 10)
+        clock.now += 3600
+    db = SessionLocal()
+    windows = [w for (w,) in db.query(RateLimitCounter.window_index).filter(RateLimitCounter.token_id == 902)]
+    db.close()
+    assert sorted(windows) == [3002, 3003]
+
+def test_redis_limiter_with_stand_in(fake_clock, fake_redis):
+    from app.rate_limit import RedisRateLimiter
+    clock = fake_clock(3600 * 1000)
+    client = fake_redis()
+    first = RedisRateLimiter(client_factory=lambda: client, clock=clock)
+    second = RedisRateLimiter(client_factory=lambda: client, clock=clock)
+    assert first.consume(None, 1, 3, count=2)
+    assert second.consume(None, 1, 3)
+    assert not first.consume(None, 1, 3)
+    # A refused request does not use up budget
+    assert client.data["pushgate:rl:1:1000"] == 3
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+import pytest
+from app.models import Message, OutboundQueue, Token
+from app.retention import append_records, iter_archive, restore_records, run_retention
+from app.shared_state import DatabaseGenerations, LocalGenerations, RedisGenerations
+
+NOW = datetime(2024, 6, 15, 12, 0)
+
+@pytest.fixture
+def session_factory(memory_sessions):
+    # Separate database: retention deletes rows across the whole messages table
+    factory = memory_sessions
+    db = factory()
+    keep_forever = Token(encrypted_token="a", token_digest="a", retention_days=0)
+    short = Token(encrypted_token="b", token_digest="b", retention_days=7)
+    default = Token(encrypted_token="c", token_digest="c")
+    db.add_all([keep_forever, short, default])
+    db.flush()
+    for token in (keep_forever, short, default):
+        for days in (3, 10, 40, 80):
+            db.add(Message(token_id=token.id, message=f"t{token.id} {days}d old", timestamp=NOW - timedelta(days=days), status="200"))
+    db.commit()
+    db.close()
+    return factory
+
+def remaining(factory):
+    db = factory()
+    try:
+        return sorted(m for (m,) in db.query(Message.message))
+    finally:
+        db.close()
+
+def test_archives_by_token_and_global_retention(session_factory, tmp_path):
+    archived = run_retention(session_factory, archive_dir=str(tmp_path), default_days=30, batch_size=2, pause=0, now=NOW)
+    # Token 1 keeps everything, token 2 keeps 7 days, token 3 the global 30 days
+    assert archived == 5
+    assert remaining(session_factory) == sorted(
+        ["t1 3d old", "t1 10d old", "t1 40d old", "t1 80d old", "t2 3d old", "t3 3d old", "t3 10d old"]
+    )
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["messages-2024-03.jsonl.gz", "messages-2024-05.jsonl.gz", "messages-2024-06.jsonl.gz"]
+    # Nothing is left to do on a second pass
+    assert run_retention(session_factory, archive_dir=str(tmp_path), default_days=30, pause=0, now=NOW) == 0
+
+def test_global_retention_off_and_queued_messages_are_kept(session_factory, tmp_path):
+    db = session_factory()
+    queued = db.query(Message).filter(Message.message == "t2 80d old").one()
+    db.add(OutboundQueue(message_id=queued.id))
+    db.commit()
+    db.close()
+    assert run_retention(session_factory, archive_dir=str(tmp_path), default_days=0, pause=0, now=NOW) == 2
+    assert "t2 80d old" in remaining(session_factory)
+    assert "t3 80d old" in remaining(session_factory)
+
+def test_query_filters_and_restore(session_factory, tmp_path):
+    run_retention(session_factory, archive_dir=str(tmp_path), default_days=30, pause=0, now=NOW)
+    db = session_factory()
+    token_id = db.query(Token.id).filter(Token.token_digest == "c").scalar()
+    db.close()
+    assert [r["message"] for r in iter_archive(str(tmp_path), token_id=token_id)] == ["t3 80d old", "t3 40d old"]
+    assert [r["message"] for r in iter_archive(str(tmp_path), since=NOW - timedelta(days=20))] == ["t2 10d old"]
+    assert [r["message"] for r in iter_archive(str(tmp_path), contains="T3 40D")] == ["t3 40d old"]
+    # A batch written twice (crash before the delete) is still read back once
+    append_records(str(tmp_path), list(iter_archive(str(tmp_path), token_id=token_id)))
+    assert len(list(iter_archive(str(tmp_path), token_id=token_id))) == 2
+    db = session_factory()
+    assert restore_records(db, iter_archive(str(tmp_path), token_id=token_id)) == 2
+    assert restore_records(db, iter_archive(str(tmp_path), token_id=token_id)) == 0
+    restored = db.query(Message).filter(Message.message == "t3 80d old").one()
+    assert restored.timestamp == NOW - timedelta(days=80) and restored.status == "200"
+    db.close()
+
+@pytest.mark.parametrize("backend", ["local", "database", "redis"])
+def test_lease_is_held_by_one_process_at_a_time(backend, fake_redis):
+    if backend == "redis":
+        client = fake_redis()
+        store = RedisGenerations(client_factory=lambda: client)
+    else:
+        store = {"local": LocalGenerations, "database": DatabaseGenerations}[backend]()
+    assert store.acquire_lease("test-job", 60)
+    assert not store.acquire_lease("test-job", 60)
+    store.release_lease("test-job")
+    assert store.acquire_lease("test-job", 60)
+    store.release_lease("test-job")
@@ -0,0 +1,169 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+import pytest
+from fastapi.testclient import TestClient
+from app import delivery, schedule
+from app.cache import TTLCache
+from app.configs import config_cache
+from app.db import SessionLocal
+from app.dedup import deduplicator
+from app.delivery import DeliveryWorkers
+from app.main import app
+from app.models import Message, MessageDelivery, OutboundQueue, ScheduledMessage, Token
+from app.schedule import ScheduleTimer, deliver_time, schedule_message
+
+client = TestClient(app, root_path="/pushgate")
+
+def test_deliver_time():
+    now = datetime(2030, 1, 1, 12, 0, 0)
+    assert deliver_time(None, None, now) is None
+    assert deliver_time(None, 90, now) == now + timedelta(seconds=90)
+    assert deliver_time("2030-01-01T14:30:00+02:00", None, now) == datetime(2030, 1, 1, 12, 30)
+    assert deliver_time("2030-01-01T12:30:00", None, now) == datetime(2030, 1, 1, 12, 30)
+    assert deliver_time("1893502800", None, now) == datetime(2030, 1, 1, 13, 0)
+    # In the past or right now: sent immediately
+    assert deliver_time("2029-12-31T00:00:00Z", None, now) is None
+    for deliver_at, delay in (("2030-01-01T13:00:00", 60), ("tomorrow", None), (None, -1), ("2040-01-01T00:00:00", None)):
+        with pytest.raises(ValueError):
+            deliver_time(deliver_at, delay, now)
+
+def _wait_for(condition, timeout=5):
+    async def wait():
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline
+            await asyncio.sleep(0.02)
+    return wait()
+
+def _queued(message_ids):
+    db = SessionLocal()
+    try:
+        return db.query(OutboundQueue).filter(OutboundQueue.message_id.in_(message_ids)).count()
+    finally:
+        db.close()
+
+def test_timer_releases_due_messages_through_a_small_window(monkeypatch, make_token):
+    monkeypatch.setattr(schedule, "delivery_workers", DeliveryWorkers(count=0))
+    _, token_id = make_token()
+    db = SessionLocal()
+    past = datetime.utcnow() - timedelta(minutes=1)
+    due = [schedule_message(db, token_id, f"overdue {i}", past + timedelta(seconds=i), priority=1) for i in range(5)]
+    later, _ = schedule_message(db, token_id, "next hour", datetime.utcnow() + timedelta(hours=1))
+    db.close()
+    due_ids = [message_id for message_id, _ in due]
+    timer = ScheduleTimer(window=2, resync=300)
+
+    async def run():
+        timer.start()
+        # Five overdue rows, read two at a time after a restart
+        await _wait_for(lambda: _queued(due_ids) == 5)
+        assert len(timer.heap) <= 2 * timer.window
+        # A new message due soon wakes the timer; no polling interval to wait out
+        db = SessionLocal()
+        soon, scheduled_id = schedule_message(db, token_id, "soon", datetime.utcnow() + timedelta(seconds=0.3))
+        db.close()
+        timer.add(datetime.utcnow() + timedelta(seconds=0.3), scheduled_id)
+        started = time.monotonic()
+        await _wait_for(lambda: _queued([soon]) == 1)
+        assert time.monotonic() - started < 2
+        await timer.stop()
+        return soon
+
+    soon = asyncio.run(run())
+    db = SessionLocal()
+    statuses = {m.id: m.status for m in db.query(Message).filter(Message.id.in_(due_ids + [later]))}
+    assert [statuses[i] for i in due_ids] == ["queued"] * 5 and statuses[later] == "scheduled"
+    assert {j.priority for j in db.query(OutboundQueue).filter(OutboundQueue.message_id.in_(due_ids))} == {1}
+    # A second timer (another process) finds nothing left to release
+    assert schedule.release_due(db, [s for _, s in due]) == 0
+    # Leave the shared queue and schedule empty for the other tests
+    db.query(OutboundQueue).filter(OutboundQueue.message_id.in_(due_ids + [soon])).delete(synchronize_session=False)
+    db.query(ScheduledMessage).filter(ScheduledMessage.message_id == later).delete(synchronize_session=False)
+    db.commit()
+    db.close()
+
+def test_schedule_and_cancel_over_http(fake_pushover, make_token, make_config):
+    plain, _ = make_token()
+    config_id = make_config("schedule-http")
+    response = client.post("/pushgate/send", data={"token": plain, "message": "later", "pushover_config_id": config_id, "delay": 600})
+    assert response.status_code == 202
+    body = response.json()
+    assert body["status"] == "scheduled" and fake_pushover.state.received == []
+    status = client.get(f"/pushgate/send/{body['id']}", headers={"X-Pushgate-Token": plain}).json()
+    assert status["status"] == "scheduled" and status["deliver_at"]
+    assert client.delete(f"/pushgate/send/{body['id']}", headers={"X-Pushgate-Token": plain}).json()["status"] == "cancelled"
+    assert client.delete(f"/pushgate/send/{body['id']}", headers={"X-Pushgate-Token": plain}).status_code == 409
+    other, _ = make_token()
+    assert client.delete(f"/pushgate/send/{body['id']}", headers={"X-Pushgate-Token": other}).status_code == 404
+    response = client.post("/pushgate/send", data={"token": plain, "message": "x", "delay": 60, "deliver_at": "2030-01-01T00:00:00Z"})
+    assert response.status_code == 400
+
+def test_scheduled_group_send_keeps_its_targets(make_token, make_config, make_group):
+    plain, _ = make_token()
+    config_ids = [make_config(f"schedule-group-{i}") for i in range(2)]
+    make_group("schedule-group", config_ids)
+    response = client.post("/pushgate/send", data={"token": plain, "message": "standup", "delivery_group": "schedule-group", "delay": 3600})
+    assert response.status_code == 202 and response.json()["delivery_group"] == "schedule-group"
+    msg_id = response.json()["id"]
+    db = SessionLocal()
+    job = db.query(ScheduledMessage).filter(ScheduledMessage.message_id == msg_id).one()
+    assert job.delivery_group_id is not None and job.pushover_config_id is None
+    deliveries = db.query(MessageDelivery).filter(MessageDelivery.message_id == msg_id).order_by(MessageDelivery.config_id).all()
+    assert [(d.config_id, d.status) for d in deliveries] == [(i, "queued") for i in config_ids]
+    db.close()
+    client.delete(f"/pushgate/send/{msg_id}", headers={"X-Pushgate-Token": plain})
+    db = SessionLocal()
+    assert {d.status for d in db.query(MessageDelivery).filter(MessageDelivery.message_id == msg_id)} == {"cancelled"}
+    db.close()
+
+def test_scheduled_send_without_config_uses_the_default_at_delivery(fake_pushover, monkeypatch, make_token, make_config):
+    monkeypatch.setattr(schedule, "delivery_workers", DeliveryWorkers(count=0))
+    plain, _ = make_token()
+    make_config("schedule-default")
+    response = client.post("/pushgate/send", data={"token": plain, "message": "to whoever is default", "delay": 600})
+    msg_id = response.json()["id"]
+    db = SessionLocal()
+    job = db.query(ScheduledMessage).filter(ScheduledMessage.message_id == msg_id).one()
+    # Nothing is fixed at schedule time, so a later change of default still applies
+    assert job.pushover_config_id is None
+    job.deliver_at = datetime.utcnow()
+    db.commit()
+    assert schedule.release_due(db, [job.id]) == 1
+    assert asyncio.run(delivery.process_one()) is True
+    default = config_cache.get(db)
+    assert fake_pushover.state.received[-1] == {"token": default.app_token, "user": default.user_key, "message": "to whoever is default"}
+    db.close()
+
+def test_scheduled_sends_skip_dedup(fake_pushover, make_token, make_config):
+    plain, token_id = make_token(rate_limit_per_hour=10)
+    config_id = make_config("schedule-dedup")
+    db = SessionLocal()
+    db.query(Token).filter(Token.id == token_id).update({"dedup_window_seconds": 60, "dedup_mode": "collapse"})
+    db.commit()
+    db.close()
+    data = {"token": plain, "message": "take the bins out", "pushover_config_id": config_id}
+    # Same reminder at two times: both are kept
+    first = client.post("/pushgate/send", data={**data, "delay": 3600})
+    second = client.post("/pushgate/send", data={**data, "delay": 7200})
+    assert (first.json()["status"], second.json()["status"]) == ("scheduled", "scheduled")
+    # Storing them opened no window, so nothing is suppressed or collapsed on their account
+    assert not any(w.message_id in (first.json()["id"], second.json()["id"]) for w in deduplicator.pending)
+    assert client.post("/pushgate/send", data=data).json()["status"] == "ok"
+    assert client.post("/pushgate/send", data=data).json()["status"] == "duplicate"
+    assert client.delete(f"/pushgate/send/{first.json()['id']}", headers={"X-Pushgate-Token": plain}).status_code == 200
+    assert [r["message"] for r in fake_pushover.state.received] == ["take the bins out"]
+
+def test_pending_count_is_cached(monkeypatch, make_token, fake_clock):
+    clock = fake_clock(0.0)
+    monkeypatch.setattr(schedule, "_count_cache", TTLCache(maxsize=1, ttl=30, clock=clock))
+    _, token_id = make_token()
+    db = SessionLocal()
+    before = schedule.count_scheduled(db)
+    message_id, _ = schedule_message(db, token_id, "count me", datetime.utcnow() + timedelta(hours=1))
+    # A scrape inside the cache time does not count the table again
+    assert schedule.count_scheduled(db) == before
+    clock.now += 30
+    assert schedule.count_scheduled(db) == before + 1
+    schedule.cancel_scheduled(db, message_id)
+    db.close()
@@ -0,0 +1,107 @@
+from fastapi.testclient import TestClient
+from app.main import app
+from app.db import SessionLocal
+from app.models import Message
+
+client = TestClient(app, root_path="/pushgate")
+
+def test_send_delivers_through_async_client(fake_pushover, make_token, make_config):
+    plain, token_id = make_token()
+    config_id = make_config("send-async")
+    response = client.post("/pushgate/send", data={"token": plain, "message": "Hello", "pushover_config_id": config_id})
+    assert response.status_code == 200
+    assert response.json()["status"] == "ok"
+    assert fake_pushover.state.received[-1] == {"token": "app-send-async", "user": "user-send-async", "message": "Hello"}
+    db = SessionLocal()
+    assert db.query(Message).filter(Message.token_id == token_id).one().status == "200"
+    db.close()
+
+def test_send_unknown_config_is_rejected(fake_pushover, make_token):
+    plain, _ = make_token()
+    response = client.post("/pushgate/send", data={"token": plain, "message": "Hello", "pushover_config_id": 999999})
+    assert response.status_code == 400
+
+def test_queued_send_is_accepted_then_delivered(fake_pushover, monkeypatch, make_token, make_config):
+    import asyncio
+    from app import delivery
+    monkeypatch.setattr(delivery, "DELIVERY_MODE", "queued")
+    plain, _ = make_token()
+    config_id = make_config("queued")
+    response = client.post("/pushgate/send", data={"token": plain, "message": "Later", "pushover_config_id": config_id})
+    assert response.status_code == 202
+    message_id = response.json()["id"]
+    status = client.get(f"/pushgate/send/{message_id}", headers={"X-Pushgate-Token": plain}).json()
+    assert status["status"] == "queued" and status["attempts"] == 0
+    assert asyncio.run(delivery.process_one()) is True
+    status = client.get(f"/pushgate/send/{message_id}", headers={"X-Pushgate-Token": plain}).json()
+    assert status["status"] == "200"
+    assert fake_pushover.state.received[-1]["message"] == "Later"
+
+def test_queued_delivery_retries_with_backoff(monkeypatch, make_token):
+    from app import delivery
+    from app.models import OutboundQueue
+    _, token_id = make_token()
+    db = SessionLocal()
+    msg = delivery.enqueue_message(db, token_id, "Retry me")
+    job = db.query(OutboundQueue).filter(OutboundQueue.message_id == msg.id).one()
+    delivery.record_attempt(db, job, 503, "unavailable")
+    db.refresh(job)
+    assert job.attempts == 1 and job.locked_until is None
+    assert job.last_error.startswith("503")
+    monkeypatch.setattr(delivery, "QUEUE_MAX_ATTEMPTS", 2)
+    delivery.record_attempt(db, job, 503, "unavailable")
+    assert db.query(OutboundQueue).filter(OutboundQueue.message_id == msg.id).first() is None
+    db.refresh(msg)
+    assert msg.status == "503"
+    db.close()
+
+def test_queued_delivery_error_uses_up_attempts(monkeypatch, make_token, make_config):
+    import asyncio
+    from datetime import datetime
+    from app import delivery
+    from app.configs import CachedConfig
+    from app.models import OutboundQueue
+    _, token_id = make_token()
+    config_id = make_config("queued-undecryptable")
+    # What the cache holds for a config the current key cannot decrypt
+    monkeypatch.setattr(delivery, "get_pushover_config", lambda db, config_id: CachedConfig(config_id, "broken", None, None))
+    db = SessionLocal()
+    msg = delivery.enqueue_message(db, token_id, "Never decrypted", config_id, priority=2)
+    assert asyncio.run(delivery.process_one()) is True
+    job = db.query(OutboundQueue).filter(OutboundQueue.message_id == msg.id).one()
+    assert job.attempts == 1 and job.locked_until is None and "could not be decrypted" in job.last_error
+    # The attempt limit gives up on it like any other failing send
+    monkeypatch.setattr(delivery, "QUEUE_MAX_ATTEMPTS", 2)
+    job.next_attempt_at = datetime.utcnow()
+    db.commit()
+    assert asyncio.run(delivery.process_one()) is True
+    assert db.query(OutboundQueue).filter(OutboundQueue.message_id == msg.id).first() is None
+    db.refresh(msg)
+    assert msg.status == "error"
+    db.close()
+
+def test_batch_send_reports_per_item_status(fake_pushover, make_token, make_config):
+    plain, token_id = make_token(rate_limit_per_hour=10)
+    config_id = make_config("batch")
+    response = client.post("/pushgate/send/batch", json={"token": plain, "messages": [
+        {"message": "one", "pushover_config_id": config_id},
+        {"message": "", "pushover_config_id": config_id},
+        {"message": "three", "pushover_config_id": 999999},
+        {"message": "four", "pushover_config_id": config_id},
+    ]})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["status"] for r in results] == ["ok", "invalid", "invalid", "ok"]
+    assert {m["message"] for m in fake_pushover.state.received} >= {"one", "four"}
+    db = SessionLocal()
+    assert db.query(Message).filter(Message.token_id == token_id).count() == 2
+    db.close()
+
+def test_batch_send_consumes_rate_limit_in_one_step(fake_pushover, make_token, make_config):
+    plain, token_id = make_token(rate_limit_per_hour=2)
+    config_id = make_config("batch-limit")
+    messages = [{"message": f"m{i}", "pushover_config_id": config_id} for i in range(3)]
+    response = client.post("/pushgate/send/batch", json={"token": plain, "messages": messages})
+    assert response.status_code == 429
+    response = client.post("/pushgate/send/batch", json={"token": plain, "messages": messages[:2]})
+    assert response.status_code == 200
@@ -0,0 +1,28 @@
+from app.shared_state import DatabaseGenerations, GenerationWatcher, RedisGenerations
+
+def test_database_generations_bump_and_read():
+    store = DatabaseGenerations()
+    before = store.get("test-gen")
+    assert store.bump("test-gen") == before + 1
+    assert store.bump("test-gen") == before + 2
+    assert store.get("test-gen") == before + 2
+
+def test_redis_generations_with_stand_in(fake_redis):
+    client = fake_redis()
+    store = RedisGenerations(client_factory=lambda: client)
+    assert store.get("configs") == 0
+    assert store.bump("configs") == 1
+    assert store.get("configs") == 1
+
+def test_watcher_reports_each_change_once_and_polls_at_interval(fake_clock):
+    store = DatabaseGenerations()
+    clock = fake_clock(100.0)
+    watcher = GenerationWatcher("watched", interval=1.0, store=store, clock=clock)
+    assert not watcher.changed()
+    store.bump("watched")
+    # Not re-read until the interval has passed
+    assert not watcher.changed()
+    clock.now += 1.0
+    assert watcher.changed()
+    clock.now += 1.0
+    assert not watcher.changed()
@@ -0,0 +1,74 @@
+import pytest
+from fastapi.testclient import TestClient
+from app import main
+from app.auth import get_current_admin
+from app.crypto import decrypt
+from app.db import SessionLocal
+from app.main import app
+from app.models import PushoverConfig, Token
+from app.tokens import clean_label, resolve_token_ref, token_names, token_page
+
+client = TestClient(app, root_path="/pushgate")
+
+@pytest.fixture
+def admin(monkeypatch):
+    monkeypatch.setattr(main, "verify_csrf", lambda request, token: None)
+    app.dependency_overrides[get_current_admin] = lambda: True
+    yield
+    app.dependency_overrides.clear()
+
+def test_token_page_walks_both_ways_without_decrypting(memory_db, monkeypatch):
+    memory_db.add_all([Token(encrypted_token=f"enc-{i}", token_prefix=f"pre{i:03d}", label=f"svc-{i}" if i % 2 else None) for i in range(7)])
+    memory_db.commit()
+    # Nothing here is valid ciphertext: any decrypt would fail
+    monkeypatch.setattr("app.tokens.decrypt", lambda value: pytest.fail("decrypted"))
+    first = token_page(memory_db, page_size=3)
+    assert [t["id"] for t in first["tokens"]] == [1, 2, 3] and first["previous_cursor"] is None
+    second = token_page(memory_db, page_size=3, after=first["next_cursor"])
+    assert [t["id"] for t in second["tokens"]] == [4, 5, 6]
+    last = token_page(memory_db, page_size=3, after=second["next_cursor"])
+    assert [t["id"] for t in last["tokens"]] == [7] and last["next_cursor"] is None
+    back = token_page(memory_db, page_size=3, before=second["previous_cursor"])
+    assert [t["id"] for t in back["tokens"]] == [1, 2, 3] and back["previous_cursor"] is None
+    assert "encrypted_token" not in first["tokens"][0]
+    assert [t["id"] for t in token_page(memory_db, q="svc")["tokens"]] == [2, 4, 6]
+    assert [t["id"] for t in token_page(memory_db, q="pre004")["tokens"]] == [5]
+    assert resolve_token_ref(memory_db, "svc-3") == 4 and resolve_token_ref(memory_db, "4") == 4
+    assert resolve_token_ref(memory_db, "nope") is None
+    assert token_names(memory_db, [2, 3, None]) == {2: "svc-1", 3: "pre002…"}
+
+def test_clean_label():
+    assert clean_label("  ops ") == "ops" and clean_label("") is None
+    for bad in ("123", "x" * 65):
+        with pytest.raises(ValueError):
+            clean_label(bad)
+
+def test_reveal_and_label_routes(admin, make_token):
+    plain, token_id = make_token()
+    assert client.post(f"/pushgate/tokens/{token_id}/reveal", data={"csrf_token": "x"}).json()["token"] == plain
+    assert client.post("/pushgate/tokens/999999/reveal", data={"csrf_token": "x"}).status_code == 404
+    label = f"label-{token_id}"
+    response = client.post("/pushgate/tokens/label", data={"token_id": token_id, "label": label, "csrf_token": "x"}, follow_redirects=False)
+    assert "Label+updated" in response.headers["location"]
+    _, other_id = make_token()
+    response = client.post("/pushgate/tokens/label", data={"token_id": other_id, "label": label, "csrf_token": "x"}, follow_redirects=False)
+    assert "already+in+use" in response.headers["location"]
+    db = SessionLocal()
+    assert resolve_token_ref(db, label) == token_id
+    db.close()
+
+def test_reveal_requires_admin(make_token):
+    _, token_id = make_token()
+    assert client.post(f"/pushgate/tokens/{token_id}/reveal", data={"csrf_token": "x"}).status_code == 401
+
+def test_config_update_keeps_secrets_left_hidden(admin, make_config):
+    config_id = make_config("keep-secrets")
+    response = client.post("/pushgate/pushover-config/update", data={"config_id": config_id, "name": "keep-secrets-2", "app_token": "", "user_key": "user-new", "csrf_token": "x"}, follow_redirects=False)
+    assert response.status_code == 303
+    db = SessionLocal()
+    config = db.query(PushoverConfig).filter(PushoverConfig.id == config_id).one()
+    assert (config.name, decrypt(config.encrypted_app_token), decrypt(config.encrypted_user_key)) == ("keep-secrets-2", "app-keep-secrets", "user-new")
+    db.close()
+    revealed = client.post(f"/pushgate/pushover-config/{config_id}/reveal", data={"csrf_token": "x"})
+    assert revealed.headers["cache-control"] == "no-store"
+    assert (revealed.json()["app_token"], revealed.json()["user_key"]) == ("app-keep-secrets", "user-new")
@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+import pytest
+from fastapi.testclient import TestClient
+from app.auth import get_current_admin
+from app.db import SessionLocal
+from app.main import app
+from app.models import Message, UsageRollup
+from app.usage import latency_percentile, rebuild_rollups, record_usage, usage_stats
+
+client = TestClient(app, root_path="/pushgate")
+
+def test_record_usage_adds_up_minute_and_hour_rows(memory_db):
+    now = datetime.utcnow().replace(second=30)
+    record_usage(memory_db, [(now, 1, 2, "200", 0.08), (now, 1, 2, "200", 0.3), (now, 1, 2, "500", 1.5)])
+    memory_db.commit()
+    record_usage(memory_db, [(now, 1, 2, "200", 0.05)])
+    memory_db.commit()
+    minute = memory_db.query(UsageRollup).filter_by(granularity="m", token_id=1, config_id=2, status="200").one()
+    assert minute.bucket == now.replace(second=0, microsecond=0)
+    assert (minute.count, minute.latency_count, minute.latency_0, minute.latency_2) == (3, 3, 2, 1)
+    assert memory_db.query(UsageRollup).filter_by(granularity="h", status="200").one().count == 3
+    stats = usage_stats(memory_db, now - timedelta(hours=1))
+    assert stats["granularity"] == "minute"
+    assert stats["total"]["count"] == 4 and stats["total"]["errors"] == 1
+    assert stats["total"]["error_rate"] == 0.25
+    assert stats["tokens"][0]["token_id"] == 1 and stats["configs"][0]["config_id"] == 2
+    assert sum(point["count"] for point in stats["series"]) == 4
+    # Longer ranges come from the hour rows
+    assert usage_stats(memory_db, now - timedelta(days=7))["granularity"] == "hour"
+
+def test_latency_percentile_interpolates_inside_bucket():
+    # 100 samples: 90 under 100 ms, 10 between 250 and 500 ms
+    assert latency_percentile([90, 0, 10, 0, 0, 0, 0, 0]) == pytest.approx(0.375)
+    assert latency_percentile([0] * 8) is None
+    # Beyond the last finite bound only a lower limit is known
+    assert latency_percentile([0, 0, 0, 0, 0, 0, 0, 5]) == 10
+
+def test_rebuild_counts_logged_messages(memory_db):
+    when = datetime(2024, 3, 1, 10, 15)
+    memory_db.add_all([Message(token_id=7, message="m", status=s, timestamp=when) for s in ("200", "200", "429", "queued", "scheduled", "cancelled")])
+    memory_db.commit()
+    assert rebuild_rollups(memory_db, datetime(2024, 1, 1)) == 3
+    hours = {r.status: r.count for r in memory_db.query(UsageRollup).filter_by(granularity="h", token_id=7)}
+    assert hours == {"200": 2, "429": 1}
+    # Minute rows that old are pruned straight away
+    assert memory_db.query(UsageRollup).filter_by(granularity="m").count() == 0
+
+def test_send_updates_rollups_and_api_reports_them(fake_pushover, make_token, make_config):
+    plain, token_id = make_token()
+    config_id = make_config("usage-api")
+    for text in ("one", "two"):
+        assert client.post("/pushgate/send", data={"token": plain, "message": text, "pushover_config_id": config_id}).status_code == 200
+    assert client.get("/pushgate/api/stats").status_code == 401
+    app.dependency_overrides[get_current_admin] = lambda: True
+    try:
+        stats = client.get(f"/pushgate/api/stats?range=1h&token_id={token_id}").json()
+        assert client.get("/pushgate/api/stats?range=2y").status_code == 400
+    finally:
+        app.dependency_overrides.clear()
+    assert stats["total"]["count"] == 2 and stats["total"]["errors"] == 0
+    assert stats["configs"] == [{**stats["configs"][0], "config_id": config_id}]
+    assert stats["total"]["p95_latency"] is not None
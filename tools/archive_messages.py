@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Archive old messages, and search or restore the archive.
+
+Messages past their retention (PUSHGATE_RETENTION_DAYS, or a token's own
+retention) are moved to gzip JSONL files, one per month, in
+PUSHGATE_ARCHIVE_DIR. The app does this in the background every
+PUSHGATE_RETENTION_INTERVAL seconds; this tool runs a pass by hand and reads
+the archive back.
+
+  run      Archive everything that is past its retention now.
+  list     Show the archive files and how many records each holds.
+  query    Print matching archived records as JSON lines.
+  restore  Insert matching archived records back into the messages table.
+           Rows whose id already exists are skipped. Restored rows that are
+           still past their retention are archived again by the next pass,
+           so raise the retention first (or restore into another database by
+           setting DATABASE_URL).
+  vacuum   Switch a SQLite database to auto_vacuum=INCREMENTAL with a full
+           VACUUM, so later passes can return freed space to the filesystem.
+           Rewrites the whole file: run it with the app stopped.
+
+Usage:
+    python tools/archive_messages.py run     [--days N] [--batch-size 500]
+    python tools/archive_messages.py list
+    python tools/archive_messages.py query   [--token-id N] [--since DATE] [--until DATE] [--contains TEXT] [--limit N]
+    python tools/archive_messages.py restore [--token-id N] [--since DATE] [--until DATE] [--contains TEXT]
+    python tools/archive_messages.py vacuum
+"""
+import argparse
+import gzip
+import itertools
+import json
+import sys
+from datetime import datetime
+from sqlalchemy import text
+from app.db import SessionLocal, engine, init_db
+from app.retention import ARCHIVE_DIR, RETENTION_DAYS, archive_files, iter_archive, restore_records, run_retention
+
+def parse_date(value):
+    return datetime.fromisoformat(value) if value else None
+
+def records(args):
+    found = iter_archive(args.archive_dir, token_id=args.token_id, since=parse_date(args.since),
+                         until=parse_date(args.until), contains=args.contains)
+    return itertools.islice(found, args.limit) if args.limit else found
+
+def run(args):
+    init_db()
+    archived = run_retention(archive_dir=args.archive_dir, default_days=args.days, batch_size=args.batch_size)
+    print(f"Archived {archived} message(s) to {args.archive_dir}")
+
+def list_files(args):
+    for path in archive_files(args.archive_dir):
+        with gzip.open(path, "rb") as f:
+            count = sum(1 for _ in f)
+        print(f"{path}\t{count}")
+
+def query(args):
+    for record in records(args):
+        print(json.dumps(record))
+
+def restore(args):
+    init_db()
+    db = SessionLocal()
+    try:
+        restored = restore_records(db, records(args), batch_size=args.batch_size)
+    finally:
+        db.close()
+    print(f"Restored {restored} message(s)")
+
+def vacuum(args):
+    if engine.dialect.name != "sqlite":
+        print("Only SQLite databases need this.")
+        sys.exit(1)
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+        conn.execute(text("VACUUM"))
+        mode = conn.execute(text("PRAGMA auto_vacuum")).scalar()
+    print(f"auto_vacuum is now {mode} (2 = incremental)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old Pushgate messages and read the archive.")
+    parser.add_argument("command", choices=["run", "list", "query", "restore", "vacuum"])
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    parser.add_argument("--days", type=int, default=RETENTION_DAYS, help="run: global retention in days (default PUSHGATE_RETENTION_DAYS)")
+    parser.add_argument("--batch-size", type=int, default=500, help="Rows per transaction")
+    parser.add_argument("--token-id", type=int, default=None)
+    parser.add_argument("--since", default=None, help="ISO date/time, inclusive")
+    parser.add_argument("--until", default=None, help="ISO date/time, exclusive")
+    parser.add_argument("--contains", default=None, help="Case-insensitive text match")
+    parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+    {"run": run, "list": list_files, "query": query, "restore": restore, "vacuum": vacuum}[args.command](args)
+
+if __name__ == "__main__":
+    main()
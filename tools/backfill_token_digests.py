@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Backfill the token lookup digest for existing Pushgate tokens.
+- Adds the token_digest column and its unique index if the database predates them.
+- Decrypts each token without a digest or prefix and stores its keyed HMAC digest
+  and the first characters shown on the admin page.
+
+After this runs, /send finds tokens with a single indexed query instead of
+decrypting every row. Safe to re-run; rows that already have a digest are skipped.
+
+Usage:
+    python tools/backfill_token_digests.py [--batch-size N]
+"""
+import argparse
+from app.db import SessionLocal, init_db
+from app.tokens import backfill_token_digests
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill token lookup digests.")
+    parser.add_argument("--batch-size", type=int, default=500, help="Rows to update per transaction")
+    args = parser.parse_args()
+    print("Ensuring DB schema is up to date...")
+    init_db()
+    db = SessionLocal()
+    updated, failed = backfill_token_digests(db, batch_size=args.batch_size)
+    db.close()
+    print(f"Backfilled {updated} token digest(s).")
+    if failed:
+        print(f"{failed} token(s) could not be decrypted with the current Fernet key and were skipped.")
+
+if __name__ == "__main__":
+    main()
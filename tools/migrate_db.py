@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Apply versioned schema migrations to the Pushgate database.
+- Creates any missing tables from the current models.
+- Applies pending migrations (new columns, indexes) in order and records them in schema_migrations.
+
+Existing deployments need this to get schema changes that create_all() cannot make,
+such as indexes on the messages table. The app also applies pending migrations at startup,
+but index builds on a large messages table can take a while, so run this first with the app stopped.
+
+Usage:
+    python tools/migrate_db.py [--status] [--target VERSION]
+"""
+import argparse
+from app.db import Base, engine, schema_lock
+from app import models  # noqa: F401  (registers tables on Base)
+from app.migrations import MIGRATIONS, applied_versions, migrate
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply Pushgate schema migrations.")
+    parser.add_argument("--status", action="store_true", help="List migrations and whether they are applied")
+    parser.add_argument("--target", type=int, default=None, help="Stop after this version")
+    args = parser.parse_args()
+    if args.status:
+        applied = applied_versions(engine)
+        for version, description, _ in MIGRATIONS:
+            print(f"{'applied' if version in applied else 'pending'}  {version:>3}  {description}")
+        return
+    with schema_lock():
+        Base.metadata.create_all(bind=engine)
+        done = migrate(engine, target=args.target, log=print)
+    print(f"Applied {len(done)} migration(s)." if done else "Database schema is up to date.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Rebuild the usage rollups (Stats page, /api/stats) from the message log.
+
+Rollups are kept up to date as messages are logged. Use this once after
+upgrading, to cover history logged before rollups existed, or to repair them.
+Rollups from --since onwards are deleted and recomputed; the message log has
+no Pushover config or latency per message, so rebuilt rows count messages
+under an unknown config and without latency data. Messages sent while this
+runs can be counted twice, so run it with the app stopped.
+
+Usage:
+    python tools/rebuild_usage_rollups.py [--since 2024-01-01] [--batch-size 1000]
+"""
+import argparse
+from datetime import datetime
+from app.db import SessionLocal, init_db
+from app.usage import rebuild_rollups
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild Pushgate usage rollups from the message log.")
+    parser.add_argument("--since", default="1970-01-01", help="ISO date; rollups from here on are rebuilt (default: everything)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Messages per transaction")
+    args = parser.parse_args()
+    print("Ensuring DB schema is up to date...")
+    init_db()
+    db = SessionLocal()
+    try:
+        counted = rebuild_rollups(db, datetime.fromisoformat(args.since), batch_size=args.batch_size,
+                                  on_batch=lambda last_id, n: print(f"  through message {last_id}: {n} counted"))
+    finally:
+        db.close()
+    print(f"Rebuilt usage rollups from {counted} message(s).")
+
+if __name__ == "__main__":
+    main()
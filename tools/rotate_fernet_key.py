@@ -1,23 +1,40 @@
 #!/usr/bin/env python3
 """
-Rotate the Fernet encryption key for all encrypted secrets in Pushgate.
-- Decrypts all encrypted fields in the database using the old key.
-- Re-encrypts them with a new Fernet key.
-- Overwrites the Fernet key file.
-- Backs up the old key and optionally the DB.
+Rotate the Fernet encryption key while Pushgate keeps running.
 
-Usage:
-    python tools/rotate_fernet_key.py [--secrets-dir DIR] [--db-backup]
+The key file holds one key per line: the first encrypts, the rest are still
+accepted for decryption, and the app reloads the file when it changes. Rotation
+is three steps:
+
+  prepare    Generate a new key and put it first in the key file, keeping the
+             old key(s) after it. From now on the app encrypts with the new key
+             and still reads everything written with the old one.
+  reencrypt  Re-encrypt every stored secret (and token lookup digest) under the
+             new key, in batches of --batch-size rows, one transaction each.
+             Progress is checkpointed after every batch next to the key file,
+             so an interrupted run resumes where it stopped. Safe to re-run.
+  retire     Check that nothing still needs an old key, then drop the old key(s)
+             from the key file. This is the only step that cannot be undone.
 
-Stop the Pushgate app before running this script!
+  status     Show the keys in the file, the checkpoint and how many values still
+             depend on an old key.
+
+Usage:
+    python tools/rotate_fernet_key.py prepare   [--secrets-dir DIR | --key-file PATH] [--db-backup]
+    python tools/rotate_fernet_key.py reencrypt [--secrets-dir DIR | --key-file PATH] [--batch-size 500]
+    python tools/rotate_fernet_key.py retire    [--secrets-dir DIR | --key-file PATH] [--force]
+    python tools/rotate_fernet_key.py status    [--secrets-dir DIR | --key-file PATH]
 """
+import argparse
 import os
-import sys
 import shutil
+import sys
+import time
 from cryptography.fernet import Fernet
 from app.db import SessionLocal
-from app.models import Token, PushoverConfig, AdminSettings
-from app.crypto import get_fernet, decrypt
+from app.crypto import FERNET_KEY_CHECK_INTERVAL
+from app.key_rotation import Checkpoint, count_not_current, key_fingerprint, read_key_file, reencrypt_all, write_key_file
+from app.shared_state import bump_generation
 
 DEFAULT_SECRETS_DIR = "./secrets"
 FERNET_KEY_FILENAME = "fernet_key"
@@ -27,54 +44,106 @@ def backup_file(path):
     shutil.copy2(path, backup_path)
     print(f"Backed up {path} to {backup_path}")
 
-def main():
-    print("--- Pushgate Fernet Key Rotation ---")
-    secrets_dir = sys.argv[sys.argv.index("--secrets-dir")+1] if "--secrets-dir" in sys.argv else DEFAULT_SECRETS_DIR
-    fernet_path = os.path.join(secrets_dir, FERNET_KEY_FILENAME)
-    if not os.path.exists(fernet_path):
-        print(f"Fernet key file not found: {fernet_path}")
+def checkpoint_path(key_path):
+    return key_path + ".rotation"
+
+def publish_keys(key_path, keys):
+    write_key_file(key_path, keys)
+    # Workers re-read the file on their next check; the generation covers replicas whose
+    # file stamp does not change (multi-process mode)
+    bump_generation("fernet_keys")
+
+def prepare(args, key_path, keys):
+    if len(keys) > 1:
+        print(f"The key file already holds {len(keys)} keys; finish the previous rotation (reencrypt, retire) first.")
         sys.exit(1)
-    backup_file(fernet_path)
-    old_key = open(fernet_path, "rb").read().strip()
-    old_fernet = Fernet(old_key)
-    new_key = Fernet.generate_key()
-    new_fernet = Fernet(new_key)
-    # Optionally backup DB
-    if "--db-backup" in sys.argv:
+    backup_file(key_path)
+    if args.db_backup:
         db_path = os.getenv("DATABASE_URL", "sqlite:///./pushgate.db").replace("sqlite:///", "")
         if os.path.exists(db_path):
             backup_file(db_path)
+    new_key = Fernet.generate_key()
+    publish_keys(key_path, [new_key] + keys)
+    print(f"New primary key {key_fingerprint(new_key)} written to {key_path}; old key {key_fingerprint(keys[0])} kept for decryption.")
+    print("Next: tools/rotate_fernet_key.py reencrypt")
+
+def reencrypt(args, key_path, keys):
+    if len(keys) < 2:
+        print("Only one key in the key file; nothing to re-encrypt from. Run 'prepare' first.")
+        return
+    # Every worker must know the new key before rows start depending on it
+    wait = args.grace - (time.time() - os.path.getmtime(key_path))
+    if wait > 0:
+        print(f"Waiting {wait:.1f}s for running workers to load the new key...")
+        time.sleep(wait)
+    checkpoint = Checkpoint(checkpoint_path(key_path), keys[0])
+
+    def progress(table, last_id, rewritten, failed):
+        print(f"  {table}: through id {last_id}, {rewritten} rewritten, {failed} undecryptable")
+
     db = SessionLocal()
-    # Rotate tokens
-    for t in db.query(Token).all():
-        try:
-            plain = old_fernet.decrypt(t.encrypted_token.encode()).decode()
-            t.encrypted_token = new_fernet.encrypt(plain.encode()).decode()
-        except Exception as e:
-            print(f"Token ID {t.id} decryption failed: {e}")
-    # Rotate pushover configs
-    for c in db.query(PushoverConfig).all():
-        try:
-            app_token = old_fernet.decrypt(c.encrypted_app_token.encode()).decode()
-            user_key = old_fernet.decrypt(c.encrypted_user_key.encode()).decode()
-            c.encrypted_app_token = new_fernet.encrypt(app_token.encode()).decode()
-            c.encrypted_user_key = new_fernet.encrypt(user_key.encode()).decode()
-        except Exception as e:
-            print(f"PushoverConfig ID {c.id} decryption failed: {e}")
-    # Rotate admin password
-    for a in db.query(AdminSettings).all():
-        try:
-            pw = old_fernet.decrypt(a.encrypted_password.encode()).decode()
-            a.encrypted_password = new_fernet.encrypt(pw.encode()).decode()
-        except Exception as e:
-            print(f"AdminSettings ID {a.id} decryption failed: {e}")
-    db.commit()
-    db.close()
-    # Overwrite Fernet key file
-    with open(fernet_path, "wb") as f:
-        f.write(new_key)
-    print(f"Fernet key rotated and all secrets re-encrypted. New key written to {fernet_path}.")
-    print("Restart Pushgate to use the new key.")
+    try:
+        results = reencrypt_all(db, keys, checkpoint=checkpoint, batch_size=args.batch_size, on_batch=progress)
+    finally:
+        db.close()
+    failed = sum(f for _, f in results.values())
+    for table, (rewritten, table_failed) in results.items():
+        print(f"{table}: {rewritten} rewritten, {table_failed} could not be decrypted with any key")
+    if failed:
+        print("Some values could not be decrypted; they will block 'retire' until fixed or deleted.")
+        sys.exit(1)
+    print("All values are under the new key. Next: tools/rotate_fernet_key.py retire")
+
+def retire(args, key_path, keys):
+    if len(keys) < 2:
+        print("Only one key in the key file; nothing to retire.")
+        return
+    db = SessionLocal()
+    try:
+        pending = count_not_current(db, keys[0], batch_size=args.batch_size)
+    finally:
+        db.close()
+    if any(pending.values()) and not args.force:
+        print(f"Values still depend on an old key: {pending}. Run 'reencrypt' again (or pass --force to drop them).")
+        sys.exit(1)
+    backup_file(key_path)
+    publish_keys(key_path, keys[:1])
+    Checkpoint(checkpoint_path(key_path), keys[0]).remove()
+    print(f"Retired {len(keys) - 1} old key(s); {key_path} now holds only {key_fingerprint(keys[0])}.")
+    print(f"The old key file is kept at {key_path}.bak; delete it once you no longer need to restore a backup made before the rotation.")
+
+def status(args, key_path, keys):
+    print(f"Key file {key_path}: primary {key_fingerprint(keys[0])}" + (f", older {', '.join(key_fingerprint(k) for k in keys[1:])}" if len(keys) > 1 else ""))
+    checkpoint = Checkpoint(checkpoint_path(key_path), keys[0])
+    if checkpoint.done:
+        print(f"Checkpoint: {checkpoint.done}")
+    db = SessionLocal()
+    try:
+        pending = count_not_current(db, keys[0], batch_size=args.batch_size)
+    finally:
+        db.close()
+    print(f"Values not yet under the primary key: {pending}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Online Fernet key rotation for Pushgate.")
+    parser.add_argument("step", choices=["prepare", "reencrypt", "retire", "status"])
+    parser.add_argument("--secrets-dir", default=DEFAULT_SECRETS_DIR)
+    parser.add_argument("--key-file", default=None, help="Path to the key file (default: SECRETS_DIR/fernet_key)")
+    parser.add_argument("--batch-size", type=int, default=500, help="Rows per transaction")
+    parser.add_argument("--grace", type=float, default=max(5.0, 3 * FERNET_KEY_CHECK_INTERVAL), help="Seconds the new key must have been in place before re-encrypting")
+    parser.add_argument("--db-backup", action="store_true", help="prepare: also copy the SQLite database file")
+    parser.add_argument("--force", action="store_true", help="retire: drop old keys even if some values still need them")
+    args = parser.parse_args()
+    print("--- Pushgate Fernet Key Rotation ---")
+    key_path = args.key_file or os.path.join(args.secrets_dir, FERNET_KEY_FILENAME)
+    if not os.path.exists(key_path):
+        print(f"Fernet key file not found: {key_path}")
+        sys.exit(1)
+    keys = read_key_file(key_path)
+    if not keys:
+        print(f"Fernet key file {key_path} contains no keys")
+        sys.exit(1)
+    {"prepare": prepare, "reencrypt": reencrypt, "retire": retire, "status": status}[args.step](args, key_path, keys)
 
 if __name__ == "__main__":
     main()